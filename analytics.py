@@ -0,0 +1,276 @@
+from datetime import date
+
+import numpy as np
+
+from db import DB_PATH, get_data_version
+from inventory_data import cached_per_version, current_stock
+from pagination import decode_cursor, encode_cursor, keyset_page
+
+# Сколько месяцев истории (включая текущий) загружается для аналитики
+ANALYTICS_MONTHS = 36
+# Границы ABC по накопленной доле выручки
+ABC_LIMITS = (0.80, 0.95)
+# Границы XYZ по коэффициенту вариации недельного спроса
+XYZ_LIMITS = (0.5, 1.0)
+# Класс XYZ товара без продаж за период
+NO_DEMAND = "-"
+# За сколько последних дней считаем скорость продаж для дней покрытия
+COVER_VELOCITY_DAYS = 30
+
+SKU_SORTS = ("revenue", "sold", "turnover", "sell_through", "days_of_cover", "cv", "name")
+
+
+def _month_start(day, months_back=0):
+    month_index = day.year * 12 + day.month - 1 - months_back
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+class AnalyticsData:
+    """
+    Таблицы sales, prihod и stock_data в виде массивов по товарам:
+    sales — продажи в штуках по дням (от start до вчера включительно),
+    revenue, received — выручка и приходы по месяцам, stock_days — сумма
+    дневных остатков за месяц, opening — остаток на 1-е число месяца,
+    stock — фактический остаток сейчас.
+    """
+
+    def __init__(self, products, months, month_offsets, start, today, version, sales, revenue, received,
+                 stock_days, opening, stock):
+        self.products = products
+        self.row = {name: position for position, name in enumerate(products)}
+        self.months = months
+        self.month_offsets = month_offsets
+        self.start = start
+        self.today = today
+        self.version = version
+        self.sales = sales
+        self.revenue = revenue
+        self.received = received
+        self.stock_days = stock_days
+        self.opening = opening
+        self.stock = stock
+
+
+# Функция для загрузки массивов аналитики из базы
+def load_analytics_data(conn, today=None, months_count=ANALYTICS_MONTHS):
+    today = today or date.today()
+    start = _month_start(today, months_count - 1)
+    month_starts = [_month_start(today, back) for back in range(months_count - 1, -1, -1)]
+    months = [month.strftime("%Y-%m") for month in month_starts]
+    month_column = {month: position for position, month in enumerate(months)}
+    version = get_data_version(conn)[0]
+    period = {"start": start.isoformat(), "end": today.isoformat()}
+
+    # Период покрывает почти всю историю: полный проход по таблице быстрее,
+    # чем поиск каждой строки через индекс по дате
+    daily = conn.execute('''
+        SELECT product, substr(date, 1, 10), SUM(quantity), SUM(quantity * price)
+        FROM sales NOT INDEXED
+        WHERE date >= :start AND date < :end
+        GROUP BY product, substr(date, 1, 10)
+    ''', period).fetchall()
+    received_rows = conn.execute('''
+        SELECT product, substr(date, 1, 7), SUM(quantity)
+        FROM prihod
+        WHERE date >= :start AND date < :end
+        GROUP BY product, substr(date, 1, 7)
+    ''', period).fetchall()
+    stock_rows = conn.execute('''
+        SELECT product_name, substr(start_date_str, 1, 7), SUM(stock_quantity),
+               SUM(CASE WHEN substr(start_date_str, 9, 2) = '01' THEN stock_quantity END)
+        FROM stock_data NOT INDEXED
+        WHERE start_date_str >= :start AND start_date_str < :end
+        GROUP BY product_name, substr(start_date_str, 1, 7)
+    ''', period).fetchall()
+    stock, _ = current_stock(conn)
+
+    products = sorted({row[0] for row in daily} | {row[0] for row in received_rows}
+                      | {row[0] for row in stock_rows} | set(stock))
+    positions = {name: position for position, name in enumerate(products)}
+    shape = (len(products), len(months))
+
+    sales = np.zeros((len(products), (today - start).days), dtype=np.float32)
+    revenue = np.zeros(shape)
+    if daily:
+        rows = np.fromiter((positions[row[0]] for row in daily), dtype=np.intp, count=len(daily))
+        days = np.fromiter(((date.fromisoformat(row[1]) - start).days for row in daily),
+                           dtype=np.intp, count=len(daily))
+        columns = np.fromiter((month_column[row[1][:7]] for row in daily), dtype=np.intp, count=len(daily))
+        np.add.at(sales, (rows, days), [row[2] or 0 for row in daily])
+        np.add.at(revenue, (rows, columns), [row[3] or 0 for row in daily])
+
+    received = np.zeros(shape)
+    for product, month, quantity in received_rows:
+        received[positions[product], month_column[month]] += quantity or 0
+
+    stock_days = np.zeros(shape)
+    opening = np.zeros(shape)
+    for product, month, total, first_day in stock_rows:
+        stock_days[positions[product], month_column[month]] = total or 0
+        opening[positions[product], month_column[month]] = first_day or 0
+
+    month_offsets = [(month - start).days for month in month_starts]
+    stock_array = np.array([max(stock.get(name, 0), 0) for name in products], dtype=float)
+    return AnalyticsData(products, months, month_offsets, start, today, version, sales, revenue, received,
+                         stock_days, opening, stock_array)
+
+
+def get_analytics_data(db_path=DB_PATH):
+    return cached_per_version("analytics", load_analytics_data, db_path)
+
+
+# Функция для расчёта показателей по всем SKU за последние months месяцев
+def compute_metrics(data, months=12):
+    """
+    Период — последние months месяцев, включая текущий (по вчерашний день).
+    ABC — по накопленной доле выручки, XYZ — по вариации недельных продаж,
+    оборачиваемость — продажи / средний остаток, sell-through — продажи /
+    (остаток на начало периода + приходы), дни покрытия — остаток / скорость
+    продаж за COVER_VELOCITY_DAYS дней.
+    """
+    months = min(max(int(months), 1), len(data.months))
+    first_day = data.month_offsets[-months]
+    period_days = max(data.sales.shape[1] - first_day, 1)
+
+    window = data.sales[:, first_day:]
+    sold = window.sum(axis=1, dtype=np.float64)
+    revenue = data.revenue[:, -months:].sum(axis=1)
+    received = data.received[:, -months:].sum(axis=1)
+    average_stock = data.stock_days[:, -months:].sum(axis=1) / period_days
+    available = data.opening[:, -months] + received
+
+    # ABC: товар попадает в класс по доле выручки всех товаров перед ним
+    order = np.argsort(-revenue, kind="stable")
+    total_revenue = revenue.sum()
+    share_before = np.zeros(len(revenue))
+    if total_revenue > 0:
+        share_before[order] = (np.cumsum(revenue[order]) - revenue[order]) / total_revenue
+    abc = np.where(share_before < ABC_LIMITS[0], "A", np.where(share_before < ABC_LIMITS[1], "B", "C"))
+    abc[revenue <= 0] = "C"
+
+    # XYZ: недели считаются от конца периода, неполная неделя в начале отбрасывается
+    weeks_count = window.shape[1] // 7
+    weeks = window[:, window.shape[1] - weeks_count * 7:].reshape(len(data.products), weeks_count, 7)
+    weeks = weeks.sum(axis=2, dtype=np.float64)
+    if weeks.shape[1]:
+        weekly_mean, weekly_std = weeks.mean(axis=1), weeks.std(axis=1)
+    else:
+        weekly_mean = weekly_std = np.zeros(len(data.products))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv = np.where(weekly_mean > 0, weekly_std / weekly_mean, np.nan)
+        turnover = np.where(average_stock > 0, sold / average_stock, np.nan)
+        sell_through = np.where(available > 0, sold / available, np.nan)
+        velocity = data.sales[:, -COVER_VELOCITY_DAYS:].sum(axis=1, dtype=np.float64) / COVER_VELOCITY_DAYS
+        days_of_cover = np.where(velocity > 0, data.stock / velocity, np.nan)
+    # Без спроса вариация не определена: такой товар не X, не Y и не Z
+    xyz = np.where(cv <= XYZ_LIMITS[0], "X", np.where(cv <= XYZ_LIMITS[1], "Y", "Z"))
+    xyz[np.isnan(cv)] = NO_DEMAND
+
+    return {
+        "period_start": data.months[-months],
+        "revenue": revenue,
+        "revenue_share": revenue / total_revenue if total_revenue > 0 else np.zeros(len(revenue)),
+        "sold": sold,
+        "received": received,
+        "average_stock": average_stock,
+        "stock": data.stock,
+        "abc": abc,
+        "xyz": xyz,
+        "cv": cv,
+        "turnover": turnover,
+        "sell_through": sell_through,
+        "days_of_cover": days_of_cover,
+    }
+
+
+def _number(value, digits=3):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def _sku_row(data, metrics, position):
+    return {
+        "product_name": data.products[position],
+        "abc": str(metrics["abc"][position]),
+        "xyz": None if metrics["xyz"][position] == NO_DEMAND else str(metrics["xyz"][position]),
+        "revenue": round(float(metrics["revenue"][position]), 2),
+        "revenue_share": round(float(metrics["revenue_share"][position]), 5),
+        "sold": _number(metrics["sold"][position], 2),
+        "received": _number(metrics["received"][position], 2),
+        "stock": _number(metrics["stock"][position], 2),
+        "average_stock": _number(metrics["average_stock"][position], 2),
+        "cv": _number(metrics["cv"][position]),
+        "turnover": _number(metrics["turnover"][position]),
+        "sell_through": _number(metrics["sell_through"][position]),
+        "days_of_cover": _number(metrics["days_of_cover"][position], 1),
+    }
+
+
+# Функция для выборки показателей SKU с фильтрами, сортировкой и курсором
+def query_skus(months=12, abc=None, xyz=None, q=None, in_stock=False, sort="revenue", order="desc",
+               limit=50, cursor=None, data=None):
+    """
+    abc / xyz — допустимые классы строкой ("AB", "X"), q — подстрока названия,
+    in_stock — только товары с остатком. Товары без спроса (xyz None)
+    в фильтр xyz не попадают. Возвращает {"period_start", "items",
+    "total", "next_cursor"}.
+    """
+    if sort not in SKU_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(SKU_SORTS)}")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+
+    data = data or get_analytics_data()
+    metrics = compute_metrics(data, months)
+
+    mask = np.ones(len(data.products), dtype=bool)
+    if abc:
+        mask &= np.isin(metrics["abc"], list(abc.upper()))
+    if xyz:
+        mask &= np.isin(metrics["xyz"], [letter for letter in xyz.upper() if letter in "XYZ"])
+    if in_stock:
+        mask &= metrics["stock"] > 0
+    positions = np.flatnonzero(mask)
+    if q:
+        q = q.casefold()
+        positions = [position for position in positions if q in data.products[position].casefold()]
+
+    def key(position):
+        name = data.products[position]
+        value = name.casefold() if sort == "name" else float(metrics[sort][position])
+        # Пустые значения (нет продаж, нет остатка) считаются наименьшими
+        if sort != "name" and np.isnan(value):
+            return (0, None, name)
+        return (1, value, name)
+
+    ordered = sorted(((key(position), position) for position in positions), key=lambda pair: pair[0])
+    page, next_key = keyset_page([position for _, position in ordered], [key for key, _ in ordered],
+                                 decode_cursor(cursor), limit, descending=order == "desc")
+    return {
+        "period_start": metrics["period_start"],
+        "items": [_sku_row(data, metrics, position) for position in page],
+        "total": len(ordered),
+        "next_cursor": encode_cursor(next_key) if next_key else None,
+    }
+
+
+# Функция для сводной матрицы ABC × XYZ: число SKU и доля выручки в каждой клетке
+def abc_xyz_matrix(months=12, data=None):
+    data = data or get_analytics_data()
+    metrics = compute_metrics(data, months)
+    cells = {}
+    for abc_class in "ABC":
+        for xyz_class in "XYZ":
+            mask = (metrics["abc"] == abc_class) & (metrics["xyz"] == xyz_class)
+            cells[abc_class + xyz_class] = {
+                "sku": int(mask.sum()),
+                "revenue": round(float(metrics["revenue"][mask].sum()), 2),
+                "revenue_share": round(float(metrics["revenue_share"][mask].sum()), 5),
+                "stock": round(float(metrics["stock"][mask].sum()), 2),
+            }
+    # Товары без спроса за период не входят ни в одну клетку
+    no_demand = metrics["xyz"] == NO_DEMAND
+    return {
+        "period_start": metrics["period_start"],
+        "cells": cells,
+        "no_demand": {"sku": int(no_demand.sum()), "stock": round(float(metrics["stock"][no_demand].sum()), 2)},
+    }
@@ -0,0 +1,289 @@
+"""
+Локальная заглушка API МойСклад для бенчмарков экспортёров без обращения
+к реальному аккаунту.
+
+    python bench/fake_moysklad.py --port 8091 --skus 2000 --days 31 --latency 0.05 --throttle 0.02
+    MOYSKLAD_BASE_URL=http://127.0.0.1:8091/api/remap/1.2/ python -c "import sales_actual; ..."
+
+Отдаёт то, что читают sales_actual, prihod_actual и stock_actual:
+entity/retaildemand и entity/supply (фильтр moment>= / updated>=, limit,
+offset), их positions, товары и сотрудников по href и report/stock/all.
+Остальные документы, меняющие остаток (возвраты, списания, перемещения...),
+отдаются пустыми списками.
+Данные детерминированы (зависят только от --seed), названия товаров
+совпадают с bench/generate_db.py. Каждый ответ задерживается на --latency
+секунд, доля --throttle запросов получает 429 с X-Lognex-Retry-TimeInterval.
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = "/api/remap/1.2/"
+# Часы, в которые магазин пробивает чеки и принимает поставки
+WORKING_HOURS = (9, 21)
+
+_NAMESPACE = uuid.UUID("6f1c1e5e-4a53-4c38-9a53-8d0f7d7c2b10")
+_ROUTES = [
+    ("documents", re.compile(r"^entity/(retaildemand|supply|demand|retailsalesreturn|salesreturn|purchasereturn"
+                             r"|enter|loss|move|processing)$")),
+    ("positions", re.compile(r"^entity/(retaildemand|supply)/([0-9a-f-]{36})/positions$")),
+    ("product", re.compile(r"^entity/product/([0-9a-f-]{36})$")),
+    ("employee", re.compile(r"^entity/employee/([0-9a-f-]{36})$")),
+    ("counterparty", re.compile(r"^entity/counterparty/([0-9a-f-]{36})$")),
+    ("stock", re.compile(r"^report/stock/all$")),
+]
+
+
+def _entity_id(kind, index):
+    return str(uuid.uuid5(_NAMESPACE, f"{kind}-{index}"))
+
+
+def product_name(index):
+    return f"Товар {index:05d}"
+
+
+def _parse_filter(value):
+    """'organization=...;moment>=2024-06-01 00:00:00' -> [(поле, оператор, значение)]"""
+    conditions = []
+    for part in (value or "").split(";"):
+        match = re.match(r"^(\w+)(>=|<=|=)(.*)$", part)
+        if match:
+            conditions.append(match.groups())
+    return conditions
+
+
+class FakeStore:
+    """
+    Детерминированный набор документов за последние days дней:
+    documents_per_day чеков и supplies_per_day поставок в день, в каждом
+    до max_positions позиций. Позиции и остатки считаются при запросе.
+    """
+
+    def __init__(self, base_url, skus=2000, days=31, documents_per_day=200, supplies_per_day=5,
+                 max_positions=5, employees=8, suppliers=20, seed=1):
+        self.base_url = base_url
+        self.skus = skus
+        self.max_positions = max_positions
+        self.employees = employees
+        self.suppliers = suppliers
+        self.seed = seed
+        self.product_index = {_entity_id("product", index): index for index in range(skus)}
+        self.employee_index = {_entity_id("employee", index): index for index in range(employees)}
+        self.supplier_index = {_entity_id("counterparty", index): index for index in range(suppliers)}
+        self.documents = {
+            "retaildemand": self._make_documents("retaildemand", days, documents_per_day),
+            "supply": self._make_documents("supply", days, supplies_per_day),
+        }
+        self.document_index = {
+            document["id"]: (entity, position)
+            for entity, documents in self.documents.items()
+            for position, document in enumerate(documents)
+        }
+
+    def href(self, path):
+        return self.base_url + path
+
+    def _make_documents(self, entity, days, per_day):
+        rng = random.Random(f"{self.seed}-{entity}")
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        prefix = "ПР" if entity == "retaildemand" else "ПО"
+        documents = []
+        for back in range(days - 1, -1, -1):
+            day = today - timedelta(days=back)
+            for _ in range(per_day):
+                seconds = rng.randrange(WORKING_HOURS[0] * 3600, WORKING_HOURS[1] * 3600)
+                moment = (day + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S.000")
+                documents.append({"moment": moment})
+        documents.sort(key=lambda document: document["moment"])
+        for position, document in enumerate(documents):
+            document["id"] = _entity_id(entity, position)
+            document["name"] = f"{prefix}-{position + 1:06d}"
+            document["position"] = position
+        return documents
+
+    def positions(self, entity, position):
+        rng = random.Random(f"{self.seed}-{entity}-{position}")
+        count = rng.randint(1, self.max_positions)
+        rows = []
+        for product in sorted({int(self.skus * rng.random() ** 2) for _ in range(count)}):
+            quantity = rng.randint(1, 3) if entity == "retaildemand" else rng.randint(10, 50)
+            price = (500 + product % 97 * 100) * 100
+            rows.append({
+                "meta": {"type": "retailposition" if entity == "retaildemand" else "supplyposition"},
+                "quantity": quantity,
+                "price": price if entity == "retaildemand" else price * 6 // 10,
+                "assortment": {"meta": {"href": self.href(f"entity/product/{_entity_id('product', product)}"),
+                                        "type": "product"}},
+            })
+        return rows
+
+    def document_json(self, entity, document):
+        rows = self.positions(entity, document["position"])
+        item = {
+            "meta": {"href": self.href(f"entity/{entity}/{document['id']}"), "type": entity},
+            "id": document["id"],
+            "name": document["name"],
+            "moment": document["moment"],
+            "updated": document["moment"],
+            "sum": sum(row["quantity"] * row["price"] for row in rows),
+            "positions": {"meta": {"href": self.href(f"entity/{entity}/{document['id']}/positions"),
+                                   "size": len(rows)}},
+        }
+        if entity == "retaildemand":
+            employee = _entity_id("employee", document["position"] % self.employees)
+            item["owner"] = {"meta": {"href": self.href(f"entity/employee/{employee}"), "type": "employee"}}
+        else:
+            supplier = document["position"] % self.suppliers
+            item["agent"] = {"meta": {"href": self.href(f"entity/counterparty/{_entity_id('counterparty', supplier)}"),
+                                      "type": "counterparty"},
+                             "name": f"Поставщик {supplier:03d}"}
+        return item
+
+    def list_documents(self, entity, params):
+        documents = self.documents.get(entity, [])
+        for field, operator, value in _parse_filter(params.get("filter")):
+            if field in ("moment", "updated") and operator == ">=":
+                documents = [document for document in documents if document["moment"] >= value]
+        return self._page([self.document_json(entity, document) for document in
+                           self._slice(documents, params)], len(documents), params)
+
+    def stock_report(self, params):
+        day = next((value for field, _, value in _parse_filter(params.get("filter")) if field == "moment"), "")
+        rows = []
+        for product in self._slice(range(self.skus), params):
+            rng = random.Random(f"{self.seed}-stock-{product}-{day[:10]}")
+            rows.append({"name": product_name(product), "code": f"{product:05d}", "stock": rng.randint(-2, 60)})
+        return self._page(rows, self.skus, params)
+
+    @staticmethod
+    def _slice(items, params):
+        limit = min(int(params.get("limit", 1000)), 1000)
+        offset = int(params.get("offset", 0))
+        return items[offset:offset + limit]
+
+    @staticmethod
+    def _page(rows, size, params):
+        return {"meta": {"size": size, "limit": int(params.get("limit", 1000)),
+                         "offset": int(params.get("offset", 0))}, "rows": rows}
+
+
+class FakeMoySkladHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят отдельными записями — без Nagle они не ждут ACK клиента
+    disable_nagle_algorithm = True
+    latency = 0.0
+    throttle = 0.0
+    retry_interval_ms = 100
+    stats = {}
+    stats_lock = Lock()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else None
+
+        time.sleep(self.latency)
+        if self.throttle and random.random() < self.throttle:
+            self._count("throttled")
+            self._reply(429, {"errors": [{"error": "Превышено ограничение на количество запросов", "code": 1049}]},
+                        {"X-Lognex-Retry-TimeInterval": str(self.retry_interval_ms)})
+            return
+
+        store = self.server.store
+        for route, pattern in _ROUTES:
+            match = pattern.match(path or "")
+            if match:
+                break
+        else:
+            self._count("not_found")
+            self._reply(404, {"errors": [{"error": f"unknown path {url.path}"}]})
+            return
+
+        self._count(route)
+        if route == "documents":
+            payload = store.list_documents(match.group(1), params)
+        elif route == "positions":
+            entity, position = store.document_index.get(match.group(2), (None, None))
+            if entity != match.group(1):
+                self._reply(404, {"errors": [{"error": "document not found"}]})
+                return
+            rows = store.positions(entity, position)
+            payload = {"meta": {"size": len(rows), "limit": 1000, "offset": 0}, "rows": rows}
+        elif route == "product":
+            index = store.product_index.get(match.group(1))
+            if index is None:
+                self._reply(404, {"errors": [{"error": "product not found"}]})
+                return
+            payload = {"meta": {"href": store.href(f"entity/product/{match.group(1)}"), "type": "product"},
+                       "id": match.group(1), "name": product_name(index), "code": f"{index:05d}",
+                       "updated": "2024-01-01 00:00:00.000"}
+        elif route == "employee":
+            index = store.employee_index.get(match.group(1), 0)
+            payload = {"id": match.group(1), "name": f"Продавец {index:02d}", "updated": "2024-01-01 00:00:00.000"}
+        elif route == "counterparty":
+            index = store.supplier_index.get(match.group(1), 0)
+            payload = {"id": match.group(1), "name": f"Поставщик {index:03d}"}
+        else:
+            payload = store.stock_report(params)
+        self._reply(200, payload)
+
+    @classmethod
+    def _count(cls, route):
+        with cls.stats_lock:
+            cls.stats[route] = cls.stats.get(route, 0) + 1
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        encoding = None
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            data, encoding = gzip.compress(data, compresslevel=1), "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8091, latency=0.0, throttle=0.0, **store_options):
+    """Создаёт сервер (port=0 — свободный порт); base_url для MOYSKLAD_BASE_URL — в server.base_url."""
+    FakeMoySkladHandler.latency = latency
+    FakeMoySkladHandler.throttle = throttle
+    FakeMoySkladHandler.stats = {}
+    server = ThreadingHTTPServer((host, port), FakeMoySkladHandler)
+    server.daemon_threads = True
+    server.base_url = f"http://{host}:{server.server_address[1]}{API_PREFIX}"
+    server.store = FakeStore(server.base_url, **store_options)
+    print(f"fake_moysklad: {server.base_url}, задержка {latency} с, доля 429 {throttle}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--skus", type=int, default=2000, help="число товаров")
+    parser.add_argument("--days", type=int, default=31, help="за сколько дней есть документы")
+    parser.add_argument("--documents-per-day", type=int, default=200, help="чеков в день")
+    parser.add_argument("--supplies-per-day", type=int, default=5, help="поставок в день")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка каждого ответа, секунд")
+    parser.add_argument("--throttle", type=float, default=0.0, help="доля запросов, получающих 429")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.latency, args.throttle, skus=args.skus, days=args.days,
+          documents_per_day=args.documents_per_day, supplies_per_day=args.supplies_per_day,
+          seed=args.seed).serve_forever()
@@ -0,0 +1,80 @@
+"""
+Локальная заглушка OpenAI Chat Completions для проверки очереди прогнозов
+без реальных запросов к API.
+
+    python bench/fake_openai.py --port 8090 --delay 3
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 OPENAI_API_KEY=fake python my_sclad_api.py
+
+На POST /v1/chat/completions отвечает после паузы --delay секунд
+фиксированным прогнозом в формате, который ожидает gpt_api.
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    requests_served = 0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._reply(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        time.sleep(self.delay)
+        type(self).requests_served += 1
+        prompt = "".join(message.get("content", "") for message in body.get("messages", []))
+        forecast = {
+            "recommended_order_date": (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d"),
+            "recommended_quantity": 10,
+            "justification": f"fake forecast, prompt {len(prompt)} chars",
+        }
+        self._reply(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "```json\n" + json.dumps(forecast) + "\n```"},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 3,
+                "completion_tokens": 40,
+                "total_tokens": len(prompt) // 3 + 40,
+            },
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"fake_openai: {format % args}")
+
+
+def serve(host="127.0.0.1", port=8090, delay=0.0):
+    FakeOpenAIHandler.delay = delay
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    print(f"fake_openai: http://{host}:{port}/v1, задержка ответа {delay} с")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=2.0, help="пауза перед ответом, секунд")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.delay).serve_forever()
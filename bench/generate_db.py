@@ -0,0 +1,115 @@
+"""
+Генератор синтетической sales_data.db для бенчмарков: N товаров × M дней
+истории продаж, приходов и ежедневных остатков в схеме последней миграции.
+
+    python bench/generate_db.py /tmp/bench/sales_data.db --skus 2000 --days 365
+
+Спрос по товарам неравномерный (немного хитов и длинный хвост), с недельной
+сезонностью; продажи собраны в чеки, остаток уменьшается продажами и
+пополняется поставками, когда опускается ниже точки заказа. Названия
+товаров совпадают с bench/fake_moysklad.py. Результат зависит только от --seed.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import bump_data_version, connect, ensure_schema, run_write  # noqa: E402
+from summary import refresh_monthly_summary  # noqa: E402
+
+# Во сколько чеков в день складываются продажи и сколько у магазина поставщиков
+DOCUMENTS_PER_DAY = 200
+SUPPLIERS = 20
+SELLERS = 8
+# Множители спроса по дням недели, с понедельника
+WEEKDAY_DEMAND = (0.9, 0.9, 0.95, 1.0, 1.15, 1.3, 0.8)
+
+
+def product_name(index):
+    return f"Товар {index:05d}"
+
+
+def generate(db_path, skus=2000, days=365, seed=1, today=None):
+    """
+    Заполняет базу db_path (таблицы должны быть пусты или отсутствовать)
+    историей за days дней до вчера включительно. Возвращает число строк
+    по таблицам.
+    """
+    ensure_schema(db_path)
+    rng = np.random.default_rng(seed)
+    today = today or date.today()
+    first_day = today - timedelta(days=days)
+
+    rates = rng.gamma(0.4, 1.5, skus)
+    prices = (500 + np.arange(skus) % 97 * 100).astype(int)
+    cover_days = rng.integers(14, 45, skus)
+    stock = np.ceil(rates * cover_days).astype(int)
+    names = [product_name(index) for index in range(skus)]
+    codes = [f"{index:05d}" for index in range(skus)]
+
+    sales, prihod, stock_rows = [], [], []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        day_text = day.isoformat()
+
+        # Снимок остатков — на начало дня, как в report/stock/all
+        for index in np.flatnonzero(stock > 0):
+            stock_rows.append((names[index], codes[index], int(stock[index]), day_text))
+
+        demand = rng.poisson(rates * WEEKDAY_DEMAND[day.weekday()])
+        sold = np.minimum(demand, np.maximum(stock, 0))
+        documents = rng.integers(0, DOCUMENTS_PER_DAY, skus)
+        for index in np.flatnonzero(sold):
+            document = int(documents[index])
+            moment = f"{day_text} {9 + document * 12 // DOCUMENTS_PER_DAY:02d}:{document % 60:02d}:00"
+            sales.append((f"ПР-{day.strftime('%y%m%d')}-{document:03d}", moment,
+                          f"Продавец {document % SELLERS:02d}", names[index], int(sold[index]),
+                          int(prices[index])))
+        stock -= sold
+
+        # Поставка приходит, когда запаса остаётся меньше чем на неделю
+        reorder = np.flatnonzero((stock < rates * 7) & (rates > 0.05))
+        for index in reorder:
+            quantity = int(np.ceil(rates[index] * cover_days[index]))
+            supplier = int(index % SUPPLIERS)
+            prihod.append((f"ПО-{day.strftime('%y%m%d')}-{supplier:03d}", f"{day_text} 18:00:00",
+                           f"Поставщик {supplier:03d}", names[index], quantity, int(prices[index] * 0.6)))
+            stock[index] += quantity
+
+    def write(conn):
+        conn.executemany('INSERT OR IGNORE INTO sales (document_number, date, seller, product, quantity, price) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', sales)
+        conn.executemany('INSERT OR IGNORE INTO prihod (document_number, date, supplier, product, quantity, price) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', prihod)
+        conn.executemany('INSERT OR IGNORE INTO stock_data (product_name, product_code, stock_quantity, '
+                         'start_date_str) VALUES (?, ?, ?, ?)', stock_rows)
+
+    run_write(write, db_path)
+    conn = connect(db_path)
+    try:
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+    refresh_monthly_summary(db_path=db_path)
+    bump_data_version(db_path)
+    return {"sales": len(sales), "prihod": len(prihod), "stock_data": len(stock_rows)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_path")
+    parser.add_argument("--skus", type=int, default=2000, help="число товаров")
+    parser.add_argument("--days", type=int, default=365, help="дней истории")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.db_path):
+        parser.error(f"{args.db_path} уже существует")
+    os.makedirs(os.path.dirname(os.path.abspath(args.db_path)), exist_ok=True)
+    started = time.monotonic()
+    counts = generate(args.db_path, args.skus, args.days, args.seed)
+    print(f"{args.db_path}: {counts}, {time.monotonic() - started:.1f} с")
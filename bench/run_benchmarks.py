@@ -0,0 +1,230 @@
+"""
+Воспроизводимые бенчмарки ETL и API без реального МойСклад и без /var/data.
+
+    python bench/run_benchmarks.py --skus 2000 --days 365 --sync-days 2
+    python bench/run_benchmarks.py --only http --requests 500 --json results.json
+
+Порядок: синтетическая база (bench/generate_db.py) в рабочем каталоге,
+заглушка МойСклад (bench/fake_moysklad.py) на свободном порту, затем группы:
+  json      — create_json_files: полная сборка и повтор без изменений;
+  http      — /summary и /files (в т.ч. с If-None-Match) через тестовый клиент Flask;
+  exporters — export_sales_data, export_prihod_data, run_products: полный
+              проход за --sync-days дней и повторный инкрементальный.
+Для каждого замера — пропускная способность и задержки p50/p99
+(запросов к МойСклад для экспортёров, ответов API для http).
+Экспортёры по умолчанию идут с настоящим лимитом 45 запросов / 3 с;
+--no-rate-limit снимает его, чтобы мерить сам код.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+GROUPS = ("json", "http", "exporters")
+
+
+def percentile(samples, share):
+    """Перцентиль по ближайшему рангу; None для пустой выборки."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(share * len(ordered) + 0.5)) - 1))]
+
+
+def result(name, seconds, count, unit, samples=(), **extra):
+    return {
+        "name": name,
+        "seconds": round(seconds, 3),
+        "count": count,
+        "throughput": round(count / seconds, 1) if seconds else None,
+        "unit": f"{unit}/s",
+        "p50_ms": None if not samples else round(percentile(samples, 0.50) * 1000, 2),
+        "p99_ms": None if not samples else round(percentile(samples, 0.99) * 1000, 2),
+        **extra,
+    }
+
+
+def print_results(results):
+    print(f"\n{'замер':<34}{'время, с':>10}{'объём':>10}{'в секунду':>20}{'p50, мс':>10}{'p99, мс':>10}")
+    for row in results:
+        throughput = f"{row['throughput']} {row['unit']}" if row["throughput"] is not None else "-"
+        p50 = "-" if row["p50_ms"] is None else row["p50_ms"]
+        p99 = "-" if row["p99_ms"] is None else row["p99_ms"]
+        print(f"{row['name']:<34}{row['seconds']:>10}{row['count']:>10}{throughput:>20}{p50:>10}{p99:>10}")
+
+
+# Функция для замера времени каждого HTTP-запроса клиента МойСклад
+def record_latency(session, samples):
+    original = session.get
+
+    def get(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    session.get = get
+
+
+def bench_exporters(server, sync_days, rate_limit):
+    from metrics import metrics
+    from moysklad_client import TokenBucket, get_client
+    from prihod_actual import export_prihod_data
+    from sales_actual import export_sales_data
+    from stock_actual import run_products
+
+    client = get_client()
+    if not rate_limit:
+        client.bucket = TokenBucket(capacity=10 ** 6, period=1.0)
+    samples = []
+    record_latency(client.session, samples)
+    start_date = (date.today() - timedelta(days=sync_days - 1)).isoformat()
+
+    exporters = [
+        ("sales", "sales", lambda full: export_sales_data(start_date, full=full)),
+        ("prihod", "prihod", lambda full: export_prihod_data(start_date, full=full)),
+        ("stock", "stock_data", lambda full: run_products(start_date, full=full)),
+    ]
+    results = []
+    for name, table, run in exporters:
+        for mode, full in (("full", True), ("incremental", False)):
+            samples.clear()
+            requests_before = sum(server.RequestHandlerClass.stats.values())
+            before = metrics.snapshot()
+            started = time.perf_counter()
+            run(full)
+            seconds = time.perf_counter() - started
+            after = metrics.snapshot()
+            key = f'etl_rows_written_total{{table="{table}"}}'
+            rows = after.get(key, 0) - before.get(key, 0)
+            results.append(result(
+                f"export {name} ({mode})", seconds, rows, "rows", samples,
+                requests=sum(server.RequestHandlerClass.stats.values()) - requests_before,
+                requests_per_second=round(len(samples) / seconds, 1) if seconds else None,
+            ))
+    return results
+
+
+def bench_json(repeat):
+    from server_for_analiz_gpt import create_json_files
+
+    started = time.perf_counter()
+    files = create_json_files()
+    results = [result("create_json_files (full build)", time.perf_counter() - started, len(files), "files")]
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        create_json_files()
+        samples.append(time.perf_counter() - started)
+    results.append(result("create_json_files (no changes)", sum(samples), len(samples), "runs", samples))
+    return results
+
+
+def bench_http(requests_count):
+    import my_sclad_api
+
+    client = my_sclad_api.app.test_client()
+    etag = client.get("/summary").headers.get("ETag")
+    files_etag = client.get("/files").headers.get("ETag")
+    cases = [
+        ("GET /summary", "/summary", {}),
+        ("GET /summary (If-None-Match)", "/summary", {"If-None-Match": etag} if etag else {}),
+        ("GET /files", "/files", {}),
+        ("GET /files (If-None-Match)", "/files", {"If-None-Match": files_etag} if files_etag else {}),
+        ("GET /files?sort=velocity&limit=50", "/files?sort=velocity&order=desc&limit=50", {}),
+        ("GET /files?q=0012&limit=50", "/files?q=0012&limit=50", {}),
+    ]
+    results = []
+    for name, url, headers in cases:
+        for _ in range(min(20, requests_count)):
+            client.get(url, headers=headers)
+        samples = []
+        statuses = set()
+        for _ in range(requests_count):
+            started = time.perf_counter()
+            response = client.get(url, headers=headers)
+            samples.append(time.perf_counter() - started)
+            statuses.add(response.status_code)
+        results.append(result(name, sum(samples), len(samples), "req", samples, statuses=sorted(statuses)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", help="каталог для базы и JSON (по умолчанию временный, удаляется)")
+    parser.add_argument("--skus", type=int, default=2000, help="число товаров")
+    parser.add_argument("--days", type=int, default=365, help="дней истории в сгенерированной базе")
+    parser.add_argument("--sync-days", type=int, default=2, help="за сколько дней экспортёры загружают документы")
+    parser.add_argument("--documents-per-day", type=int, default=200, help="чеков в день у заглушки МойСклад")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа заглушки, секунд")
+    parser.add_argument("--throttle", type=float, default=0.01, help="доля ответов 429 у заглушки")
+    parser.add_argument("--no-rate-limit", action="store_true", help="снять лимит 45 запросов / 3 с")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждый HTTP-замер")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов create_json_files без изменений")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"группы через запятую: {','.join(GROUPS)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+    groups = [group for group in args.only.split(",") if group]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="sclad-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, BENCH_DIR)
+    from fake_moysklad import serve
+
+    server = serve("127.0.0.1", 0, args.latency, args.throttle, skus=args.skus, days=max(args.sync_days, 31),
+                   documents_per_day=args.documents_per_day, seed=args.seed)
+    threading.Thread(target=server.serve_forever, name="fake_moysklad", daemon=True).start()
+
+    # Пути и адрес API читаются модулями при импорте — задаём их до первого импорта
+    os.environ["SALES_DB_PATH"] = os.path.join(workdir, "sales_data.db")
+    os.environ["PRODUCTS_JSON_DIR"] = os.path.join(workdir, "products_json")
+    os.environ["SCHEDULER_LOCK"] = os.path.join(workdir, "scheduler.lock")
+    os.environ["SCHEDULER_ENABLED"] = "0"
+    os.environ["MOYSKLAD_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+    from generate_db import generate
+
+    results = []
+    try:
+        if not os.path.exists(os.environ["SALES_DB_PATH"]):
+            started = time.perf_counter()
+            counts = generate(os.environ["SALES_DB_PATH"], args.skus, args.days, args.seed)
+            results.append(result("generate_db", time.perf_counter() - started, sum(counts.values()), "rows",
+                                  **counts))
+        # Экспортёры идут последними: сверка удалённых документов убирает из базы
+        # сгенерированные чеки последнего месяца, которых нет у заглушки
+        if "json" in groups:
+            results += bench_json(args.repeat)
+        if "http" in groups:
+            results += bench_http(args.requests)
+        if "exporters" in groups:
+            results += bench_exporters(server, args.sync_days, rate_limit=not args.no_rate_limit)
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    print(f"\nзапросы к заглушке МойСклад: {server.RequestHandlerClass.stats}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,38 @@
 import os
+import time
 import openai
 import json
 from datetime import datetime
 import urllib.parse
 
+from gpt_cache import forecast_cache, forecast_key
+from gpt_payload import TOKEN_BUDGET, build_history_payload
+from server_for_analiz_gpt import JSON_DIR_PATH
+
 
 # Подключаем OpenAI API
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-client = openai.OpenAI(api_key=openai.api_key)
+# OPENAI_BASE_URL позволяет направить запросы на локальный fake (bench/fake_openai.py)
+client = openai.OpenAI(api_key=openai.api_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
+
+GPT_MODEL = "gpt-4o-mini"
+# Версия формулировки запроса и формата данных — меняется вместе с ними
+PROMPT_VERSION = 2
 
 
-def gpt_api(file_name, dostavka, zapas):
-    """Загружает JSON-файл, передаёт его в GPT для анализа и получает ответ."""
+def gpt_api(file_name, dostavka, zapas, stats=None):
+    """
+    Загружает JSON-файл, сворачивает историю в компактный вид в пределах
+    бюджета токенов, передаёт в GPT для анализа и получает ответ.
+    Повторный запрос с тем же содержимым файла, параметрами и датой
+    отдаётся из кэша без обращения к модели.
+    Если передан словарь stats, в него пишутся токены, время запроса
+    и признак попадания в кэш (cached).
+    """
 
     file_name = urllib.parse.unquote(file_name)
-    file_name = f"/var/data/products_json/{file_name}"
+    file_name = os.path.join(JSON_DIR_PATH, file_name)
 
     # Проверяем, существует ли файл
     if not os.path.exists(file_name):
@@ -23,19 +40,33 @@ def gpt_api(file_name, dostavka, zapas):
         return
 
     # Загружаем данные из JSON
-    with open(file_name, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open(file_name, "rb") as f:
+        content = f.read()
 
     today = datetime.now().strftime("%Y-%m-%d")
+    cache_key = forecast_key(content, dostavka, zapas, GPT_MODEL, PROMPT_VERSION, today)
+    cached = forecast_cache.get(cache_key)
+    if stats is not None:
+        stats["cached"] = cached is not None
+    if cached is not None:
+        print(f"GPT: прогноз для {os.path.basename(file_name)} взят из кэша")
+        return cached
+
+    data = json.loads(content)
+    payload, payload_tokens = build_history_payload(data, token_budget=TOKEN_BUDGET, model=GPT_MODEL)
 
     # Новое описание задачи (User prompt)
     task_description = (
-        f"Сегодняшняя дата: {today}. Ниже приведён файл с историей приходов (prihod), продаж (sales) "
-        "и полем 'stock', которое может быть либо изначальным остатком, либо устаревшим значением. "
+        f"Сегодняшняя дата: {today}. Ниже приведена история приходов и продаж товара, сведённая в ряды "
+        "по месяцам (monthly), неделям (weekly) и дням (daily): у каждого ряда 'from' — начало первого периода, "
+        "'step' — длина периода, а массивы sold (продано), received (поступило), revenue (выручка) и "
+        "stock_end (stock_after на конец периода) идут по периодам подряд, пустые периоды — нули; "
+        "если есть массив 'days', в периоде столько дней данных, а не полный месяц или неделя. "
+        "Поле 'stock' может быть либо изначальным остатком, либо устаревшим значением. "
         "Твоя задача: 1) понять, каков фактический остаток к {today}, ориентируясь на данные транзакций; "
         "2) определить оптимальную дату (не в прошлом) и количество для следующего заказа у поставщика. "
         f"Срок поставки (lead time) ~{dostavka} дней, и мы обычно держим запас на {zapas} дней продаж. "
-        "Если в истории транзакций есть противоречия между 'stock' и 'stock_after', "
+        "Если в истории есть противоречия между 'stock' и 'stock_end', "
         f"используй логику, чтобы выяснить текущий остаток на {today}. "
         "Не заказывай прямо завтра, если остаток очень велик по сравнению со средней скоростью продаж. "
         "Учти, что может быть рост продаж (процентный или иной) от месяца к месяцу, если данные на это указывают. "
@@ -51,7 +82,7 @@ def gpt_api(file_name, dostavka, zapas):
     # Обновлённое системное сообщение (System prompt)
     system_message = (
         "Ты — опытный аналитик по управлению складскими запасами. "
-        "Твоя задача — на основе подробного лога приходов/продаж и поля 'stock' определить реальный остаток "
+        "Твоя задача — на основе истории приходов/продаж по периодам и поля 'stock' определить реальный остаток "
         f"к {today}, вычислить среднюю скорость продаж (учитывая динамику и всплески), "
         "и спрогнозировать, надо ли и когда заказывать следующую партию товара, а также в каком объёме. "
         f"Не указывай дату заказа, которая прошла (то есть раньше {today}). "
@@ -65,17 +96,32 @@ def gpt_api(file_name, dostavka, zapas):
     )
 
     # Формируем запрос к модели
+    started = time.monotonic()
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=GPT_MODEL,
         messages=[
             {"role": "system", "content": system_message},
             {"role": "user", "content": task_description},
             {
                 "role": "user",
-                "content": f"Данные в JSON-формате:\n{json.dumps(data, indent=2, ensure_ascii=False)}"
+                "content": f"Данные в JSON-формате:\n{payload}"
             }
         ]
     )
+    elapsed = time.monotonic() - started
+
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    print(f"GPT: история {payload_tokens} токенов, запрос {prompt_tokens}, ответ {completion_tokens}, "
+          f"{elapsed:.2f} с")
+    if stats is not None:
+        stats.update({
+            "payload_tokens": payload_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "elapsed": round(elapsed, 3),
+        })
 
     # Извлекаем ответ
     result = response.choices[0].message.content
@@ -84,4 +130,6 @@ def gpt_api(file_name, dostavka, zapas):
     # — уберём эти обёртки, чтобы на выходе был “чистый” JSON:
     result = result.replace("```json", "").replace("```", "")
 
+    if result.strip():
+        forecast_cache.put(cache_key, result, os.path.basename(file_name))
     return result
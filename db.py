@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import time
+from threading import Lock
+
+from metrics import metrics
+from migrations import migrate
+
+# Путь к базе данных SQLite (SALES_DB_PATH — для бенчмарков и локального запуска)
+DB_PATH = os.getenv("SALES_DB_PATH", '/var/data/sales_data.db')
+
+# Сколько раз повторяем запись, если база занята другим процессом
+WRITE_RETRIES = 10
+WRITE_RETRY_DELAY = 0.5
+
+# Базы, схема которых в этом процессе уже приведена к последней версии
+_migrated = set()
+_migrate_lock = Lock()
+
+
+# Функция для подключения к базе с ожиданием блокировки вместо мгновенной ошибки
+def connect(db_path=DB_PATH, check_same_thread=True):
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=check_same_thread)
+    # В режиме WAL NORMAL не теряет согласованность, но не делает fsync на каждый commit
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-32000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+# Функция для применения миграций один раз за процесс (вызывается при старте)
+def ensure_schema(db_path=DB_PATH):
+    if db_path in _migrated:
+        return
+    with _migrate_lock:
+        if db_path in _migrated:
+            return
+        conn = connect(db_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        _migrated.add(db_path)
+
+
+# Функция для выполнения записи в одной транзакции с ограниченными повторами
+def run_write(work, db_path=DB_PATH, retries=WRITE_RETRIES):
+    """
+    Вызывает work(conn) внутри транзакции и фиксирует её.
+    При блокировке базы повторяет с нарастающей паузой, после retries попыток
+    пробрасывает исключение, а не крутится бесконечно.
+    """
+    for attempt in range(1, retries + 1):
+        conn = connect(db_path)
+        try:
+            with metrics.timer('db_write_seconds'), conn:
+                return work(conn)
+        except sqlite3.OperationalError as e:
+            if attempt == retries:
+                raise
+            metrics.inc('db_write_retries_total')
+            print(f"Ошибка записи в базу данных: {e}. Повторная попытка {attempt}/{retries}...")
+            time.sleep(WRITE_RETRY_DELAY * attempt)
+        finally:
+            conn.close()
+
+
+# Функция для разворачивания документов страницы в строки таблицы
+def document_rows(documents):
+    for document_number, date, party, positions, document_id in documents:
+        for position in positions:
+            yield (document_number, date, party, position['product'], position['quantity'], position['price'],
+                   document_id)
+
+
+# Условие на строки документа: по id МойСклад, а строки, записанные до появления
+# колонки document_id, — только с тем же номером и той же датой
+DOCUMENT_ROWS_CONDITION = 'document_id = ? OR (document_id IS NULL AND document_number = ? AND date = ?)'
+
+
+# Функция для удаления прежних строк изменённых документов перед их перезаписью
+def delete_document_rows(conn, table, documents, touched_months=None):
+    """
+    Документ ищется по id, поэтому документ с тем же номером из другого года
+    или другой кассы не затрагивается. touched_months пополняется месяцами,
+    где документ был до изменения (дата могла смениться).
+    """
+    keys = [(document_id, document_number, date) for document_number, date, _, _, document_id in documents]
+    if touched_months is not None:
+        for key in keys:
+            touched_months.update(row[0] for row in conn.execute(
+                f'SELECT DISTINCT substr(date, 1, 7) FROM {table} WHERE {DOCUMENT_ROWS_CONDITION}', key
+            ))
+    conn.executemany(f'DELETE FROM {table} WHERE {DOCUMENT_ROWS_CONDITION}', keys)
+
+
+# Функция для чтения отметки последней синхронизации сущности
+def get_watermark(entity, db_path=DB_PATH):
+    ensure_schema(db_path)
+    conn = connect(db_path)
+    try:
+        row = conn.execute('SELECT watermark FROM sync_state WHERE entity = ?', (entity,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+# Функция для сохранения отметки синхронизации (только вперёд)
+def set_watermark(entity, watermark, db_path=DB_PATH):
+    if not watermark:
+        return
+    ensure_schema(db_path)
+
+    def write(conn):
+        conn.execute('''
+            INSERT INTO sync_state (entity, watermark, updated_at) VALUES (?, ?, datetime('now'))
+            ON CONFLICT(entity) DO UPDATE SET
+                watermark = MAX(watermark, excluded.watermark),
+                updated_at = excluded.updated_at
+        ''', (entity, watermark))
+
+    run_write(write, db_path)
+
+
+# Функция для удаления документов, которых больше нет в МойСклад
+def delete_missing_documents(table, existing_documents, since, db_path=DB_PATH):
+    """
+    Удаляет из table строки документов с датой >= since, которых нет
+    в existing_documents — парах (id, номер) из API за тот же период.
+    Документ сверяется по id; строки без document_id (записанные до
+    миграции 14) — по номеру.
+    """
+    existing_ids = {document_id for document_id, _ in existing_documents}
+    existing_names = {name for _, name in existing_documents}
+
+    def write(conn):
+        stored = conn.execute(
+            f'SELECT DISTINCT document_id, document_number FROM {table} WHERE date >= ?', (since,)
+        ).fetchall()
+        missing = [(document_id, name) for document_id, name in stored
+                   if (document_id not in existing_ids if document_id is not None else name not in existing_names)]
+        conn.executemany(
+            f'DELETE FROM {table} WHERE document_id = ? AND date >= ?',
+            [(document_id, since) for document_id, _ in missing if document_id is not None]
+        )
+        conn.executemany(
+            f'DELETE FROM {table} WHERE document_id IS NULL AND document_number = ? AND date >= ?',
+            [(name, since) for document_id, name in missing if document_id is None]
+        )
+        return len(missing)
+
+    return run_write(write, db_path)
+
+
+# Функция для отметки, что данные изменились (сбрасывает ETag читающих эндпоинтов)
+def bump_data_version(db_path=DB_PATH):
+    ensure_schema(db_path)
+
+    def write(conn):
+        conn.execute("UPDATE data_version SET version = version + 1, updated_at = datetime('now') WHERE id = 1")
+
+    run_write(write, db_path)
+
+
+# Функция для чтения текущей версии данных: (номер, время изменения в UTC)
+def get_data_version(conn):
+    row = conn.execute('SELECT version, updated_at FROM data_version WHERE id = 1').fetchone()
+    return (row[0], row[1]) if row else (0, None)
@@ -0,0 +1,144 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, timedelta
+
+from db import DB_PATH, connect
+from metrics import metrics
+
+# Сколько строк читаем из курсора за раз и сколько байт копим перед отправкой клиенту
+EXPORT_BATCH_ROWS = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Выгружаемые таблицы: колонки, колонка даты, товара и контрагента с именем параметра запроса
+EXPORT_TABLES = {
+    "sales": {
+        "table": "sales",
+        "columns": ("document_number", "date", "seller", "product", "quantity", "price"),
+        "date": "date",
+        "product": "product",
+        "party": "seller",
+    },
+    "prihod": {
+        "table": "prihod",
+        "columns": ("document_number", "date", "supplier", "product", "quantity", "price"),
+        "date": "date",
+        "product": "product",
+        "party": "supplier",
+    },
+    "stock": {
+        "table": "stock_data",
+        "columns": ("start_date_str", "product_name", "product_code", "stock_quantity"),
+        "date": "start_date_str",
+        "product": "product_name",
+        "party": None,
+    },
+}
+
+
+def _parse_day(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a date YYYY-MM-DD")
+
+
+# Функция для границ периода из date_from / date_to: (нижняя включительно, верхняя исключительно)
+def date_bounds(args):
+    lower = _parse_day(args["date_from"], "date_from").isoformat() if args.get("date_from") else None
+    # Дата в таблицах хранится со временем, поэтому верхняя граница — начало следующего дня
+    upper = (_parse_day(args["date_to"], "date_to") + timedelta(days=1)).isoformat() if args.get("date_to") else None
+    return lower, upper
+
+
+# Функция для условий WHERE по фильтрам запроса без периода: товар, продавец/поставщик
+def party_filters(spec, args):
+    conditions, params = [], []
+    if args.get("product"):
+        conditions.append(f"{spec['product']} = ?")
+        params.append(args["product"])
+    if spec["party"] and args.get(spec["party"]):
+        conditions.append(f"{spec['party']} = ?")
+        params.append(args[spec["party"]])
+    return conditions, params
+
+
+# Функция для условий WHERE по фильтрам запроса: даты включительно, товар, продавец/поставщик
+def table_filters(spec, args):
+    conditions, params = [], []
+    lower, upper = date_bounds(args)
+    if lower:
+        conditions.append(f"{spec['date']} >= ?")
+        params.append(lower)
+    if upper:
+        conditions.append(f"{spec['date']} < ?")
+        params.append(upper)
+    party_conditions, party_params = party_filters(spec, args)
+    return conditions + party_conditions, params + party_params
+
+
+# Функция для запроса выгрузки: SQL, параметры и колонки
+def export_query(name, args):
+    """
+    KeyError — неизвестная таблица, ValueError — неверный фильтр.
+    Порядок по дате отдаёт индекс (по дате или по товару и дате),
+    поэтому SQLite не сортирует результат в памяти.
+    """
+    spec = EXPORT_TABLES[name]
+    conditions, params = table_filters(spec, args)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {', '.join(spec['columns'])} FROM {spec['table']} {where} ORDER BY {spec['date']}"
+    return sql, params, spec["columns"]
+
+
+def _ndjson_lines(columns, rows):
+    return "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+# Генератор тела выгрузки: строки читаются из курсора пачками и сразу уходят клиенту
+def stream_export(name, sql, params, columns, fmt="ndjson", compress=False, db_path=DB_PATH):
+    """
+    Память не зависит от объёма выгрузки: в ней только пачка из
+    EXPORT_BATCH_ROWS строк и буфер до EXPORT_CHUNK_BYTES. compress —
+    поток gzip. Соединение закрывается, когда клиент дочитал или отключился.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    conn = connect(db_path)
+    exported = 0
+    try:
+        cursor = conn.execute(sql, params)
+        pending = [_csv_lines([columns])] if fmt == "csv" else []
+        pending_size = sum(len(text) for text in pending)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+            if rows:
+                text = _csv_lines(rows) if fmt == "csv" else _ndjson_lines(columns, rows)
+                pending.append(text)
+                pending_size += len(text)
+                exported += len(rows)
+            if pending and (pending_size >= EXPORT_CHUNK_BYTES or not rows):
+                data = "".join(pending).encode("utf-8")
+                pending, pending_size = [], 0
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+            if not rows:
+                break
+        if compressor:
+            yield compressor.flush()
+    finally:
+        conn.close()
+        metrics.inc('export_rows_total', exported, table=name, format=fmt)
@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from chatgpt_api import GPT_MODEL, gpt_api
+from db import bump_data_version, ensure_schema, run_write
+from product_index import product_index
+
+# Параметры прогноза для всех товаров пакета
+BATCH_DOSTAVKA = int(os.getenv("FORECAST_DOSTAVKA", 14))
+BATCH_ZAPAS = int(os.getenv("FORECAST_ZAPAS", 30))
+# Сколько прогнозов идёт параллельно
+BATCH_WORKERS = int(os.getenv("FORECAST_WORKERS", 4))
+# Потолок расходов на один прогон в долларах
+SPEND_CAP_USD = float(os.getenv("FORECAST_SPEND_CAP_USD", 2.0))
+# Цена за миллион токенов (запрос, ответ) по моделям
+MODEL_PRICES_USD = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+# Повторы одного товара при ошибках API
+BATCH_RETRIES = 3
+BATCH_RETRY_DELAY = 5
+
+
+class SpendTracker:
+    """
+    Учитывает стоимость прогона по токенам из ответов модели.
+    Ответы из кэша бесплатны. Проверка идёт перед каждым запросом, поэтому
+    перерасход ограничен запросами, уже выполняющимися в пуле.
+    """
+
+    def __init__(self, cap_usd, model=GPT_MODEL):
+        self.cap_usd = cap_usd
+        self.prices = MODEL_PRICES_USD.get(model, max(MODEL_PRICES_USD.values()))
+        self.spent_usd = 0.0
+        self._lock = Lock()
+
+    def add(self, stats):
+        prompt_price, completion_price = self.prices
+        cost = ((stats.get("prompt_tokens") or 0) * prompt_price
+                + (stats.get("completion_tokens") or 0) * completion_price) / 1_000_000
+        with self._lock:
+            self.spent_usd += cost
+
+    def exhausted(self):
+        with self._lock:
+            return self.spent_usd >= self.cap_usd
+
+
+# Функция для разбора ответа модели: JSON с датой, количеством и обоснованием
+def parse_forecast(result):
+    forecast = json.loads(result)
+    quantity = forecast.get("recommended_quantity")
+    return {
+        "recommended_order_date": str(forecast.get("recommended_order_date") or "")[:10] or None,
+        "recommended_quantity": int(float(quantity)) if quantity not in (None, "") else None,
+        "justification": forecast.get("justification"),
+    }
+
+
+# Функция для прогноза одного товара с повторами при ошибках API
+def forecast_product(entry, dostavka, zapas, spend):
+    if spend.exhausted():
+        return {"status": "skipped", "error": "spend cap reached"}
+
+    for attempt in range(1, BATCH_RETRIES + 1):
+        stats = {}
+        try:
+            result = gpt_api(entry["file_name"], dostavka, zapas, stats)
+            break
+        except Exception as e:
+            if attempt == BATCH_RETRIES:
+                return {"status": "error", "error": str(e)}
+            print(f"Ошибка прогноза для {entry['product_name']}: {e}. Повторная попытка {attempt}/{BATCH_RETRIES}...")
+            time.sleep(BATCH_RETRY_DELAY * 2 ** (attempt - 1))
+        finally:
+            spend.add(stats)
+
+    if result is None:
+        return {"status": "error", "error": "file not found"}
+    try:
+        return {"status": "done", "raw": result, **parse_forecast(result)}
+    except (ValueError, TypeError, AttributeError) as e:
+        return {"status": "invalid", "raw": result, "error": f"unparsable answer: {e}"}
+
+
+# Функция для сохранения результата прогноза товара
+def save_forecast(entry, dostavka, zapas, run_id, outcome):
+    def write(conn):
+        conn.execute('''
+            INSERT OR REPLACE INTO forecasts (file_name, product_name, dostavka, zapas, status,
+                recommended_order_date, recommended_quantity, justification, raw, error, run_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
+        ''', (entry["file_name"], entry["product_name"], dostavka, zapas, outcome["status"],
+              outcome.get("recommended_order_date"), outcome.get("recommended_quantity"),
+              outcome.get("justification"), outcome.get("raw"), outcome.get("error"), run_id))
+
+    run_write(write)
+
+
+# Функция для удаления прогнозов товаров, которых больше нет в сборке JSON
+def remove_stale_forecasts(file_names):
+    def write(conn):
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS current_files (file_name TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM current_files')
+        conn.executemany('INSERT OR IGNORE INTO current_files (file_name) VALUES (?)',
+                         [(file_name,) for file_name in file_names])
+        removed = conn.execute(
+            'DELETE FROM forecasts WHERE file_name NOT IN (SELECT file_name FROM current_files)'
+        ).rowcount
+        conn.execute('DROP TABLE current_files')
+        return removed
+
+    return run_write(write)
+
+
+# Основная функция пакетного прогноза по всем товарам из опубликованной сборки JSON
+def run_forecast_batch(dostavka=BATCH_DOSTAVKA, zapas=BATCH_ZAPAS, workers=BATCH_WORKERS,
+                       spend_cap_usd=SPEND_CAP_USD):
+    """
+    Товары идут по убыванию скорости продаж: если упрёмся в потолок
+    расходов, без прогноза останутся самые медленные. Товары, пропущенные
+    из-за потолка, сохраняют прошлый прогноз; прогнозы товаров, выпавших
+    из сборки (распроданы, переименованы), удаляются.
+    Возвращает счётчики статусов прогона.
+    """
+    ensure_schema()
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    entries = sorted(product_index.entries(), key=lambda entry: entry.get("velocity") or 0, reverse=True)
+    spend = SpendTracker(spend_cap_usd)
+    counts = {}
+
+    def work(entry):
+        outcome = forecast_product(entry, dostavka, zapas, spend)
+        if outcome["status"] != "skipped":
+            save_forecast(entry, dostavka, zapas, run_id, outcome)
+        return outcome["status"]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for status in pool.map(work, entries):
+            counts[status] = counts.get(status, 0) + 1
+
+    # Пустая сборка скорее говорит о сбое, чем о том, что товаров не осталось
+    if entries:
+        counts["removed"] = remove_stale_forecasts(entry["file_name"] for entry in entries)
+    bump_data_version()
+    print(f"Пакетный прогноз {run_id}: {counts}, расход ${spend.spent_usd:.4f} из ${spend_cap_usd:.2f}")
+    return counts
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from db import DB_PATH, connect, ensure_schema, run_write
+
+# Сколько живёт прогноз (ключ и так включает дату, TTL ограничивает его внутри дня)
+DEFAULT_TTL = int(os.getenv("GPT_CACHE_TTL", 24 * 60 * 60))
+# Сколько прогнозов храним; сверх этого вытесняются давно не использованные
+DEFAULT_MAX_ENTRIES = int(os.getenv("GPT_CACHE_MAX_ENTRIES", 5000))
+
+
+# Функция для ключа кэша: тот же файл истории и те же параметры — тот же ответ
+def forecast_key(content, dostavka, zapas, model, prompt_version, day):
+    """content — байты JSON истории товара; day — дата прогноза (YYYY-MM-DD)."""
+    parts = [hashlib.sha256(content).hexdigest(), dostavka, zapas, model, prompt_version, day]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+class ForecastCache:
+    """
+    Постоянный кэш ответов GPT в таблице gpt_cache. Ключ — хэш содержимого
+    истории и параметров запроса, поэтому пересобранный JSON товара сам
+    собой даёт промах. Записи устаревают по TTL, а при превышении
+    max_entries удаляются давно не использованные.
+    """
+
+    def __init__(self, db_path=DB_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        ensure_schema(self.db_path)
+        now = time.time()
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute(
+                'SELECT result FROM gpt_cache WHERE cache_key = ? AND created_at > ?', (key, now - self.ttl)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            print(f"Ошибка чтения кэша GPT: {e}")
+            row = None
+        finally:
+            conn.close()
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        def touch(write_conn):
+            write_conn.execute('UPDATE gpt_cache SET last_used = ? WHERE cache_key = ?', (now, key))
+
+        try:
+            run_write(touch, self.db_path, retries=2)
+        except sqlite3.OperationalError as e:
+            # Не обновили время использования — ответ из кэша всё равно верный
+            print(f"Ошибка записи в кэш GPT: {e}")
+        return row[0]
+
+    def put(self, key, result, file_name=None):
+        ensure_schema(self.db_path)
+        now = time.time()
+
+        def write(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO gpt_cache (cache_key, file_name, result, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, file_name, result, now, now)
+            )
+            conn.execute('DELETE FROM gpt_cache WHERE created_at <= ?', (now - self.ttl,))
+            conn.execute('''
+                DELETE FROM gpt_cache WHERE cache_key IN (
+                    SELECT cache_key FROM gpt_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+        try:
+            run_write(write, self.db_path)
+        except sqlite3.OperationalError as e:
+            print(f"Ошибка записи в кэш GPT: {e}")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# Общий экземпляр для всех запросов процесса
+forecast_cache = ForecastCache()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from chatgpt_api import gpt_api
+from db import DB_PATH, connect, ensure_schema, run_write
+from process_utils import now, process_alive
+
+# Сколько прогнозов GPT выполняется одновременно в процессе
+GPT_WORKERS = int(os.getenv("GPT_WORKERS", 4))
+# Сколько дней хранить завершённые задания
+JOB_RETENTION_DAYS = 7
+
+JOB_FIELDS = ("job_id", "file_name", "dostavka", "zapas", "status", "result", "error",
+              "created_at", "started_at", "finished_at")
+
+
+class GptJobQueue:
+    """
+    Очередь прогнозов GPT: submit сразу возвращает job_id, прогноз считает
+    ограниченный пул потоков, а статус и результат лежат в таблице gpt_jobs,
+    поэтому их видит любой воркер gunicorn. Одинаковые задания (товар,
+    параметры, дата), которые ещё ждут или выполняются в живом процессе
+    любого воркера, не запускаются повторно — возвращается job_id уже идущего.
+    """
+
+    def __init__(self, db_path=DB_PATH, workers=GPT_WORKERS, forecast=gpt_api):
+        self.db_path = db_path
+        self.workers = workers
+        self.forecast = forecast
+        self._pool = None
+        self._lock = Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="gpt-job")
+            return self._pool
+
+    @staticmethod
+    def _job_key(file_name, dostavka, zapas):
+        parts = [file_name, dostavka, zapas, datetime.now().strftime("%Y-%m-%d")]
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _update(self, job_id, **fields):
+        def write(conn):
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            conn.execute(f"UPDATE gpt_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+        run_write(write, self.db_path)
+
+    def submit(self, file_name, dostavka, zapas):
+        """Ставит прогноз в очередь. Возвращает (job_id, True, если задание новое)."""
+        ensure_schema(self.db_path)
+        # Имя из URL и то же имя без кодирования должны давать один ключ
+        file_name = urllib.parse.unquote(file_name)
+        job_key = self._job_key(file_name, dostavka, zapas)
+        job_id = uuid.uuid4().hex
+
+        def write(conn):
+            # Поиск и вставка под одной блокировкой записи: два воркера с одинаковым
+            # запросом не создадут два задания
+            conn.execute('BEGIN IMMEDIATE')
+            for existing_id, pid in conn.execute(
+                "SELECT job_id, pid FROM gpt_jobs WHERE job_key = ? AND status IN ('queued', 'running')", (job_key,)
+            ).fetchall():
+                if process_alive(pid):
+                    return existing_id
+            conn.execute('''
+                INSERT INTO gpt_jobs (job_id, job_key, file_name, dostavka, zapas, status, pid, created_at)
+                VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)
+            ''', (job_id, job_key, file_name, dostavka, zapas, os.getpid(), now()))
+            conn.execute("DELETE FROM gpt_jobs WHERE created_at < datetime('now', 'localtime', ?)",
+                         (f"-{JOB_RETENTION_DAYS} days",))
+            return job_id
+
+        submitted_id = run_write(write, self.db_path)
+        if submitted_id != job_id:
+            return submitted_id, False
+
+        self._executor().submit(self._run, job_id, file_name, dostavka, zapas)
+        return job_id, True
+
+    def _run(self, job_id, file_name, dostavka, zapas):
+        try:
+            self._update(job_id, status="running", started_at=now())
+            result = self.forecast(file_name, dostavka, zapas)
+            if result is None:
+                self._update(job_id, status="error", error="file not found", finished_at=now())
+            else:
+                self._update(job_id, status="done", result=result, finished_at=now())
+        except Exception as e:
+            print(f"Ошибка прогноза GPT для {file_name}: {e}")
+            try:
+                self._update(job_id, status="error", error=str(e), finished_at=now())
+            except Exception as write_error:
+                print(f"Ошибка записи статуса задания {job_id}: {write_error}")
+
+    def get(self, job_id):
+        """Возвращает задание словарём или None, если такого нет."""
+        ensure_schema(self.db_path)
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)}, pid FROM gpt_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+
+        job = dict(zip(JOB_FIELDS, row))
+        pid = row[-1]
+        # Процесс, принявший задание, перезапустился — результата уже не будет
+        if job["status"] in ("queued", "running") and pid != os.getpid() and not process_alive(pid):
+            job.update(status="error", error="interrupted", finished_at=now())
+            self._update(job_id, status="error", error="interrupted", finished_at=job["finished_at"])
+        return job
+
+
+# Общая очередь процесса
+gpt_jobs = GptJobQueue()
@@ -0,0 +1,193 @@
+import json
+import math
+import os
+from datetime import date, datetime, timedelta
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken считаем токены приближённо
+    tiktoken = None
+
+# Сколько токенов максимум отдаём под историю товара
+TOKEN_BUDGET = int(os.getenv("GPT_TOKEN_BUDGET", 3000))
+
+# Уровни детализации от подробного к грубому: (дней подневно, дней понедельно),
+# всё, что старше, агрегируется по месяцам. При превышении бюджета берём
+# следующий уровень, то есть сначала огрубляем самые старые периоды.
+DETAIL_LEVELS = [
+    (31, 182),
+    (14, 91),
+    (7, 56),
+    (0, 28),
+    (0, 0),
+]
+
+SERIES_FIELDS = ("sold", "received", "revenue", "stock_end")
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text))
+    # Цифры и короткие ключи — около трёх символов на токен
+    return math.ceil(len(text) / 3)
+
+
+def _parse_day(value):
+    return datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def _week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_period(start, step):
+    if step == "day":
+        return start + timedelta(days=1)
+    if step == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _period_start(day, step):
+    if step == "day":
+        return day
+    if step == "week":
+        return _week_start(day)
+    return _month_start(day)
+
+
+def _series(transactions, step, first, last, opening_stock):
+    """
+    Плотный ряд периодов от first до last (включительно) в колоночном виде:
+    {"step": ..., "from": ..., "sold": [...], "received": [...], ...}.
+    Пустые периоды остаются нулями — это тоже информация о скорости продаж.
+    Если крайний период обрезан границей ряда, в "days" — сколько дней
+    реально попало в каждый период, иначе модель примет его за спад.
+    """
+    if first > last:
+        return None, opening_stock
+    starts = []
+    start = _period_start(first, step)
+    while start <= last:
+        starts.append(start)
+        start = _next_period(start, step)
+    if not starts:
+        return None, opening_stock
+
+    index = {start: position for position, start in enumerate(starts)}
+    columns = {field: [0] * len(starts) for field in SERIES_FIELDS}
+    stock_seen = [None] * len(starts)
+
+    for day, trans_type, quantity, price, stock_after in transactions:
+        position = index[_period_start(day, step)]
+        if trans_type == "sales":
+            columns["sold"][position] += quantity
+            columns["revenue"][position] += quantity * price
+        else:
+            columns["received"][position] += quantity
+        stock_seen[position] = stock_after
+
+    # Остаток на конец периода — последний известный stock_after
+    stock = opening_stock
+    for position, value in enumerate(stock_seen):
+        if value is not None:
+            stock = value
+        columns["stock_end"][position] = stock
+
+    series = {"step": step, "from": starts[0].isoformat()}
+    days = [(min(_next_period(start, step), last + timedelta(days=1)) - max(start, first)).days for start in starts]
+    if any(count != (_next_period(start, step) - start).days for start, count in zip(starts, days)):
+        series["days"] = days
+    series.update(columns)
+    return series, stock
+
+
+def build_history_payload(data, today=None, token_budget=TOKEN_BUDGET, model="gpt-4o-mini"):
+    """
+    Сворачивает историю товара из JSON (create_json_files) в компактный
+    колоночный вид: свежие дни подневно, затем недели, старше — месяцы.
+    Если результат не укладывается в token_budget, огрубляет старые периоды,
+    а в крайнем случае отбрасывает самые старые месяцы.
+    Возвращает (текст для модели, число токенов).
+    """
+    today = today or date.today()
+    transactions = []
+    for entry in data.get("history", []):
+        stock_after = entry.get("stock_after")
+        if entry["type"] == "prihod":
+            # В JSON у прихода stock_after — остаток до поступления
+            stock_after = (stock_after or 0) + entry["quantity"]
+        transactions.append((_parse_day(entry["date"]), entry["type"], entry["quantity"],
+                             entry.get("price") or 0, stock_after))
+    transactions.sort(key=lambda row: row[0])
+
+    first_day = transactions[0][0] if transactions else today
+    opening_stock = data.get("stock")
+
+    def render(daily_days, weekly_days, drop_months=0):
+        # Подневный ряд начинается с понедельника, поэтому недели перед ним целые
+        daily_from = _week_start(today - timedelta(days=daily_days - 1)) if daily_days else today + timedelta(days=1)
+        # Недели начинаются с понедельника не позже начала месяца: неполным
+        # остаётся только последний месяц, и его длина видна в "days"
+        weekly_from = _week_start(_month_start(daily_from - timedelta(days=weekly_days)))
+        monthly_to = weekly_from - timedelta(days=1)
+
+        payload = {
+            "product": data.get("product_name"),
+            "stock": data.get("stock"),
+            "today": today.isoformat(),
+            "fields": {
+                "sold": "продано шт.",
+                "received": "поступило шт.",
+                "revenue": "выручка",
+                "stock_end": "stock_after на конец периода",
+                "days": "дней в периоде, если период неполный",
+            },
+        }
+        stock = opening_stock
+        parts = [
+            ("monthly", "month", first_day, monthly_to),
+            ("weekly", "week", max(first_day, weekly_from), daily_from - timedelta(days=1)),
+            ("daily", "day", max(first_day, daily_from), today),
+        ]
+        for name, step, start, end in parts:
+            chunk = [row for row in transactions if start <= row[0] <= end]
+            series, stock = _series(chunk, step, start, end, stock)
+            if series and name == "monthly" and drop_months:
+                for field in SERIES_FIELDS + ("days",):
+                    if field in series:
+                        series[field] = series[field][drop_months:]
+                months = datetime.strptime(series["from"], "%Y-%m-%d").date()
+                for _ in range(drop_months):
+                    months = _next_period(months, "month")
+                series["from"] = months.isoformat()
+                if not series["sold"]:
+                    series = None
+            if series:
+                payload[name] = series
+        text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        return text, count_tokens(text, model)
+
+    text, tokens = None, None
+    for daily_days, weekly_days in DETAIL_LEVELS:
+        text, tokens = render(daily_days, weekly_days)
+        if tokens <= token_budget:
+            return text, tokens
+
+    # Даже помесячно не помещается — отбрасываем самые старые месяцы
+    drop_months = 1
+    while tokens > token_budget:
+        shorter, shorter_tokens = render(0, 0, drop_months)
+        if shorter == text:
+            break
+        text, tokens = shorter, shorter_tokens
+        drop_months += 1
+    return text, tokens
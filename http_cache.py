@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request
+
+from db import get_data_version
+from read_pool import get_read_pool
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него отдаём gzip
+    brotli = None
+
+# Ответы меньше этого размера не сжимаем: выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 1024
+
+
+def _last_modified(updated_at):
+    if not updated_at:
+        return None
+    return datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+# Функция для сжатия тела ответа по Accept-Encoding клиента
+def compress_response(response):
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def conditional(per_day=False):
+    """
+    Декоратор для читающих эндпоинтов: ETag и Last-Modified берутся из версии
+    данных, которую повышают задания ETL. Если у клиента актуальная копия,
+    отвечаем 304 без вызова обработчика, иначе отдаём ответ со сжатием.
+    per_day — ответ зависит ещё и от текущей даты (прогнозы).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            with get_read_pool().connection() as conn:
+                version, updated_at = get_data_version(conn)
+
+            # Ответ зависит от параметров запроса, поэтому они входят в ETag
+            key = request.full_path
+            if per_day:
+                key += datetime.now().strftime('%Y-%m-%d')
+            etag = f"{version}-{hashlib.md5(key.encode('utf-8')).hexdigest()[:16]}"
+            # Для ответов, зависящих от даты, полагаемся только на ETag
+            last_modified = None if per_day else _last_modified(updated_at)
+
+            if _not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                response = compress_response(make_response(view(*args, **kwargs)))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            # Браузер хранит копию, но каждый раз сверяет её с сервером
+            response.cache_control.no_cache = True
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,113 @@
+from datetime import date, timedelta
+from threading import Lock
+
+import numpy as np
+
+from db import DB_PATH, get_data_version
+from read_pool import get_read_pool
+
+# Сколько последних дней продаж держим в матрице (скорость, тренд, вариация)
+WINDOW_DAYS = 182
+
+
+class InventoryData:
+    """
+    Снимок складских данных для расчётов по всем SKU сразу:
+    products — названия товаров, row — {товар: номер строки},
+    stock — фактический остаток (последний снимок + движения после него),
+    sales — матрица продаж (товар × день) за WINDOW_DAYS дней до today
+    (сегодняшний неполный день не входит), revenue — то же в деньгах.
+    """
+
+    def __init__(self, products, stock, stock_day, sales, revenue, start, today, version):
+        self.products = products
+        self.row = {name: position for position, name in enumerate(products)}
+        self.stock = stock
+        self.stock_day = stock_day
+        self.sales = sales
+        self.revenue = revenue
+        self.start = start
+        self.today = today
+        self.version = version
+
+
+# Функция для расчёта фактического остатка: {товар: остаток}, день последнего снимка
+def current_stock(conn):
+    # Отчёт об остатках на дату D — остаток на начало дня D, поэтому движения
+    # в сам день D и позже добавляются к нему. Товара нет в последнем снимке — остаток 0.
+    stock_day = conn.execute('SELECT MAX(start_date_str) FROM stock_data').fetchone()[0]
+    stock = {}
+    if stock_day:
+        stock = dict(conn.execute(
+            'SELECT product_name, stock_quantity FROM stock_data WHERE start_date_str = ?', (stock_day,)
+        ))
+        for product, received, sold in conn.execute('''
+            SELECT product, TOTAL(received), TOTAL(sold) FROM (
+                SELECT product, quantity AS received, 0 AS sold FROM prihod WHERE date >= :day
+                UNION ALL
+                SELECT product, 0, quantity FROM sales WHERE date >= :day
+            )
+            GROUP BY product
+        ''', {"day": stock_day}):
+            stock[product] = stock.get(product, 0) + received - sold
+    return stock, stock_day
+
+
+# Функция для загрузки снимка из базы
+def load_inventory_data(conn, today=None, window_days=WINDOW_DAYS):
+    today = today or date.today()
+    start = today - timedelta(days=window_days)
+    version = get_data_version(conn)[0]
+    stock, stock_day = current_stock(conn)
+
+    daily = conn.execute('''
+        SELECT product, substr(date, 1, 10), SUM(quantity), SUM(quantity * price)
+        FROM sales
+        WHERE date >= ? AND date < ?
+        GROUP BY product, substr(date, 1, 10)
+    ''', (start.isoformat(), today.isoformat())).fetchall()
+
+    products = sorted(set(stock) | {row[0] for row in daily})
+    positions = {name: position for position, name in enumerate(products)}
+    sales = np.zeros((len(products), window_days))
+    revenue = np.zeros((len(products), window_days))
+    if daily:
+        rows = np.fromiter((positions[product] for product, *_ in daily), dtype=np.intp, count=len(daily))
+        days = np.fromiter(
+            ((date.fromisoformat(day) - start).days for _, day, _, _ in daily),
+            dtype=np.intp, count=len(daily)
+        )
+        np.add.at(sales, (rows, days), [quantity or 0 for _, _, quantity, _ in daily])
+        np.add.at(revenue, (rows, days), [amount or 0 for _, _, _, amount in daily])
+
+    stock_array = np.array([max(stock.get(name, 0), 0) for name in products], dtype=float)
+    return InventoryData(products, stock_array, stock_day, sales, revenue, start, today, version)
+
+
+# Кэш снимков: пересобираются, когда меняется версия данных или наступает новый день
+_cache = {}
+_cache_lock = Lock()
+
+
+# Функция для получения снимка loader(conn) из кэша процесса
+def cached_per_version(name, loader, db_path=DB_PATH):
+    """
+    loader(conn) возвращает объект с полями version и today. Пока версия
+    данных и дата не изменились, повторные вызовы отдают тот же объект.
+    """
+    key = (name, db_path)
+    with get_read_pool(db_path).connection() as conn:
+        version = get_data_version(conn)[0]
+        cached = _cache.get(key)
+        if cached is not None and cached.version == version and cached.today == date.today():
+            return cached
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is None or cached.version != version or cached.today != date.today():
+                cached = loader(conn)
+                _cache[key] = cached
+            return cached
+
+
+def get_inventory_data(db_path=DB_PATH):
+    return cached_per_version("inventory", load_inventory_data, db_path)
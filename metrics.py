@@ -0,0 +1,188 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# Границы бакетов гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Описания метрик для # HELP / # TYPE
+DESCRIPTIONS = {
+    "moysklad_requests_total": ("counter", "Запросы к МойСклад по эндпоинту и коду ответа"),
+    "moysklad_request_seconds": ("histogram", "Длительность запросов к МойСклад"),
+    "moysklad_retries_total": ("counter", "Повторы запросов к МойСклад по причине"),
+    "moysklad_rate_limit_wait_seconds_total": ("counter", "Время ожидания лимита запросов МойСклад"),
+    "reference_cache_requests_total": ("counter", "Обращения к кэшу справочников (hit/miss)"),
+    "db_write_seconds": ("histogram", "Длительность транзакций записи в SQLite"),
+    "db_write_retries_total": ("counter", "Повторы записи из-за блокировки базы"),
+    "db_read_connections_opened_total": ("counter", "Соединения для чтения, открытые пулом (рост — пул холодный)"),
+    "etl_rows_fetched_total": ("counter", "Строки, полученные из МойСклад, по таблице"),
+    "etl_rows_written_total": ("counter", "Строки, записанные в базу, по таблице"),
+    "etl_stage_seconds": ("histogram", "Длительность этапов ETL"),
+    "json_files_total": ("counter", "JSON товаров при пересборке: written, linked, removed"),
+    "job_duration_seconds": ("histogram", "Длительность заданий планировщика"),
+    "export_rows_total": ("counter", "Строки, отданные /export, по таблице и формату"),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Registry:
+    """
+    Счётчики и гистограммы процесса в памяти. render() отдаёт их в текстовом
+    формате Prometheus, snapshot() — плоский словарь для разницы до/после
+    задания (сводка запуска в job_runs). state() и merge() переносят
+    значения между процессами: /metrics складывает состояния всех
+    воркеров (metrics_store).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        # Значения меток приводятся к строке: код ответа (int) и 'error' в одной метке
+        # иначе ломают сортировку в render()
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][position] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            values = {name + _label_text(labels): value for (name, labels), value in self._counters.items()}
+            for (name, labels), histogram in self._histograms.items():
+                values[f"{name}_sum{_label_text(labels)}"] = histogram["sum"]
+                values[f"{name}_count{_label_text(labels)}"] = histogram["count"]
+        return values
+
+    def state(self):
+        """Значения реестра в виде, пригодном для JSON."""
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, list(labels), dict(histogram, buckets=list(histogram["buckets"]))]
+                               for (name, labels), histogram in self._histograms.items()],
+            }
+
+    def merge(self, state):
+        """Прибавляет к реестру значения state() другого процесса."""
+        with self._lock:
+            for name, labels, value in state.get("counters", ()):
+                key = (name, tuple(tuple(label) for label in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+            for name, labels, other in state.get("histograms", ()):
+                if len(other["buckets"]) != len(self.buckets):
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                histogram["buckets"] = [mine + theirs for mine, theirs in zip(histogram["buckets"], other["buckets"])]
+                histogram["sum"] += other["sum"]
+                histogram["count"] += other["count"]
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        described = set()
+
+        def header(name):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = DESCRIPTIONS.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name)
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_label_text(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр процесса
+metrics = Registry()
+
+
+# Функция для сводки запуска: разница счётчиков и скорости записи строк
+def run_summary(before, after, duration):
+    delta = {key: round(value - before.get(key, 0), 6) for key, value in after.items()
+             if value != before.get(key, 0)}
+    if duration:
+        for key, value in list(delta.items()):
+            if key.startswith(("etl_rows_fetched_total", "etl_rows_written_total")):
+                delta[key.replace("_total", "_per_second", 1)] = round(value / duration, 2)
+    return delta
+
+
+# Функция для текста /metrics по последним запускам заданий из job_runs:
+# задания выполняет только ведущий процесс, а /metrics может ответить любой воркер
+def render_job_runs(jobs):
+    lines = [
+        "# HELP job_last_run_duration_seconds Длительность последнего запуска задания",
+        "# TYPE job_last_run_duration_seconds gauge",
+    ]
+    for job in jobs:
+        if job["last_run"] and job["last_run"]["duration"] is not None:
+            lines.append(f"job_last_run_duration_seconds{_label_text((('job', job['name']),))} "
+                         f"{job['last_run']['duration']}")
+    lines += [
+        "# HELP job_last_run_status Статус последнего запуска задания (1 у текущего статуса)",
+        "# TYPE job_last_run_status gauge",
+    ]
+    for job in jobs:
+        if job["last_run"]:
+            labels = (("job", job["name"]), ("status", job["last_run"]["status"]))
+            lines.append(f"job_last_run_status{_label_text(labels)} 1")
+    lines += [
+        "# HELP job_last_success_timestamp_seconds Время окончания последнего успешного запуска",
+        "# TYPE job_last_success_timestamp_seconds gauge",
+    ]
+    for job in jobs:
+        success = job["last_success"]
+        if success and success["finished_at"]:
+            finished = time.mktime(time.strptime(success["finished_at"], "%Y-%m-%d %H:%M:%S"))
+            lines.append(f"job_last_success_timestamp_seconds{_label_text((('job', job['name']),))} {finished:.0f}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+
+from db import DB_PATH, connect, ensure_schema, run_write
+from metrics import Registry, metrics
+from process_utils import now, process_alive
+
+# Как часто воркер сохраняет свои метрики в базу
+PUBLISH_SECONDS = int(os.getenv("METRICS_PUBLISH_SECONDS", 15))
+# Строка с суммой метрик завершившихся процессов: счётчики не сбрасываются после перезапуска воркера
+RETIRED = "retired"
+
+_process = None
+
+
+# Функция для имени процесса в metric_snapshots: pid и время старта, чтобы
+# новый воркер с тем же pid не перезаписал метрики завершившегося
+def _process_id():
+    global _process
+    if _process is None or _process[0] != os.getpid():
+        _process = (os.getpid(), f"{os.getpid()}-{time.time():.6f}")
+    return _process[1]
+
+
+# Функция для сохранения метрик процесса в metric_snapshots
+def publish(registry=metrics, db_path=DB_PATH):
+    """
+    Записывает state() реестра в строку процесса. Строки завершившихся
+    процессов в той же транзакции прибавляются к строке RETIRED и удаляются.
+    """
+    ensure_schema(db_path)
+    process = _process_id()
+    state = json.dumps(registry.state(), ensure_ascii=False)
+
+    def write(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        retired = Registry(registry.buckets)
+        finished = []
+        for other, pid, other_state in conn.execute(
+            "SELECT process, pid, state FROM metric_snapshots WHERE process NOT IN (?, ?)", (process, RETIRED)
+        ).fetchall():
+            if pid == os.getpid() or not process_alive(pid):
+                retired.merge(json.loads(other_state))
+                finished.append(other)
+        if finished:
+            row = conn.execute("SELECT state FROM metric_snapshots WHERE process = ?", (RETIRED,)).fetchone()
+            if row:
+                retired.merge(json.loads(row[0]))
+            conn.execute(
+                "INSERT OR REPLACE INTO metric_snapshots (process, pid, state, updated_at) VALUES (?, 0, ?, ?)",
+                (RETIRED, json.dumps(retired.state(), ensure_ascii=False), now())
+            )
+            conn.executemany("DELETE FROM metric_snapshots WHERE process = ?", [(other,) for other in finished])
+        conn.execute(
+            "INSERT OR REPLACE INTO metric_snapshots (process, pid, state, updated_at) VALUES (?, ?, ?, ?)",
+            (process, os.getpid(), state, now())
+        )
+
+    run_write(write, db_path)
+
+
+# Функция для суммы метрик всех воркеров (и завершившихся) в одном реестре
+def collect(db_path=DB_PATH, buckets=None):
+    ensure_schema(db_path)
+    total = Registry(buckets or metrics.buckets)
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("SELECT state FROM metric_snapshots").fetchall()
+    finally:
+        conn.close()
+    for state, in rows:
+        total.merge(json.loads(state))
+    return total
+
+
+def _publish_loop(interval, db_path):
+    while True:
+        time.sleep(interval)
+        try:
+            publish(db_path=db_path)
+        except Exception as e:
+            print(f"Метрики: не удалось сохранить метрики процесса: {type(e).__name__}: {e}", flush=True)
+
+
+# Функция для фонового потока, который периодически сохраняет метрики процесса
+def start_publisher(interval=PUBLISH_SECONDS, db_path=DB_PATH):
+    thread = threading.Thread(target=_publish_loop, args=(interval, db_path), name="metrics_publisher", daemon=True)
+    thread.start()
+    return thread
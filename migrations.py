@@ -0,0 +1,277 @@
+# Версионированные миграции схемы sales_data.db.
+# Номер применённой миграции хранится в PRAGMA user_version. Каждая миграция
+# выполняется в своей транзакции вместе с повышением версии, поэтому
+# параллельный старт нескольких воркеров не применит её дважды.
+# Новые изменения схемы добавляются в конец MIGRATIONS, старые не редактируются.
+
+
+def _has_index(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _create_unique_index(conn, name, table, columns):
+    if _has_index(conn, name):
+        return
+    # Старые данные могли накопить дубли — оставляем первую запись
+    conn.execute(f'''
+        DELETE FROM {table} WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM {table} GROUP BY {columns}
+        )
+    ''')
+    conn.execute(f'CREATE UNIQUE INDEX {name} ON {table} ({columns})')
+
+
+# 1. Таблицы, которые раньше создавались прямо в функциях записи, и ключи уникальности
+def _base_tables(conn):
+    for table, party_column in (('sales', 'seller'), ('prihod', 'supplier')):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                document_number TEXT,
+                date TEXT,
+                {party_column} TEXT,
+                product TEXT,
+                quantity INTEGER,
+                price INTEGER
+            )
+        ''')
+        _create_unique_index(conn, f'ux_{table}_document_date_product', table, 'document_number, date, product')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_data (
+            product_name TEXT,
+            product_code TEXT,
+            stock_quantity INTEGER,
+            start_date_str TEXT
+        )
+    ''')
+    _create_unique_index(conn, 'ux_stock_data_code_date', 'stock_data', 'product_code, start_date_str')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            entity TEXT PRIMARY KEY,
+            watermark TEXT,
+            updated_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ref_cache (
+            href TEXT PRIMARY KEY,
+            data TEXT,
+            updated TEXT,
+            fetched_at REAL
+        )
+    ''')
+
+
+# 2. Индексы под очистку по дате, выборки по товару и помесячные сводки
+def _query_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_sales_date ON sales (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_sales_product_date ON sales (product, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_prihod_date ON prihod (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_prihod_product_date ON prihod (product, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_stock_data_date ON stock_data (start_date_str)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_stock_data_name_date ON stock_data (product_name, start_date_str)')
+    conn.execute('ANALYZE')
+
+
+# 3. Помесячная сводка для /summary, которую поддерживают экспортёры
+def _monthly_summary(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_summary (
+            month TEXT PRIMARY KEY,
+            sku INTEGER,
+            sales_sku INTEGER,
+            revenue INTEGER,
+            updated_at TEXT
+        )
+    ''')
+
+
+# 4. Счётчик версии данных: растёт после каждого прогона ETL и пересборки JSON
+def _data_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version, updated_at) VALUES (1, 1, datetime('now'))")
+
+
+# 5. Отпечатки опубликованных JSON товаров для инкрементальной пересборки
+def _json_build_state(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS json_build_state (
+            product_name TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            fingerprint TEXT NOT NULL
+        )
+    ''')
+
+
+# 6. Кэш ответов GPT по содержимому истории товара и параметрам запроса
+def _gpt_cache(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gpt_cache (
+            cache_key TEXT PRIMARY KEY,
+            file_name TEXT,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_gpt_cache_last_used ON gpt_cache (last_used)')
+
+
+# 7. Асинхронные задания прогноза GPT: статус и результат по job_id
+def _gpt_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gpt_jobs (
+            job_id TEXT PRIMARY KEY,
+            job_key TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            dostavka INTEGER,
+            zapas INTEGER,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            pid INTEGER,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_gpt_jobs_created_at ON gpt_jobs (created_at)')
+
+
+# 8. Результаты ночного пакетного прогноза по всем товарам в наличии
+def _forecasts(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS forecasts (
+            file_name TEXT PRIMARY KEY,
+            product_name TEXT,
+            dostavka INTEGER,
+            zapas INTEGER,
+            status TEXT NOT NULL,
+            recommended_order_date TEXT,
+            recommended_quantity INTEGER,
+            justification TEXT,
+            raw TEXT,
+            error TEXT,
+            run_id TEXT,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_forecasts_order_date ON forecasts (recommended_order_date, file_name)')
+
+
+# 9. История запусков заданий планировщика
+def _job_runs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            status TEXT NOT NULL,
+            trigger TEXT,
+            pid INTEGER,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            duration REAL,
+            error TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_job_runs_job_id ON job_runs (job, id)')
+
+
+# 10. Сводка метрик запуска задания (разница счётчиков за время запуска)
+def _job_run_metrics(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(job_runs)')}
+    if 'metrics' not in columns:
+        conn.execute('ALTER TABLE job_runs ADD COLUMN metrics TEXT')
+
+
+# 11. Индексы под постраничный просмотр /sales и /prihod по продавцу или поставщику
+def _party_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_sales_seller_date ON sales (seller, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_prihod_supplier_date ON prihod (supplier, date)')
+    conn.execute('ANALYZE sales')
+    conn.execute('ANALYZE prihod')
+
+
+# 12. Поиск незавершённого задания GPT с тем же ключом при постановке в очередь
+def _gpt_jobs_key_index(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_gpt_jobs_job_key ON gpt_jobs (job_key, status)')
+
+
+
+# 13. Метрики каждого воркера: /metrics складывает их, с какого бы воркера ни пришёл запрос
+def _metric_snapshots(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metric_snapshots (
+            process TEXT PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+
+
+# 14. id документа МойСклад: изменённый документ перезаписывается по id, а не по номеру,
+# который может повторяться (розничная нумерация, новый год)
+def _document_ids(conn):
+    for table in ('sales', 'prihod'):
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if 'document_id' not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN document_id TEXT')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_document_id ON {table} (document_id)')
+
+
+MIGRATIONS = [
+    (1, 'base tables and uniqueness keys', _base_tables),
+    (2, 'query indexes', _query_indexes),
+    (3, 'monthly summary', _monthly_summary),
+    (4, 'data version counter', _data_version),
+    (5, 'json build state', _json_build_state),
+    (6, 'gpt result cache', _gpt_cache),
+    (7, 'gpt jobs', _gpt_jobs),
+    (8, 'batch forecasts', _forecasts),
+    (9, 'scheduler job runs', _job_runs),
+    (10, 'job run metrics', _job_run_metrics),
+    (11, 'seller and supplier indexes', _party_indexes),
+    (12, 'gpt jobs key index', _gpt_jobs_key_index),
+    (13, 'metric snapshots', _metric_snapshots),
+    (14, 'moysklad document ids', _document_ids),
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применяет недостающие миграции и возвращает итоговую версию схемы."""
+    # WAL сохраняется в файле базы: читатели Flask больше не ждут писателей ETL
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    for version, description, apply in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Версию перечитываем под блокировкой: другой воркер мог успеть раньше
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Применена миграция базы {version}: {description}")
+
+    return current_version(conn)
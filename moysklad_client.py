@@ -0,0 +1,191 @@
+import os
+import random
+import re
+import time
+from threading import BoundedSemaphore, Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# Учётные данные и организация, общие для всех экспортёров
+USERNAME = os.getenv("MOYSKLAD_USERNAME", "admin@bayzak1")
+PASSWORD = os.getenv("MOYSKLAD_PASSWORD", "Pospro2023!")
+ORGANIZATION_URL = 'https://api.moysklad.ru/api/remap/1.2/entity/organization/092e4f5f-2391-11e9-9109-f8fc00017cb3'
+
+# Ограничения МойСклад: не более 45 запросов за 3 секунды на аккаунт
+# и не более 5 параллельных запросов от одного пользователя
+RATE_LIMIT_REQUESTS = 45
+RATE_LIMIT_PERIOD = 3.0
+MAX_PARALLEL_REQUESTS = 5
+
+# Сколько документов страницы экспортёры обрабатывают одновременно
+EXPORT_WORKERS = int(os.getenv("MOYSKLAD_WORKERS", MAX_PARALLEL_REQUESTS))
+
+# За сколько дней назад инкрементальная синхронизация сверяет список
+# документов, чтобы удалить из базы удалённые в МойСклад
+SYNC_RECONCILE_DAYS = int(os.getenv("MOYSKLAD_RECONCILE_DAYS", 31))
+
+# Повторы при троттлинге и ошибках сервера
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 6
+BACKOFF_FACTOR = 0.5
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = (10, 120)
+
+# Идентификаторы сущностей в пути заменяются, чтобы метрики группировались по эндпоинту
+_ID_PATTERN = re.compile(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+class TokenBucket:
+    """Токен-бакет: пропускает не более capacity запросов за period секунд."""
+
+    def __init__(self, capacity=RATE_LIMIT_REQUESTS, period=RATE_LIMIT_PERIOD):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            metrics.inc('moysklad_rate_limit_wait_seconds_total', wait)
+            time.sleep(wait)
+
+
+class MoySkladClient:
+    # MOYSKLAD_BASE_URL позволяет направить экспортёры на локальный fake (bench/fake_moysklad.py)
+    BASE_URL = os.getenv('MOYSKLAD_BASE_URL', 'https://api.moysklad.ru/api/remap/1.2/')
+
+    def __init__(self, username=USERNAME, password=PASSWORD, pool_size=MAX_PARALLEL_REQUESTS):
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        # МойСклад требует явного согласия на сжатие ответа
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.bucket = TokenBucket()
+        self.parallel = BoundedSemaphore(MAX_PARALLEL_REQUESTS)
+
+    def _endpoint_label(self, url):
+        path = url.split('?', 1)[0]
+        if path.startswith(self.BASE_URL):
+            path = path[len(self.BASE_URL):]
+        return _ID_PATTERN.sub('/{id}', '/' + path.strip('/'))
+
+    def _url(self, endpoint):
+        if endpoint.startswith("http"):  # Проверяем, является ли `endpoint` полным URL
+            return endpoint
+        return self.BASE_URL + endpoint
+
+    @staticmethod
+    def _retry_delay(response, attempt):
+        # Сервер сам подсказывает, сколько ждать после 429
+        if response is not None:
+            lognex = response.headers.get('X-Lognex-Retry-TimeInterval')
+            if lognex:
+                try:
+                    return int(lognex) / 1000
+                except ValueError:
+                    pass
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        delay = min(BACKOFF_MAX, BACKOFF_FACTOR * (2 ** attempt))
+        return delay + random.uniform(0, delay / 2)
+
+    def get(self, endpoint, params=None):
+        url = self._url(endpoint)
+        label = self._endpoint_label(url)
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            response = None
+            started = time.monotonic()
+            try:
+                with self.parallel:
+                    response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc('moysklad_requests_total', endpoint=label, status='error')
+                if attempt == MAX_RETRIES:
+                    raise
+                metrics.inc('moysklad_retries_total', endpoint=label, reason='connection')
+                print(f"Ошибка соединения с МойСклад: {e}. Повторная попытка...")
+            else:
+                metrics.observe('moysklad_request_seconds', time.monotonic() - started, endpoint=label)
+                metrics.inc('moysklad_requests_total', endpoint=label, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    response.raise_for_status()
+                    return response.json()
+                metrics.inc('moysklad_retries_total', endpoint=label, reason=response.status_code)
+                print(f"МойСклад ответил {response.status_code} на {url}. Повторная попытка...")
+            time.sleep(self._retry_delay(response, attempt))
+
+    # field: moment — выборка по дате документа, updated — по дате изменения
+    def get_documents(self, entity, organization_url, start_date, limit=1000, offset=0, field='moment'):
+        params = {
+            'filter': f'organization={organization_url};{field}>={start_date}',
+            'limit': limit,
+            'offset': offset
+        }
+        return self.get(f'entity/{entity}', params=params)
+
+    def get_retail_demand(self, organization_url, start_date, limit=1000, offset=0, field='moment'):
+        return self.get_documents('retaildemand', organization_url, start_date, limit, offset, field)
+
+    def get_supply(self, organization_url, start_date, limit=1000, offset=0, field='moment'):
+        return self.get_documents('supply', organization_url, start_date, limit, offset, field)
+
+    # Генератор всех документов выборки постранично
+    def iter_documents(self, entity, organization_url, start_date, field='moment', limit=1000):
+        offset = 0
+        while True:
+            response = self.get_documents(entity, organization_url, start_date, limit, offset, field)
+            rows = response.get('rows') or []
+            yield from rows
+            if len(rows) < limit:
+                break
+            offset += limit
+
+    def get_stock_all(self, moment, store_urls, limit=1000, offset=0):
+        filter_store = ";".join([f"store={store_url}" for store_url in store_urls])
+        params = {
+            'filter': f'moment={moment};{filter_store}',
+            'limit': limit,
+            'offset': offset
+        }
+        return self.get('report/stock/all', params=params)
+
+
+# Дата изменения документа без миллисекунд — в формате фильтров API
+def document_updated(item):
+    updated = item.get('updated')
+    return updated.split('.')[0] if updated else None
+
+
+_client = None
+_client_lock = Lock()
+
+
+# Общий клиент процесса: один пул соединений и один лимит запросов на всех
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MoySkladClient()
+        return _client
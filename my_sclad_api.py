@@ -1,16 +1,30 @@
 import json
+import urllib.parse
 
 from flask import Flask, jsonify, Response, request
 from flask_cors import CORS
 import sqlite3
 from datetime import datetime
-import threading
-import time
-import schedule
+import os
 
+from analytics import abc_xyz_matrix, query_skus
 from chatgpt_api import gpt_api
+from db import ensure_schema
+from export_stream import EXPORT_TABLES, FORMATS, export_query, stream_export
+from forecast_batch import run_forecast_batch
+from gpt_jobs import gpt_jobs
+from http_cache import conditional
+from metrics import render_job_runs
+from metrics_store import collect, publish, start_publisher
+from pagination import decode_cursor, encode_cursor, parse_limit
+from product_index import product_index
+from read_pool import get_read_pool
+from reorder_engine import recommend
+from transactions import query_transactions
+from scheduler import Scheduler
 from sales_actual import export_sales_data
-from server_for_analiz_gpt import create_json_files, list_json_files
+from summary import ensure_monthly_summary
+from server_for_analiz_gpt import create_json_files
 from stock_actual import run_products
 from prihod_actual import export_prihod_data
 
@@ -18,11 +32,10 @@ app = Flask(__name__)
 CORS(app)
 
 
-# Function to get database connection
+# Function to borrow a read-only connection from the worker's pool (see read_pool.py);
+# use it as `with get_db_connection() as conn:`, the connection goes back to the pool
 def get_db_connection():
-    conn = sqlite3.connect('/var/data/sales_data.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_read_pool().connection(row_factory=sqlite3.Row)
 
 
 # Helper function to parse date and extract year-month
@@ -76,113 +89,265 @@ def get_data():
     return jsonify(data)
 
 
-# Route to process data and return the required summary
+# Route to return the monthly summary maintained by the exporters (see summary.py)
 @app.route('/summary', methods=['GET'])
+@conditional()
 def get_summary():
-    conn = get_db_connection()
-
-    # Извлечение уникальных SKU из stock_data
-    stock_query = """
-        SELECT strftime('%Y-%m', start_date_str) AS month_year, product_code
-        FROM stock_data
-        GROUP BY month_year, product_code
-    """
-    stock_data = conn.execute(stock_query).fetchall()
-
-    # Извлечение уникальных наименований из prihod за каждый месяц
-    prihod_query = """
-        SELECT strftime('%Y-%m', date) AS month_year, product AS product_name
-        FROM prihod
-        GROUP BY month_year, product_name
-    """
-    prihod_results = conn.execute(prihod_query).fetchall()
-
-    # Извлечение уникальных проданных SKU из sales
-    sku_query = """
-        SELECT strftime('%Y-%m', date) AS month_year, COUNT(DISTINCT product) AS unique_sales_sku
-        FROM sales
-        GROUP BY month_year
-    """
-    sku_results = conn.execute(sku_query).fetchall()
-
-    # Подсчет общей выручки по месяцам
-    revenue_query = """
-        SELECT strftime('%Y-%m', date) AS month_year, SUM(price * quantity) AS total_revenue
-        FROM sales
-        GROUP BY month_year
-    """
-    revenue_results = conn.execute(revenue_query).fetchall()
-
-    conn.close()
-
-    # Обработка данных
-    stock_dict = {}
-    for row in stock_data:
-        month_year = row['month_year']
-        product_code = row['product_code']
-        if month_year not in stock_dict:
-            stock_dict[month_year] = set()
-        stock_dict[month_year].add(product_code)
-
-    prihod_dict = {}
-    for row in prihod_results:
-        month_year = row['month_year']
-        product_name = row['product_name']
-        if month_year not in prihod_dict:
-            prihod_dict[month_year] = set()
-        prihod_dict[month_year].add(product_name)
-
-    summary = []
-    for month_year, stock_products in stock_dict.items():
-        prihod_products = prihod_dict.get(month_year, set())
-
-        # Добавляем недостающие товары из prihod
-        unique_sku_count = len(stock_products | prihod_products)
-
-        # Получаем данные о продажах SKU и выручке
-        sku_data = next((sku for sku in sku_results if sku['month_year'] == month_year), None)
-        revenue_data = next((rev for rev in revenue_results if rev['month_year'] == month_year), None)
-
-        summary.append({
-            'Дата': f'{month_year}-01',
-            'SKU': unique_sku_count,
-            'Продаж SKU': sku_data['unique_sales_sku'] if sku_data else 0,
-            'Выручка': revenue_data['total_revenue'] if revenue_data else 0
-        })
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT month, sku, sales_sku, revenue
+            FROM monthly_summary
+            ORDER BY month
+        ''').fetchall()
+
+    summary = [
+        {
+            'Дата': f"{row['month']}-01",
+            'SKU': row['sku'],
+            'Продаж SKU': row['sales_sku'],
+            'Выручка': row['revenue']
+        }
+        for row in rows
+    ]
 
     return jsonify(summary)
 
 
+# Route to list product JSON files from the in-memory index of the published build.
+# Without parameters returns the plain list of file names as before; with any of
+# q, prefix, sort (name|stock|velocity|last_sale|size), order, limit, cursor
+# returns a page: {"items": [...], "total": ..., "next_cursor": ...}
 @app.route("/files", methods=["GET"])
+@conditional()
 def files():
-    return Response(json.dumps(list_json_files(), ensure_ascii=False), mimetype="application/json")
-
-
-
+    if not request.args:
+        return Response(json.dumps(product_index.file_names(), ensure_ascii=False), mimetype="application/json")
 
+    try:
+        page = product_index.query(
+            q=request.args.get("q"),
+            prefix=request.args.get("prefix"),
+            sort=request.args.get("sort", "name"),
+            order=request.args.get("order", "asc"),
+            limit=parse_limit(request.args.get("limit")),
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(json.dumps(page, ensure_ascii=False), mimetype="application/json")
+
+
+
+
+# GET runs the forecast synchronously (kept for existing clients).
+# POST only queues it: the response is 202 with a job_id, and the result
+# is polled from /gpt_analiz/<job_id>, so workers are not held by the LLM call.
+# mode=local (GET or POST) answers at once from the NumPy reorder engine
+# instead of the LLM, in the same JSON-string format.
 @app.route("/gpt_analiz", methods=["GET", "POST"])
+@conditional(per_day=True)
 def gpt_analiz():
     if request.method == "GET":
         file_name = request.args.get("file_name")
         dostavka = request.args.get("dostavka", type=int)
         zapas = request.args.get("zapas", type=int)
+        mode = request.args.get("mode", "gpt")
     else:  # POST-запрос
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         file_name = data.get("file_name")
         dostavka = data.get("dostavka", 0)
         zapas = data.get("zapas", 0)
+        mode = data.get("mode", "gpt")
 
     if not file_name:
         return jsonify({"error": "file_name is required"}), 400
+    if mode not in ("gpt", "local"):
+        return jsonify({"error": "mode must be gpt or local"}), 400
+
+    if mode == "local":
+        product_name = product_index.product_name(urllib.parse.unquote(file_name))
+        result = recommend(product_name, dostavka, zapas) if product_name else None
+        if result is None:
+            return jsonify({"error": "product not found"}), 404
+        return jsonify(json.dumps(result, ensure_ascii=False))
+
+    if request.method == "POST":
+        job_id, created = gpt_jobs.submit(file_name, dostavka, zapas)
+        if created:
+            print(f"Прогноз для товара {file_name} поставлен в очередь: задание {job_id}")
+        status = "queued" if created else gpt_jobs.get(job_id)["status"]
+        response = jsonify({"job_id": job_id, "status": status})
+        response.status_code = 202
+        response.headers["Location"] = f"/gpt_analiz/{job_id}"
+        return response
 
     print(f"Генерация прогноза для товара {file_name}, со сроком доставки {dostavka} дней и запасом {zapas} шт.")
 
-    result = gpt_api(file_name, dostavka, zapas)  # Просто вызываем синхронно
-    return jsonify(result)
+    stats = {}
+    result = gpt_api(file_name, dostavka, zapas, stats)  # Просто вызываем синхронно
+    response = jsonify(result)
+    response.headers["X-Cache"] = "HIT" if stats.get("cached") else "MISS"
+    # Размер запроса к модели — чтобы видеть эффект от сжатия истории
+    if stats.get("payload_tokens") is not None:
+        response.headers["X-Payload-Tokens"] = str(stats["payload_tokens"])
+    if stats.get("prompt_tokens") is not None:
+        response.headers["X-Prompt-Tokens"] = str(stats["prompt_tokens"])
+    return response
+
+
+# Route to poll an asynchronous forecast: status is queued, running, done or error
+@app.route("/gpt_analiz/<job_id>", methods=["GET"])
+def gpt_analiz_job(job_id):
+    job = gpt_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
     
 
 
-# Function to determine the start date and export sales data
+FORECAST_SORTS = ("recommended_order_date", "recommended_quantity", "product_name")
+
+
+# Route to list batch forecasts, soonest order first by default.
+# Parameters: sort (recommended_order_date|recommended_quantity|product_name), order,
+# before (only orders due on or before this date), status (default done), limit, cursor
+@app.route("/forecasts", methods=["GET"])
+@conditional()
+def forecasts():
+    sort = request.args.get("sort", "recommended_order_date")
+    order = request.args.get("order", "asc")
+    if sort not in FORECAST_SORTS:
+        return jsonify({"error": f"sort must be one of: {', '.join(FORECAST_SORTS)}"}), 400
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "order must be asc or desc"}), 400
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        cursor = decode_cursor(request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conditions = ["status = ?", f"{sort} IS NOT NULL"]
+    params = [request.args.get("status", "done")]
+    if request.args.get("before"):
+        conditions.append("recommended_order_date <= ?")
+        params.append(request.args["before"])
+    if cursor:
+        if len(cursor) != 2:
+            return jsonify({"error": "invalid cursor"}), 400
+        # Keyset: следующая страница начинается сразу после последней строки предыдущей
+        conditions.append(f"({sort}, file_name) {'>' if order == 'asc' else '<'} (?, ?)")
+        params.extend(cursor)
+
+    with get_db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT file_name, product_name, dostavka, zapas, recommended_order_date,
+                   recommended_quantity, justification, updated_at
+            FROM forecasts
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {sort} {order}, file_name {order}
+            LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor((items[-1][sort], items[-1]["file_name"]))
+    return Response(json.dumps({"items": items, "next_cursor": next_cursor}, ensure_ascii=False),
+                    mimetype="application/json")
+
+
+# Route to per-SKU analytics over the last `months` months (default 12):
+# ABC by revenue share, XYZ by weekly demand variation, turnover, sell-through, days of cover.
+# Filters: abc (e.g. AB), xyz (e.g. X), q, in_stock=1; sort, order, limit, cursor.
+# SKUs without sales in the period have xyz null and never match an xyz filter
+@app.route("/analytics/skus", methods=["GET"])
+@conditional(per_day=True)
+def analytics_skus():
+    try:
+        result = query_skus(
+            months=request.args.get("months", 12, type=int),
+            abc=request.args.get("abc"),
+            xyz=request.args.get("xyz"),
+            q=request.args.get("q"),
+            in_stock=request.args.get("in_stock") == "1",
+            sort=request.args.get("sort", "revenue"),
+            order=request.args.get("order", "desc"),
+            limit=parse_limit(request.args.get("limit")),
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(json.dumps(result, ensure_ascii=False), mimetype="application/json")
+
+
+# Route to the ABC × XYZ matrix: SKU count, revenue and stock per cell;
+# SKUs without sales in the period are counted under no_demand
+@app.route("/analytics/abc_xyz", methods=["GET"])
+@conditional(per_day=True)
+def analytics_abc_xyz():
+    result = abc_xyz_matrix(months=request.args.get("months", 12, type=int))
+    return Response(json.dumps(result, ensure_ascii=False), mimetype="application/json")
+
+
+# Function to answer /sales and /prihod: one page of transactions, newest first by default
+def transactions_page(table):
+    try:
+        with get_db_connection() as conn:
+            page = query_transactions(
+                conn, table, request.args,
+                limit=parse_limit(request.args.get("limit")),
+                order=request.args.get("order", "desc"),
+                cursor=request.args.get("cursor"),
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(json.dumps(page, ensure_ascii=False), mimetype="application/json")
+
+
+# Routes to browse transactions with keyset pagination.
+# Filters: product, seller (sales) / supplier (prihod), date_from, date_to (inclusive);
+# order (desc|asc), limit, cursor from the previous page's next_cursor
+@app.route("/sales", methods=["GET"])
+@conditional()
+def sales_page():
+    return transactions_page("sales")
+
+
+@app.route("/prihod", methods=["GET"])
+@conditional()
+def prihod_page():
+    return transactions_page("prihod")
+
+
+# Route to download a whole table (sales, prihod, stock) without copying the DB file.
+# Rows are streamed from the SQLite cursor with chunked transfer, so memory does not
+# grow with the date range. Parameters: format (ndjson|csv), date_from, date_to
+# (inclusive, YYYY-MM-DD), product, seller (sales) or supplier (prihod).
+# The body is gzipped when the client sends Accept-Encoding: gzip.
+@app.route("/export/<table>", methods=["GET"])
+def export_table(table):
+    if table not in EXPORT_TABLES:
+        return jsonify({"error": f"table must be one of: {', '.join(EXPORT_TABLES)}"}), 404
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(FORMATS)}"}), 400
+    try:
+        sql, params, columns = export_query(table, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    compress = bool(request.accept_encodings["gzip"])
+    response = Response(stream_export(table, sql, params, columns, fmt, compress), mimetype=FORMATS[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="{table}.{fmt}"'
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# Function to determine the start date and export sales data.
+# The start date only matters for the first run: after that exporters
+# continue from the watermark stored in sync_state.
 def actual_date():
     start_date = datetime.now().replace(day=1).strftime("%Y-%m-%d")
     # start_date = '2025-01-01'
@@ -210,38 +375,57 @@ def update_file_list():
     print(f"Обновление списка пакетов из директории завершено")
 
 
-# Function to schedule daily task at 22:00
-def schedule_task():
-    schedule.every().day.at("11:15").do(actual_date)
-    schedule.every().day.at("11:40").do(actual_stock)
-    schedule.every().day.at("11:59").do(actual_prihod)
-    schedule.every().day.at("12:15").do(update_file_list)
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute if the scheduled task should run
+def actual_forecasts():
+    run_forecast_batch()
+    print("Batch forecast completed", flush=True)
+
 
+# Daily ETL chain: each job starts when the previous one has succeeded,
+# instead of at fixed clock offsets. Only the leader process (see scheduler.py) runs it.
+# Stock goes after sales and receipts: carrying a stock snapshot forward to a day
+# relies on that day's documents already being in the DB
+scheduler = Scheduler()
+scheduler.add_job("sales", actual_date)
+scheduler.add_job("prihod", actual_prihod, after="sales")
+scheduler.add_job("stock", actual_stock, after="prihod")
+scheduler.add_job("json", update_file_list, after="stock")
+scheduler.add_job("forecasts", actual_forecasts, after="json")
 
-def run_initial_tasks():
-    actual_date()
-    threading.Timer(300, actual_stock).start()
-    threading.Timer(600, actual_prihod).start()
 
+# Route to show the scheduler state: leader pid and the last run of every job
+@app.route("/jobs", methods=["GET"])
+def jobs():
+    return jsonify(scheduler.status())
 
-def run_initial_tasks_gpt_files():
-    update_file_list()
+
+# Route to expose metrics (MoySklad calls, DB writes, ETL stages) and the last job
+# runs from job_runs in the Prometheus text format.
+# Every worker saves its counters to metric_snapshots (see metrics_store.py) and the
+# scrape renders their sum, so any worker answers with the same series, including
+# the ETL counters of the scheduler leader. Counters of finished workers are kept,
+# so a worker restart does not look like a counter reset.
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    try:
+        publish()
+    except sqlite3.OperationalError as e:
+        print(f"Metrics: could not save this worker's metrics: {e}", flush=True)
+    text = collect().render() + render_job_runs(scheduler.status()["jobs"])
+    return Response(text, mimetype="text/plain; version=0.0.4")
 
 
-# Start the scheduling in a separate thread
-task_thread = threading.Thread(target=schedule_task)
-task_thread.start()
+# Bring the database schema (tables, indexes, WAL) up to date before any job or request touches it
+ensure_schema()
+ensure_monthly_summary()
 
-# поток запуска при старте
-# initial_tasks_thread = threading.Thread(target=run_initial_tasks)
-# initial_tasks_thread.start()
+# Start the scheduler thread in every worker; the one that takes the leader lock
+# rebuilds the product JSON at startup and then runs the chain daily at SCHEDULE_AT.
+# SCHEDULER_ENABLED=0 serves the API only (benchmarks, read-only replicas)
+if os.getenv("SCHEDULER_ENABLED", "1") == "1":
+    scheduler.start(daily_at=os.getenv("SCHEDULE_AT", "11:15"), root="sales", initial=["json"])
 
-# поток запуска при старте
-initial_tasks_thread = threading.Thread(target=run_initial_tasks_gpt_files)
-initial_tasks_thread.start()
+# Save this worker's metrics every METRICS_PUBLISH_SECONDS for /metrics on any worker
+start_publisher()
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=3000)
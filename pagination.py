@@ -0,0 +1,64 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right
+
+# Размер страницы по умолчанию и верхняя граница для параметра limit
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# Функция для разбора параметра limit из запроса
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+
+# Функции для непрозрачного курсора: ключ последней записи страницы в base64
+def encode_cursor(key):
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("invalid cursor")
+    if not isinstance(key, list):
+        raise ValueError("invalid cursor")
+    return tuple(key)
+
+
+# Функция для выборки страницы из упорядоченного списка по ключу курсора
+def keyset_page(items, keys, cursor_key, limit, descending=False):
+    """
+    items отсортированы по возрастанию keys (уникальных). Страница начинается
+    сразу после записи с ключом cursor_key, поэтому вставки и удаления между
+    запросами не сдвигают её, как сдвинули бы offset.
+    Возвращает (записи страницы, ключ для следующего курсора или None).
+    """
+    try:
+        if descending:
+            end = len(keys) if cursor_key is None else bisect_left(keys, cursor_key)
+            positions = range(end - 1, max(end - limit - 1, 0) - 1, -1)
+        else:
+            start = 0 if cursor_key is None else bisect_right(keys, cursor_key)
+            positions = range(start, min(start + limit + 1, len(keys)))
+    except TypeError:
+        # Курсор от другой сортировки: ключи несравнимы
+        raise ValueError("invalid cursor")
+
+    positions = list(positions)
+    has_more = len(positions) > limit
+    positions = positions[:limit]
+    next_key = keys[positions[-1]] if has_more else None
+    return [items[position] for position in positions], next_key
@@ -1,38 +1,19 @@
 import sqlite3
-import time
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-
-class MoySkladClient:
-    BASE_URL = 'https://api.moysklad.ru/api/remap/1.2/'
-
-    def __init__(self, username, password):
-        self.session = requests.Session()
-        self.session.auth = (username, password)
-
-    def get(self, endpoint, params=None):
-        if endpoint.startswith("http"):
-            url = endpoint
-        else:
-            url = self.BASE_URL + endpoint
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
-
-    def get_supply(self, organization_url, start_date, limit=1000, offset=0):
-        params = {
-            'filter': f'organization={organization_url};moment>={start_date}',
-            'limit': limit,
-            'offset': offset
-        }
-        return self.get('entity/supply', params=params)
+from db import bump_data_version, connect, delete_document_rows, delete_missing_documents, document_rows, ensure_schema, get_watermark, run_write, set_watermark
+from metrics import metrics
+from moysklad_client import EXPORT_WORKERS, ORGANIZATION_URL, SYNC_RECONCILE_DAYS, document_updated, get_client
+from ref_cache import reference_cache, get_cached_name
+from summary import months_between, refresh_monthly_summary
 
 
 # Функция для очистки данных по приходам
 def clear_existing_prihod_data(start_date):
     try:
-        conn = sqlite3.connect('/var/data/sales_data.db')
+        conn = connect()
         cursor = conn.cursor()
         cursor.execute('DELETE FROM prihod WHERE date >= ?', (start_date + " 00:00:00",))
         conn.commit()
@@ -44,103 +25,137 @@ def clear_existing_prihod_data(start_date):
         print(f"Неожиданная ошибка при очистке данных: {e}")
 
 
-# Функция для сохранения данных о приходах в базу
-def save_prihod_data(document_number, date, supplier, positions):
-    while True:
-        try:
-            conn = sqlite3.connect('/var/data/sales_data.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS prihod (
-                    document_number TEXT,
-                    date TEXT,
-                    supplier TEXT,
-                    product TEXT,
-                    quantity INTEGER,
-                    price INTEGER
-                )
-            ''')
-            for position in positions:
-                product = position['product']
-                quantity = position['quantity']
-                price = position['price']
-
-                cursor.execute('SELECT * FROM prihod WHERE document_number = ? AND date = ? AND product = ?',
-                               (document_number, date, product))
-                if not cursor.fetchone():
-                    cursor.execute('''
-                        INSERT INTO prihod (document_number, date, supplier, product, quantity, price)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (document_number, date, supplier, product, quantity, price))
-            conn.commit()
-            conn.close()
-            break
-        except sqlite3.OperationalError as e:
-            print(f"Ошибка записи в базу данных: {e}. Повторная попытка...")
-            time.sleep(1)
-        except Exception as e:
-            print(f"Неожиданная ошибка: {e}. Повторная попытка...")
-            time.sleep(1)
-
-
-# Функция для экспорта данных по приходам
-def export_prihod_data(start_date):
-    clear_existing_prihod_data(start_date)
-    formatted_start_date = f"{start_date} 00:00:00"
-
-    sklad = MoySkladClient('admin@bayzak1', 'Pospro2023!')
-    organization_url = 'https://api.moysklad.ru/api/remap/1.2/entity/organization/092e4f5f-2391-11e9-9109-f8fc00017cb3'
+# Функция для пакетной записи страницы документов в базу одной транзакцией
+def save_prihod_data(documents, replace=False, touched_months=None):
+    ensure_schema()
+    rows = list(document_rows(documents))
+
+    def write(conn):
+        before = conn.total_changes
+        if replace:
+            # Изменённые документы перезаписываются целиком: старые позиции удаляются,
+            # а сводка месяца, где документ был до смены даты, тоже пересчитывается
+            delete_document_rows(conn, 'prihod', documents, touched_months)
+            before = conn.total_changes
+        # Дубли отсекает уникальный индекс (document_number, date, product)
+        conn.executemany('''
+            INSERT OR IGNORE INTO prihod (document_number, date, supplier, product, quantity, price, document_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return conn.total_changes - before
+
+    inserted = run_write(write)
+    metrics.inc('etl_rows_fetched_total', len(rows), table='prihod')
+    metrics.inc('etl_rows_written_total', inserted, table='prihod')
+    print(f"Записано строк приходов: {inserted} из {len(rows)} ({len(documents)} документов).")
+    return inserted
+
+
+# Функция для сбора одного документа прихода: поставщик и позиции
+def collect_prihod_document(item, sklad):
+    name = item.get('name')
+    moment = item.get('moment').replace(".000", "")
+
+    # Информация о поставщике
+    supplier = item.get('agent', {}).get('name', 'Неизвестный поставщик')
+
+    positions_list = []
+    positions_meta = item.get('positions')
+    if positions_meta:
+        positions_href = positions_meta.get('meta', {}).get('href')
+        if positions_href:
+            positions_response = sklad.get(positions_href)
+
+            if 'rows' in positions_response:
+                for position in positions_response['rows']:
+                    assortment_meta = position.get('assortment', {}).get('meta', {})
+                    if assortment_meta:
+                        assortment_href = assortment_meta.get('href')
+                        position_name = get_cached_name(assortment_href, sklad, "Неизвестный товар")
+                    else:
+                        position_name = "Неизвестный товар"
 
-    limit = 1000
-    offset = 0
+                    quantity = position.get('quantity')
+                    price = position.get('price') / 100
 
-    while True:
-        response = sklad.get_supply(organization_url, formatted_start_date, limit, offset)
-        if 'rows' not in response or not response['rows']:
-            break
-
-        for item in response['rows']:
-            name = item.get('name')
-            moment = item.get('moment').replace(".000", "")
-
-            # Информация о поставщике
-            supplier = item.get('agent', {}).get('name', 'Неизвестный поставщик')
-
-            positions_list = []
-            positions_meta = item.get('positions')
-            if positions_meta:
-                positions_href = positions_meta.get('meta', {}).get('href')
-                if positions_href:
-                    positions_response = sklad.get(positions_href)
-
-                    if 'rows' in positions_response:
-                        for position in positions_response['rows']:
-                            assortment_meta = position.get('assortment', {}).get('meta', {})
-                            if assortment_meta:
-                                assortment_href = assortment_meta.get('href')
-                                assortment_data = sklad.get(assortment_href)
-                                position_name = assortment_data.get('name', "Неизвестный товар")
-                            else:
-                                position_name = "Неизвестный товар"
-
-                            quantity = position.get('quantity')
-                            price = position.get('price') / 100
-
-                            positions_list.append({
-                                'product': position_name,
-                                'quantity': int(quantity),
-                                'price': int(price)
-                            })
-                    else:
-                        print("\tНет позиций в документе.")
-                else:
-                    print("\tНе удалось получить ссылку на позиции.")
+                    positions_list.append({
+                        'product': position_name,
+                        'quantity': int(quantity),
+                        'price': int(price)
+                    })
             else:
-                print("\tНет информации о позициях.")
+                print("\tНет позиций в документе.")
+        else:
+            print("\tНе удалось получить ссылку на позиции.")
+    else:
+        print("\tНет информации о позициях.")
+
+    return name, moment, supplier, positions_list, item.get('id')
+
 
-            save_prihod_data(name, moment, supplier, positions_list)
-        offset += limit
-    print('Закончен сбор данных по приходам с даты: ' + str(start_date))
+# Функция для удаления из базы документов, удалённых в МойСклад
+def reconcile_deleted_prihod(sklad, organization_url):
+    since = (datetime.now() - timedelta(days=SYNC_RECONCILE_DAYS)).strftime("%Y-%m-%d 00:00:00")
+    try:
+        documents = [(item.get('id'), item.get('name'))
+                     for item in sklad.iter_documents('supply', organization_url, since)]
+    except requests.RequestException as e:
+        print(f"Ошибка сверки удалённых документов: {e}")
+        return 0
+    if not documents:
+        # Пустой ответ за месяц скорее говорит о сбое, чем об удалении всего
+        print("Сверка удалённых документов пропущена: API вернул пустой список.")
+        return 0
+    removed = delete_missing_documents('prihod', documents, since)
+    print(f"Удалено документов приходов, отсутствующих в МойСклад: {removed}")
+    return removed
+
+
+# Функция для экспорта данных. start_date используется при первом запуске
+# (или full=True), дальше синхронизируются только изменённые документы.
+def export_prihod_data(start_date, workers=EXPORT_WORKERS, full=False):
+    sklad = get_client()
+    organization_url = ORGANIZATION_URL
+
+    watermark = None if full else get_watermark('supply')
+    if watermark:
+        print(f"Синхронизация документов приходов, изменённых с {watermark}")
+        field, since, replace = 'updated', watermark, True
+    else:
+        clear_existing_prihod_data(start_date)
+        field, since, replace = 'moment', f"{start_date} 00:00:00", False
+    touched_months = set() if watermark else set(months_between(start_date))
+
+    limit = 1000
+    offset = 0
+    newest = watermark
+
+    # Документы страницы собираются параллельно, запись идёт в порядке страницы
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            with metrics.timer('etl_stage_seconds', stage='prihod_fetch_page'):
+                response = sklad.get_supply(organization_url, since, limit, offset, field)
+            if 'rows' not in response or not response['rows']:
+                break
+
+            with metrics.timer('etl_stage_seconds', stage='prihod_collect_positions'):
+                documents = list(pool.map(lambda item: collect_prihod_document(item, sklad), response['rows']))
+            with metrics.timer('etl_stage_seconds', stage='prihod_save'):
+                save_prihod_data(documents, replace=replace, touched_months=touched_months)
+            touched_months.update(document[1][:7] for document in documents)
+            newest = max(filter(None, [newest] + [document_updated(item) for item in response['rows']]), default=None)
+            offset += limit
+
+    with metrics.timer('etl_stage_seconds', stage='prihod_reconcile'):
+        if watermark and reconcile_deleted_prihod(sklad, organization_url):
+            touched_months.update(months_between((datetime.now() - timedelta(days=SYNC_RECONCILE_DAYS)).strftime("%Y-%m-%d")))
+    with metrics.timer('etl_stage_seconds', stage='prihod_summary'):
+        refresh_monthly_summary(touched_months)
+    bump_data_version()
+    # Отметка сдвигается только после успешного прохода
+    set_watermark('supply', newest)
+    print(f"Кэш справочников: {reference_cache.stats()}")
+    print('Закончен сбор данных по приходам с даты: ' + str(since))
 
 
 #start_date = '2021-01-01'
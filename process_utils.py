@@ -0,0 +1,18 @@
+import os
+from datetime import datetime
+
+
+# Функция для текущего локального времени в формате колонок *_at
+def now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Функция для проверки, жив ли процесс pid (воркер, записавший задание)
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
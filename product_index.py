@@ -0,0 +1,117 @@
+import json
+import os
+from threading import Lock
+
+from pagination import decode_cursor, encode_cursor, keyset_page
+from server_for_analiz_gpt import INDEX_FILE_NAME, JSON_DIR_PATH, list_json_files
+
+# Поля, по которым /files умеет сортировать, и их значения в записи индекса
+SORT_FIELDS = {
+    "name": lambda entry: entry["product_name"].casefold(),
+    "stock": lambda entry: entry["stock"],
+    "velocity": lambda entry: entry["velocity"],
+    "last_sale": lambda entry: entry["last_sale"],
+    "size": lambda entry: entry["size"],
+}
+
+
+def _sort_key(entry, sort):
+    value = SORT_FIELDS[sort](entry)
+    # Пустые значения (нет продаж, нет индекса) считаются наименьшими;
+    # имя файла делает ключ уникальным для курсора
+    return (0, None, entry["file_name"]) if value is None else (1, value, entry["file_name"])
+
+
+class ProductIndex:
+    """
+    Индекс опубликованной сборки JSON товаров в памяти.
+    Читает .index.json, который пишет create_json_files, и перечитывает его,
+    только когда сборка сменилась (другой inode или время изменения файла).
+    """
+
+    def __init__(self, directory=JSON_DIR_PATH):
+        self.directory = directory
+        self._lock = Lock()
+        self._signature = None
+        self._entries = []
+        self._sorted = {}
+
+    def _current_signature(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, INDEX_FILE_NAME))
+        except FileNotFoundError:
+            # Сборка без индекса (до первой пересборки) — следим за самим каталогом
+            return ("dir", os.path.realpath(self.directory), os.stat(self.directory).st_mtime_ns)
+        return ("index", stat.st_ino, stat.st_mtime_ns)
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE_NAME), encoding="utf-8") as f:
+                return json.load(f)["products"]
+        except FileNotFoundError:
+            return [
+                {"file_name": file_name, "product_name": os.path.splitext(file_name)[0],
+                 "stock": None, "last_sale": None, "velocity": None, "size": None}
+                for file_name in sorted(list_json_files())
+            ]
+
+    def entries(self):
+        signature = self._current_signature()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._entries = self._load()
+                    self._sorted = {}
+                    self._signature = signature
+        return self._entries
+
+    def _ordered(self, sort):
+        entries = self.entries()
+        ordered = self._sorted.get(sort)
+        if ordered is None:
+            ordered = sorted(((_sort_key(entry, sort), entry) for entry in entries), key=lambda pair: pair[0])
+            self._sorted[sort] = ordered
+        return ordered
+
+    def file_names(self):
+        return [entry["file_name"] for entry in self.entries()]
+
+    def product_name(self, file_name):
+        """Название товара по имени его JSON-файла или None."""
+        for entry in self.entries():
+            if entry["file_name"] == file_name:
+                return entry["product_name"]
+        return None
+
+    def query(self, q=None, prefix=None, sort="name", order="asc", limit=50, cursor=None):
+        """
+        Поиск по названию товара (q — подстрока, prefix — начало, без учёта
+        регистра), сортировка и страница после cursor.
+        Возвращает {"items": [...], "total": ..., "next_cursor": ...}.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+
+        ordered = self._ordered(sort)
+        if q or prefix:
+            q = (q or "").casefold()
+            prefix = (prefix or "").casefold()
+            ordered = [
+                (key, entry) for key, entry in ordered
+                if entry["product_name"].casefold().startswith(prefix) and q in entry["product_name"].casefold()
+            ]
+
+        items, next_key = keyset_page(
+            [entry for _, entry in ordered], [key for key, _ in ordered],
+            decode_cursor(cursor), limit, descending=order == "desc"
+        )
+        return {
+            "items": items,
+            "total": len(ordered),
+            "next_cursor": encode_cursor(next_key) if next_key else None,
+        }
+
+
+product_index = ProductIndex()
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from threading import Lock
+from urllib.parse import quote
+
+from db import DB_PATH, ensure_schema
+from metrics import metrics
+
+# Сколько простаивающих соединений держит пул одного процесса
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 8))
+# Файл базы читается через mmap: страницы берутся из кэша ОС без копирования
+READ_MMAP_SIZE = int(os.getenv("DB_READ_MMAP_SIZE", 256 * 1024 * 1024))
+# Кэш страниц соединения, КиБ (отрицательное значение в PRAGMA cache_size)
+READ_CACHE_SIZE_KIB = 16000
+# Подготовленные запросы, которые соединение держит по тексту SQL
+CACHED_STATEMENTS = 256
+
+
+def _file_id(db_path):
+    stat = os.stat(db_path)
+    return stat.st_dev, stat.st_ino
+
+
+class ReadPool:
+    """
+    Пул соединений только для чтения для эндпоинтов Flask.
+    Соединение открывается с mode=ro и query_only, с mmap и кэшем страниц,
+    и возвращается в пул после запроса — следующий запрос получает тёплый
+    кэш и уже подготовленные запросы. Перед выдачей проверяется, что файл
+    базы тот же (устройство и inode): после подмены файла, например
+    восстановления из копии, соединения открываются заново.
+    После fork пул родителя не используется — у каждого воркера свой.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = []
+        self._lock = Lock()
+        self._pid = os.getpid()
+
+    def _open(self):
+        ensure_schema(self.db_path)
+        file_id = _file_id(self.db_path)
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.db_path))}?mode=ro", uri=True, timeout=30,
+                               check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        conn.execute('PRAGMA query_only=ON')
+        conn.execute(f'PRAGMA mmap_size={READ_MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size=-{READ_CACHE_SIZE_KIB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        metrics.inc('db_read_connections_opened_total')
+        return conn, file_id
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Соединения SQLite нельзя делить между процессами
+                self._idle, self._pid = [], os.getpid()
+            entry = self._idle.pop() if self._idle else None
+        if entry is not None:
+            try:
+                current = _file_id(self.db_path)
+            except OSError:
+                current = None
+            if entry[1] == current:
+                return entry
+            entry[0].close()
+        return self._open()
+
+    def _release(self, entry):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(entry)
+                return
+        entry[0].close()
+
+    @contextmanager
+    def connection(self, row_factory=None):
+        """Соединение из пула на время блока with; при ошибке базы оно закрывается, а не возвращается."""
+        entry = self._acquire()
+        entry[0].row_factory = row_factory
+        broken = False
+        try:
+            yield entry[0]
+        except sqlite3.DatabaseError:
+            broken = True
+            raise
+        finally:
+            if broken:
+                entry[0].close()
+            else:
+                if entry[0].in_transaction:
+                    entry[0].rollback()
+                self._release(entry)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+# Пул процесса для базы db_path
+def get_read_pool(db_path=DB_PATH):
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ReadPool(db_path)
+        return pool
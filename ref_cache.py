@@ -0,0 +1,132 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from db import DB_PATH, connect, ensure_schema
+from metrics import metrics
+
+# Сколько живёт запись справочника (товар, сотрудник) до повторной загрузки
+DEFAULT_TTL = 7 * 24 * 60 * 60
+# Сколько записей держим в памяти процесса
+DEFAULT_LRU_SIZE = 20000
+
+
+class ReferenceCache:
+    """
+    Кэш справочных сущностей МойСклад (товары, модификации, сотрудники) по href.
+    Перед таблицей ref_cache в SQLite стоит LRU в памяти процесса, поэтому
+    повторные обращения к одному товару не уходят ни в API, ни в базу.
+    Записи переживают перезапуск и устаревают по TTL или по полю `updated`.
+    """
+
+    def __init__(self, db_path=DB_PATH, ttl=DEFAULT_TTL, lru_size=DEFAULT_LRU_SIZE):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        if self._conn is None:
+            ensure_schema(self.db_path)
+            self._conn = connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    @staticmethod
+    def _key(href):
+        # Параметры запроса (expand и т.п.) не влияют на саму сущность
+        return href.split('?', 1)[0]
+
+    def _is_fresh(self, entry, updated):
+        data, entry_updated, fetched_at = entry
+        if updated is not None:
+            return entry_updated == updated
+        return time.time() - fetched_at < self.ttl
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key):
+        entry = self._lru.get(key)
+        if entry is not None:
+            self._lru.move_to_end(key)
+            return entry
+        try:
+            row = self._connection().execute(
+                'SELECT data, updated, fetched_at FROM ref_cache WHERE href = ?', (key,)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            print(f"Ошибка чтения кэша справочников: {e}")
+            return None
+        if row is None:
+            return None
+        entry = (json.loads(row[0]), row[1], row[2])
+        self._remember(key, entry)
+        return entry
+
+    def _store(self, key, data):
+        entry = (data, data.get('updated'), time.time())
+        self._remember(key, entry)
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO ref_cache (href, data, updated, fetched_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(data, ensure_ascii=False), entry[1], entry[2])
+            )
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            # Не смогли записать на диск — запись всё равно останется в памяти
+            print(f"Ошибка записи в кэш справочников: {e}")
+
+    def get(self, href, loader, updated=None):
+        """
+        Возвращает сущность по href. Если её нет в кэше, она устарела по TTL
+        или её `updated` отличается от переданного — вызывает loader(href)
+        и сохраняет результат.
+        """
+        key = self._key(href)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and self._is_fresh(entry, updated):
+                self.hits += 1
+                metrics.inc('reference_cache_requests_total', result='hit')
+                return entry[0]
+            self.misses += 1
+        metrics.inc('reference_cache_requests_total', result='miss')
+
+        data = loader(href)
+
+        with self._lock:
+            self._store(key, data)
+        return data
+
+    def invalidate(self, href):
+        key = self._key(href)
+        with self._lock:
+            self._lru.pop(key, None)
+            try:
+                conn = self._connection()
+                conn.execute('DELETE FROM ref_cache WHERE href = ?', (key,))
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                print(f"Ошибка очистки кэша справочников: {e}")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'in_memory': len(self._lru)}
+
+
+# Общий экземпляр для всех экспортёров процесса
+reference_cache = ReferenceCache()
+
+
+# Функция для получения наименования сущности через кэш
+def get_cached_name(href, sklad, default):
+    return reference_cache.get(href, sklad.get).get('name', default)
@@ -0,0 +1,89 @@
+import math
+from datetime import timedelta
+
+import numpy as np
+
+from inventory_data import get_inventory_data
+
+# За сколько последних полных дней считаем среднюю скорость продаж
+VELOCITY_DAYS = 30
+# Насколько тренд месяц к месяцу может поднять или опустить прогноз скорости
+TREND_LIMIT = 0.5
+
+
+def compute_reorder(data, dostavka, zapas):
+    """
+    Расчёт точки заказа сразу для всех SKU из InventoryData.
+    Скорость — среднее за VELOCITY_DAYS дней, тренд — отношение последних
+    30 дней к предыдущим 30, прогноз скорости — скорость с поправкой на тренд
+    (не больше ±TREND_LIMIT). Заказ нужен, когда запаса остаётся на срок
+    поставки; количество — чтобы к приходу партии покрыть zapas дней.
+    Возвращает словарь массивов по строкам data.products.
+    """
+    dostavka = max(int(dostavka or 0), 0)
+    zapas = max(int(zapas or 0), 0)
+
+    recent = data.sales[:, -VELOCITY_DAYS:].sum(axis=1)
+    previous = data.sales[:, -2 * VELOCITY_DAYS:-VELOCITY_DAYS].sum(axis=1)
+    velocity = recent / VELOCITY_DAYS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trend = np.where(previous > 0, recent / previous - 1, 0.0)
+        forecast_velocity = velocity * (1 + np.clip(trend, -TREND_LIMIT, TREND_LIMIT))
+        days_of_cover = np.where(forecast_velocity > 0, data.stock / forecast_velocity, np.inf)
+
+    # Через сколько дней заказывать: когда покрытие сравняется со сроком поставки.
+    # Для товаров без продаж считаем с нулевым сроком, ниже они всё равно отбрасываются
+    order_in = np.clip(np.floor(np.where(np.isfinite(days_of_cover), days_of_cover, 0) - dostavka), 0, None)
+    stock_at_arrival = np.clip(data.stock - forecast_velocity * (order_in + dostavka), 0, None)
+    quantity = np.ceil(np.clip(forecast_velocity * zapas - stock_at_arrival, 0, None))
+    needs_order = (forecast_velocity > 0) & (quantity > 0)
+
+    return {
+        "stock": data.stock,
+        "velocity": velocity,
+        "trend": trend,
+        "forecast_velocity": forecast_velocity,
+        "days_of_cover": days_of_cover,
+        "order_in": np.where(needs_order, order_in, np.nan),
+        "quantity": np.where(needs_order, quantity, 0),
+    }
+
+
+# Функция для рекомендации по одному товару в формате ответа gpt_api
+def recommend(product_name, dostavka, zapas, data=None):
+    data = data or get_inventory_data()
+    position = data.row.get(product_name)
+    if position is None:
+        return None
+    result = {name: values[position] for name, values in compute_reorder(data, dostavka, zapas).items()}
+
+    order_date = None
+    if not math.isnan(result["order_in"]):
+        order_date = (data.today + timedelta(days=int(result["order_in"]))).isoformat()
+    cover = result["days_of_cover"]
+    cover_text = "без продаж" if math.isinf(cover) else f"{cover:.0f} дн."
+
+    justification = (
+        f"Остаток на {data.today.isoformat()}: {result['stock']:.0f} шт. "
+        f"Средняя скорость за {VELOCITY_DAYS} дн.: {result['velocity']:.2f} шт./день, "
+        f"динамика к предыдущим {VELOCITY_DAYS} дн.: {result['trend'] * 100:+.0f}%, "
+        f"прогноз скорости {result['forecast_velocity']:.2f} шт./день. "
+        f"Запаса хватит на {cover_text}, срок поставки {int(dostavka or 0)} дн., "
+        f"запас после прихода — на {int(zapas or 0)} дн."
+    )
+    if order_date is None:
+        justification += " Заказ не нужен: продаж нет или запаса достаточно."
+
+    return {
+        "recommended_order_date": order_date,
+        "recommended_quantity": int(result["quantity"]),
+        "justification": justification,
+        "metrics": {
+            "stock": round(float(result["stock"]), 2),
+            "velocity": round(float(result["velocity"]), 3),
+            "trend": round(float(result["trend"]), 3),
+            "forecast_velocity": round(float(result["forecast_velocity"]), 3),
+            "days_of_cover": None if math.isinf(cover) else round(float(cover), 1),
+            "stock_day": data.stock_day,
+        },
+    }
@@ -1,39 +1,19 @@
 import sqlite3
-import time
 import requests
-from datetime import datetime
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-
-class MoySkladClient:
-    BASE_URL = 'https://api.moysklad.ru/api/remap/1.2/'
-
-    def __init__(self, username, password):
-        self.session = requests.Session()
-        self.session.auth = (username, password)
-
-    def get(self, endpoint, params=None):
-        if endpoint.startswith("http"):  # Проверяем, является ли `endpoint` полным URL
-            url = endpoint
-        else:
-            url = self.BASE_URL + endpoint
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
-
-    def get_retail_demand(self, organization_url, start_date, limit=1000, offset=0):
-        params = {
-            'filter': f'organization={organization_url};moment>={start_date}',
-            'limit': limit,
-            'offset': offset
-        }
-        return self.get('entity/retaildemand', params=params)
+from db import bump_data_version, connect, delete_document_rows, delete_missing_documents, document_rows, ensure_schema, get_watermark, run_write, set_watermark
+from metrics import metrics
+from moysklad_client import EXPORT_WORKERS, ORGANIZATION_URL, SYNC_RECONCILE_DAYS, document_updated, get_client
+from ref_cache import reference_cache, get_cached_name
+from summary import months_between, refresh_monthly_summary
 
 
 # Функция для удаления данных из базы начиная с указанной даты
 def clear_existing_data(start_date):
     try:
-            conn = sqlite3.connect('/var/data/sales_data.db')
+            conn = connect()
             cursor = conn.cursor()
             cursor.execute('DELETE FROM sales WHERE date >= ?', (start_date + " 00:00:00",))
             conn.commit()
@@ -48,10 +28,7 @@ def clear_existing_data(start_date):
 # Функция для получения данных о сотруднике с обработкой ошибок
 def get_employee_data(employee, sklad):
     try:
-        if employee.startswith(MoySkladClient.BASE_URL):
-            return requests.get(employee, auth=sklad.session.auth).json()
-        else:
-            return sklad.get(employee)
+        return reference_cache.get(employee, sklad.get)
     except requests.RequestException as e:
         print(f"Ошибка получения данных сотрудника: {e}")
         return {"name": "Неизвестный пользователь"}
@@ -60,121 +37,153 @@ def get_employee_data(employee, sklad):
 # Функция для получения данных о позициях с обработкой ошибок
 def get_positions_data(positions_href, sklad):
     try:
-        if positions_href.startswith(MoySkladClient.BASE_URL):
-            return requests.get(positions_href, auth=sklad.session.auth).json()
-        else:
-            return sklad.get(positions_href)
+        return sklad.get(positions_href)
     except requests.RequestException as e:
         print(f"Ошибка получения данных позиций: {e}")
         return {"rows": []}
 
 
-# Функция для сохранения данных в базу
-def save_sales_data(document_number, date, seller, positions):
-    while True:
-        try:
-                conn = sqlite3.connect('/var/data/sales_data.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS sales (
-                        document_number TEXT,
-                        date TEXT,
-                        seller TEXT,
-                        product TEXT,
-                        quantity INTEGER,
-                        price INTEGER
-                    )
-                ''')
-                for position in positions:
-                    product = position['product']
-                    quantity = position['quantity']
-                    price = position['price']
-
-                    # Проверка на дубликаты перед вставкой
-                    cursor.execute('SELECT * FROM sales WHERE document_number = ? AND date = ? AND product = ?',
-                                   (document_number, date, product))
-                    if not cursor.fetchone():
-                        cursor.execute('''
-                            INSERT INTO sales (document_number, date, seller, product, quantity, price)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        ''', (document_number, date, seller, product, quantity, price))
-                conn.commit()
-                conn.close()
-                break
-        except sqlite3.OperationalError as e:
-            print(f"Ошибка записи в базу данных: {e}. Повторная попытка...")
-            time.sleep(1)
-        except Exception as e:
-            print(f"Неожиданная ошибка: {e}. Повторная попытка...")
-            time.sleep(1)
+# Функция для пакетной записи страницы документов в базу одной транзакцией
+def save_sales_data(documents, replace=False, touched_months=None):
+    ensure_schema()
+    rows = list(document_rows(documents))
+
+    def write(conn):
+        before = conn.total_changes
+        if replace:
+            # Изменённые документы перезаписываются целиком: старые позиции удаляются,
+            # а сводка месяца, где документ был до смены даты, тоже пересчитывается
+            delete_document_rows(conn, 'sales', documents, touched_months)
+            before = conn.total_changes
+        # Дубли отсекает уникальный индекс (document_number, date, product)
+        conn.executemany('''
+            INSERT OR IGNORE INTO sales (document_number, date, seller, product, quantity, price, document_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return conn.total_changes - before
+
+    inserted = run_write(write)
+    metrics.inc('etl_rows_fetched_total', len(rows), table='sales')
+    metrics.inc('etl_rows_written_total', inserted, table='sales')
+    print(f"Записано строк продаж: {inserted} из {len(rows)} ({len(documents)} документов).")
+    return inserted
+
+
+# Функция для сбора одного документа продажи: продавец и позиции
+def collect_sales_document(item, sklad):
+    name = item.get('name')
+    moment = item.get('moment').replace(".000", "")
+    total_sum = item.get('sum') / 100
+
+    # Информация о продавце (пользователе)
+    employee = item.get('owner', {}).get('meta', {}).get('href')
+    if employee:
+        employee_data = get_employee_data(employee, sklad)
+        employee_name = employee_data.get('name', 'Неизвестный пользователь')
+    else:
+        employee_name = "Неизвестный пользователь"
+
+    # print("-" * 50)
+    # print(f"Документ: {name}, Дата: {moment}, Сумма: {int(total_sum)}, Продавец: {employee_name}")
+
+    positions_list = []
+    positions_meta = item.get('positions')
+    if positions_meta:
+        positions_href = positions_meta.get('meta', {}).get('href')
+        if positions_href:
+            positions_response = get_positions_data(positions_href, sklad)
+
+            if 'rows' in positions_response:
+                for position in positions_response['rows']:
+                    assortment_meta = position.get('assortment', {}).get('meta', {})
+                    if assortment_meta:
+                        assortment_href = assortment_meta.get('href')
+                        position_name = get_cached_name(assortment_href, sklad, "Неизвестный товар")
+                    else:
+                        position_name = "Неизвестный товар"
 
+                    quantity = position.get('quantity')
+                    price = position.get('price') / 100
 
-# Функция для экспорта данных о продажах
-def export_sales_data(start_date):
-    clear_existing_data(start_date)
-    formatted_start_date = f"{start_date} 00:00:00"
+                    # print(f"\tПозиция: {position_name}, Кол-во: {int(quantity)}, Цена: {int(price)}")
 
-    sklad = MoySkladClient('admin@bayzak1', 'Pospro2023!')
-    organization_url = 'https://api.moysklad.ru/api/remap/1.2/entity/organization/092e4f5f-2391-11e9-9109-f8fc00017cb3'
+                    positions_list.append({
+                        'product': position_name,
+                        'quantity': int(quantity),
+                        'price': int(price)
+                    })
+            else:
+                print("\tНет позиций в документе.")
+        else:
+            print("\tНе удалось получить ссылку на позиции.")
+    else:
+        print("\tНет информации о позициях.")
+
+    return name, moment, employee_name, positions_list, item.get('id')
+
+
+# Функция для удаления из базы документов, удалённых в МойСклад
+def reconcile_deleted_sales(sklad, organization_url):
+    since = (datetime.now() - timedelta(days=SYNC_RECONCILE_DAYS)).strftime("%Y-%m-%d 00:00:00")
+    try:
+        documents = [(item.get('id'), item.get('name'))
+                     for item in sklad.iter_documents('retaildemand', organization_url, since)]
+    except requests.RequestException as e:
+        print(f"Ошибка сверки удалённых документов: {e}")
+        return 0
+    if not documents:
+        # Пустой ответ за месяц скорее говорит о сбое, чем об удалении всего
+        print("Сверка удалённых документов пропущена: API вернул пустой список.")
+        return 0
+    removed = delete_missing_documents('sales', documents, since)
+    print(f"Удалено документов продаж, отсутствующих в МойСклад: {removed}")
+    return removed
+
+
+# Функция для экспорта данных. start_date используется при первом запуске
+# (или full=True), дальше синхронизируются только изменённые документы.
+def export_sales_data(start_date, workers=EXPORT_WORKERS, full=False):
+    sklad = get_client()
+    organization_url = ORGANIZATION_URL
+
+    watermark = None if full else get_watermark('retaildemand')
+    if watermark:
+        print(f"Синхронизация документов продаж, изменённых с {watermark}")
+        field, since, replace = 'updated', watermark, True
+    else:
+        clear_existing_data(start_date)
+        field, since, replace = 'moment', f"{start_date} 00:00:00", False
+    touched_months = set() if watermark else set(months_between(start_date))
 
     limit = 1000
     offset = 0
+    newest = watermark
+
+    # Позиции документов страницы загружаются параллельно, а map сохраняет
+    # порядок документов, поэтому запись в базу идёт в исходном порядке.
+    # Общее число одновременных запросов всё равно ограничивает клиент.
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            with metrics.timer('etl_stage_seconds', stage='sales_fetch_page'):
+                response = sklad.get_retail_demand(organization_url, since, limit, offset, field)
+            if 'rows' not in response or not response['rows']:
+                break
 
-    while True:
-        response = sklad.get_retail_demand(organization_url, formatted_start_date, limit, offset)
-        if 'rows' not in response or not response['rows']:
-            break
-
-        for item in response['rows']:
-            name = item.get('name')
-            moment = item.get('moment').replace(".000", "")
-            total_sum = item.get('sum') / 100
-
-            # Информация о продавце (пользователе)
-            employee = item.get('owner', {}).get('meta', {}).get('href')
-            if employee:
-                employee_data = get_employee_data(employee, sklad)
-                employee_name = employee_data.get('name', 'Неизвестный пользователь')
-            else:
-                employee_name = "Неизвестный пользователь"
-
-            # print("-" * 50)
-            # print(f"Документ: {name}, Дата: {moment}, Сумма: {int(total_sum)}, Продавец: {employee_name}")
-
-            positions_list = []
-            positions_meta = item.get('positions')
-            if positions_meta:
-                positions_href = positions_meta.get('meta', {}).get('href')
-                if positions_href:
-                    positions_response = get_positions_data(positions_href, sklad)
-
-                    if 'rows' in positions_response:
-                        for position in positions_response['rows']:
-                            assortment_meta = position.get('assortment', {}).get('meta', {})
-                            if assortment_meta:
-                                assortment_href = assortment_meta.get('href')
-                                assortment_data = sklad.get(assortment_href)
-                                position_name = assortment_data.get('name', "Неизвестный товар")
-                            else:
-                                position_name = "Неизвестный товар"
-
-                            quantity = position.get('quantity')
-                            price = position.get('price') / 100
-
-                            # print(f"\tПозиция: {position_name}, Кол-во: {int(quantity)}, Цена: {int(price)}")
-
-                            positions_list.append({
-                                'product': position_name,
-                                'quantity': int(quantity),
-                                'price': int(price)
-                            })
-                    else:
-                        print("\tНет позиций в документе.")
-                else:
-                    print("\tНе удалось получить ссылку на позиции.")
-            else:
-                print("\tНет информации о позициях.")
-
-            save_sales_data(name, moment, employee_name, positions_list)
-        offset += limit
-    print('Закончен сбор продаж с даты: ' + str(start_date))
+            with metrics.timer('etl_stage_seconds', stage='sales_collect_positions'):
+                documents = list(pool.map(lambda item: collect_sales_document(item, sklad), response['rows']))
+            with metrics.timer('etl_stage_seconds', stage='sales_save'):
+                save_sales_data(documents, replace=replace, touched_months=touched_months)
+            touched_months.update(document[1][:7] for document in documents)
+            newest = max(filter(None, [newest] + [document_updated(item) for item in response['rows']]), default=None)
+            offset += limit
+
+    with metrics.timer('etl_stage_seconds', stage='sales_reconcile'):
+        if watermark and reconcile_deleted_sales(sklad, organization_url):
+            touched_months.update(months_between((datetime.now() - timedelta(days=SYNC_RECONCILE_DAYS)).strftime("%Y-%m-%d")))
+    with metrics.timer('etl_stage_seconds', stage='sales_summary'):
+        refresh_monthly_summary(touched_months)
+    bump_data_version()
+    # Отметка сдвигается только после успешного прохода
+    set_watermark('retaildemand', newest)
+    print(f"Кэш справочников: {reference_cache.stats()}")
+    print('Закончен сбор продаж с даты: ' + str(since))
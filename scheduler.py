@@ -0,0 +1,239 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+import schedule
+
+from db import DB_PATH, connect, ensure_schema, run_write
+from metrics import metrics, run_summary
+from process_utils import now, process_alive
+
+# Файл блокировки: задания выполняет только процесс, который её удерживает
+LEADER_LOCK_PATH = os.getenv("SCHEDULER_LOCK", "/var/data/scheduler.lock")
+# Как часто проверяем расписание и пытаемся стать ведущим
+TICK_SECONDS = 30
+
+JOB_RUN_FIELDS = ("id", "job", "status", "trigger", "pid", "started_at", "finished_at", "duration", "error",
+                  "metrics")
+
+
+class Job:
+    def __init__(self, name, func, after=None):
+        self.name = name
+        self.func = func
+        self.after = after
+        self.lock = threading.Lock()
+
+
+class Scheduler:
+    """
+    Планировщик ETL для нескольких воркеров gunicorn. Задания запускает
+    только ведущий процесс — тот, кто удерживает flock на LEADER_LOCK_PATH;
+    остальные периодически пробуют её взять и подхватывают работу, если
+    ведущий завершился. Задания связаны в цепочку (after): следующее
+    стартует, когда предыдущее успешно закончилось, а не по часам.
+    Каждый запуск пишется в job_runs; повторный запуск уже идущего
+    задания пропускается.
+    """
+
+    def __init__(self, db_path=DB_PATH, lock_path=LEADER_LOCK_PATH):
+        self.db_path = db_path
+        self.lock_path = lock_path
+        self.jobs = {}
+        self._lock_file = None
+        self._schedule = schedule.Scheduler()
+
+    def add_job(self, name, func, after=None):
+        if after is not None and after not in self.jobs:
+            raise ValueError(f"unknown job {after!r}")
+        self.jobs[name] = Job(name, func, after)
+
+    def dependents(self, name):
+        return [job.name for job in self.jobs.values() if job.after == name]
+
+    def is_leader(self):
+        return self._lock_file is not None
+
+    def try_become_leader(self):
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # В файле — pid ведущего, его показывает /jobs
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        print(f"Планировщик: процесс {os.getpid()} стал ведущим", flush=True)
+        ensure_schema(self.db_path)
+        self._mark_interrupted()
+        return True
+
+    def leader_pid(self):
+        try:
+            with open(self.lock_path) as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return None
+        return pid if pid and process_alive(pid) else None
+
+    def _record_start(self, name, trigger):
+        def write(conn):
+            cursor = conn.execute(
+                "INSERT INTO job_runs (job, status, trigger, pid, started_at) VALUES (?, 'running', ?, ?, ?)",
+                (name, trigger, os.getpid(), now())
+            )
+            return cursor.lastrowid
+
+        return run_write(write, self.db_path)
+
+    def _record_finish(self, run_id, status, duration=None, error=None, summary=None):
+        def write(conn):
+            conn.execute(
+                "UPDATE job_runs SET status = ?, finished_at = ?, duration = ?, error = ?, metrics = ? WHERE id = ?",
+                (status, now(), duration, error, json.dumps(summary, ensure_ascii=False) if summary else None,
+                 run_id)
+            )
+
+        run_write(write, self.db_path)
+
+    def _running_elsewhere(self, name):
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT pid FROM job_runs WHERE job = ? AND status = 'running' AND pid != ?", (name, os.getpid())
+            ).fetchall()
+        finally:
+            conn.close()
+        return any(process_alive(pid) for pid, in rows)
+
+    def _skip(self, name, trigger):
+        run_id = self._record_start(name, trigger)
+        self._record_finish(run_id, "skipped", error="already running")
+        print(f"Планировщик: {name} уже выполняется, запуск пропущен", flush=True)
+        return "skipped"
+
+    def _mark_interrupted(self):
+        """Запуски, чей процесс умер, не закончатся — помечаем их прерванными."""
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT id, pid FROM job_runs WHERE status = 'running'").fetchall()
+        finally:
+            conn.close()
+        for run_id, pid in rows:
+            if not process_alive(pid):
+                self._record_finish(run_id, "interrupted")
+
+    def run_job(self, name, trigger="schedule", with_dependents=True):
+        """
+        Выполняет задание и, если оно прошло успешно, зависящие от него.
+        Возвращает статус задания: success, failed или skipped.
+        """
+        ensure_schema(self.db_path)
+        job = self.jobs[name]
+        if not job.lock.acquire(blocking=False):
+            return self._skip(name, trigger)
+
+        try:
+            if self._running_elsewhere(name):
+                return self._skip(name, trigger)
+            run_id = self._record_start(name, trigger)
+            before = metrics.snapshot()
+            started = time.monotonic()
+            try:
+                job.func()
+                status, error = "success", None
+            except Exception as e:
+                status, error = "failed", f"{type(e).__name__}: {e}"
+                print(f"Планировщик: задание {name} завершилось ошибкой: {error}", flush=True)
+            duration = round(time.monotonic() - started, 3)
+            metrics.observe('job_duration_seconds', duration, job=name)
+            # Счётчики общие для процесса: в сводку попадают и запросы, пришедшие за время задания
+            summary = run_summary(before, metrics.snapshot(), duration)
+            try:
+                self._record_finish(run_id, status, duration, error, summary)
+            except Exception as e:
+                # Задание уже выполнено: цепочка продолжается, запуск останется в статусе running
+                print(f"Планировщик: не удалось записать итог {name}: {type(e).__name__}: {e}", flush=True)
+            print(f"Планировщик: {name} — {status} за {duration} с", flush=True)
+        finally:
+            job.lock.release()
+
+        if status == "success" and with_dependents:
+            for dependent in self.dependents(name):
+                self.run_job(dependent, trigger=f"after:{name}")
+        return status
+
+    def _run_logged(self, name, trigger="schedule", with_dependents=True):
+        """run_job для фонового потока: ошибка записи в job_runs не должна его завершить."""
+        try:
+            return self.run_job(name, trigger, with_dependents)
+        except Exception as e:
+            print(f"Планировщик: запуск {name} не состоялся: {type(e).__name__}: {e}", flush=True)
+            return "failed"
+
+    def _wait_for_leadership(self):
+        while True:
+            try:
+                if self.try_become_leader():
+                    return
+            except Exception as e:
+                print(f"Планировщик: ошибка при попытке стать ведущим: {type(e).__name__}: {e}", flush=True)
+            time.sleep(TICK_SECONDS)
+
+    def _loop(self, daily_at, root, initial):
+        self._wait_for_leadership()
+        for name in initial:
+            self._run_logged(name, trigger="startup", with_dependents=False)
+        self._schedule.every().day.at(daily_at).do(self._run_logged, root)
+        while True:
+            try:
+                self._schedule.run_pending()
+            except Exception as e:
+                print(f"Планировщик: ошибка в цикле расписания: {type(e).__name__}: {e}", flush=True)
+            time.sleep(TICK_SECONDS)
+
+    def start(self, daily_at, root, initial=()):
+        """
+        Запускает фоновый поток: ждёт лидерства, выполняет задания initial
+        (без зависимых), затем каждый день в daily_at — цепочку от root.
+        """
+        thread = threading.Thread(target=self._loop, args=(daily_at, root, list(initial)),
+                                  name="scheduler", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        """Последний и последний успешный запуск каждого задания, pid ведущего процесса."""
+        ensure_schema(self.db_path)
+        conn = connect(self.db_path)
+        try:
+            def latest(condition):
+                rows = conn.execute(f'''
+                    SELECT {', '.join(JOB_RUN_FIELDS)} FROM job_runs
+                    WHERE id IN (SELECT MAX(id) FROM job_runs {condition} GROUP BY job)
+                ''').fetchall()
+                runs = {row[1]: dict(zip(JOB_RUN_FIELDS, row)) for row in rows}
+                for run in runs.values():
+                    run["metrics"] = json.loads(run["metrics"]) if run["metrics"] else None
+                return runs
+
+            last_runs = latest("")
+            last_successes = latest("WHERE status = 'success'")
+        finally:
+            conn.close()
+        return {
+            "leader_pid": self.leader_pid(),
+            "jobs": [
+                {"name": job.name, "after": job.after, "last_run": last_runs.get(job.name),
+                 "last_success": last_successes.get(job.name)}
+                for job in self.jobs.values()
+            ],
+        }
@@ -1,15 +1,33 @@
-import sqlite3
+import hashlib
 import json
 import os
 import re
+import shutil
+from datetime import datetime, timedelta
+from itertools import groupby
 
+from db import bump_data_version, connect, ensure_schema, run_write
+from metrics import metrics
 
-DB_PATH = "/var/data/sales_data.db"
-JSON_DIR_PATH = "/var/data/products_json/"
+JSON_DIR_PATH = os.path.join(os.getenv("PRODUCTS_JSON_DIR", "/var/data/products_json"), "")
 
-# DB_PATH = "sales_data.db"
 # JSON_DIR_PATH = "products_json/"
 
+# JSON_DIR_PATH — символическая ссылка на последнюю опубликованную сборку.
+# Сборки лежат рядом в JSON_BUILDS_PATH, ссылка переключается атомарно.
+JSON_LINK_PATH = JSON_DIR_PATH.rstrip("/")
+JSON_BUILDS_PATH = JSON_LINK_PATH + ".builds"
+# Сколько сборок хранить (текущая и предыдущая — для читателей, открывших её файлы)
+KEEP_BUILDS = 2
+
+# С какой даты история транзакций попадает в JSON товара
+HISTORY_START = '2024-06-01'
+
+# Скрытый файл сборки с метаданными товаров, которые /files отдаёт из памяти
+INDEX_FILE_NAME = ".index.json"
+# За сколько последних дней считаем среднюю скорость продаж в индексе
+VELOCITY_DAYS = 30
+
 # Создаём папку для JSON, если её нет
 os.makedirs(JSON_DIR_PATH, exist_ok=True)
 
@@ -23,83 +41,263 @@ def list_json_files():
     """
     Возвращает список всех файлов в директории JSON_DIR_PATH.
     Не создаёт/не обновляет никаких файлов — только читает директорию.
+    Скрытые служебные файлы (индекс сборки) в список не входят.
     """
     return [
         f for f in os.listdir(JSON_DIR_PATH)
-        if os.path.isfile(os.path.join(JSON_DIR_PATH, f))
+        if not f.startswith(".") and os.path.isfile(os.path.join(JSON_DIR_PATH, f))
     ]
 
 
-def create_json_files():
+# Функция для потоковой записи JSON одного товара: история пишется по мере чтения
+def write_product_json(directory, product_name, stock_quantity, transactions):
+    json_file_path = os.path.join(directory, f"{sanitize_filename(product_name)}.json")
+    current_stock = stock_quantity
+
+    with open(json_file_path, "w", encoding="utf-8") as f:
+        f.write('{\n    "product_name": ' + json.dumps(product_name, ensure_ascii=False))
+        f.write(',\n    "stock": ' + json.dumps(stock_quantity))
+        f.write(',\n    "history": [')
+
+        for index, (date, quantity, price, trans_type) in enumerate(transactions):
+            if trans_type == 'prihod':
+                entry = {"type": "prihod", "date": date, "quantity": quantity, "price": price,
+                         "stock_after": current_stock}
+                current_stock += quantity
+            else:  # sales
+                entry = {"type": "sales", "date": date, "quantity": quantity, "price": price,
+                         "stock_after": current_stock - quantity}
+                current_stock -= quantity
+            f.write((',' if index else '') + '\n        ' + json.dumps(entry, ensure_ascii=False))
+
+        f.write('\n    ]\n}\n')
+
+    return os.path.basename(json_file_path)
+
+
+# Функция для расчёта отпечатков товаров: меняется отпечаток — меняется JSON
+def product_fingerprints(conn):
     """
-    1. Удаляем все файлы в JSON_DIR_PATH (полная очистка папки).
-    2. Подключаемся к БД, берём список товаров и их остатки.
-    3. По каждому товару формируем JSON, сохраняем на диск.
-    4. Возвращаем список (уже новых) файлов в директории.
+    Возвращает {товар: (остаток, отпечаток)} для всех товаров с остатком.
+    Отпечаток собран из последнего остатка и агрегатов приходов/продаж
+    (количество строк, суммы, взвешенные даты), которые попадают в JSON.
     """
-    # Шаг 1. Полная очистка папки с JSON‑файлами
-    existing_files = list_json_files()
-    for filename in existing_files:
-        os.remove(os.path.join(JSON_DIR_PATH, filename))
-
-    # Шаг 2. Подключаемся к БД и получаем товары
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT DISTINCT product_name, stock_quantity
-        FROM stock_data
-        WHERE stock_quantity > 0
-    """)
-    products = cursor.fetchall()
-
-    # Шаг 3. Формируем для каждого товара отдельный JSON‑файл
-    for product_name, stock_quantity in products:
-        product_data = {
-            "product_name": product_name,
-            "stock": stock_quantity,
-            "history": []
-        }
+    products = {
+        name: [stock, ""]
+        for name, stock, _ in conn.execute("""
+            SELECT product_name, stock_quantity, MAX(start_date_str)
+            FROM stock_data
+            WHERE stock_quantity > 0
+            GROUP BY product_name
+        """)
+    }
+    for product, trans_type, *aggregates in conn.execute("""
+        SELECT product, type, COUNT(*), TOTAL(quantity), TOTAL(price * quantity),
+               TOTAL(julianday(date) * (quantity + 1)), MAX(date)
+        FROM (
+            SELECT product, date, quantity, price, 'prihod' AS type FROM prihod WHERE date >= :since
+            UNION ALL
+            SELECT product, date, quantity, price, 'sales' AS type FROM sales WHERE date >= :since
+        )
+        GROUP BY product, type
+    """, {"since": HISTORY_START}):
+        if product in products:
+            products[product][1] += f"|{trans_type}:{aggregates}"
+
+    return {
+        name: (stock, hashlib.md5(f"{stock}{history}".encode("utf-8")).hexdigest())
+        for name, (stock, history) in products.items()
+    }
+
+
+# Функция для потоковой записи JSON выбранных товаров в каталог сборки
+def write_products(conn, directory, products):
+    """
+    products — {товар: остаток}. Товары и их транзакции читаются двумя
+    упорядоченными курсорами; история товара пишется в файл прямо из курсора,
+    и файл закрывается, как только начинается следующий товар.
+    """
+    conn.execute("DROP TABLE IF EXISTS temp.json_products")
+    conn.execute("CREATE TEMP TABLE json_products (product_name TEXT PRIMARY KEY, stock_quantity INTEGER)")
+    conn.executemany("INSERT INTO temp.json_products VALUES (?, ?)", products.items())
+    conn.commit()
 
-        # Собираем приходы и продажи
-        cursor.execute("""
-            SELECT date, quantity, price, 'prihod' AS type
-            FROM prihod
-            WHERE product = ? AND date >= '2024-06-01'
+    ordered = conn.execute("SELECT product_name, stock_quantity FROM temp.json_products ORDER BY product_name")
+    transactions = conn.cursor().execute("""
+        SELECT product, date, quantity, price, type FROM (
+            SELECT product, date, quantity, price, 'prihod' AS type FROM prihod WHERE date >= :since
             UNION ALL
-            SELECT date, quantity, price, 'sales' AS type
+            SELECT product, date, quantity, price, 'sales' AS type FROM sales WHERE date >= :since
+        )
+        WHERE product IN (SELECT product_name FROM temp.json_products)
+        ORDER BY product, date, type
+    """, {"since": HISTORY_START})
+
+    # Слияние двух упорядоченных потоков по названию товара
+    groups = groupby(transactions, key=lambda row: row[0])
+    current_product, current_rows = next(groups, (None, iter(())))
+    written = {}
+
+    for product_name, stock_quantity in ordered:
+        # Транзакции товаров, которые идут раньше текущего, не относятся к выгрузке
+        while current_product is not None and current_product < product_name:
+            current_product, current_rows = next(groups, (None, iter(())))
+
+        if current_product == product_name:
+            history = (row[1:] for row in current_rows)
+        else:
+            history = ()
+        written[product_name] = write_product_json(directory, product_name, stock_quantity, history)
+
+    conn.execute("DROP TABLE temp.json_products")
+    return written
+
+
+# Функция для сбора метаданных товаров сборки: остаток, последняя продажа, скорость, размер
+def build_index_entries(conn, directory, files, stocks):
+    """
+    files — {товар: имя файла} в каталоге directory, stocks — {товар: остаток}.
+    Скорость продаж — проданные штуки за последние VELOCITY_DAYS дней в среднем за день.
+    """
+    since = (datetime.now() - timedelta(days=VELOCITY_DAYS)).strftime("%Y-%m-%d")
+    sales_stats = {
+        product: (last_sale, sold)
+        for product, last_sale, sold in conn.execute("""
+            SELECT product, MAX(date), TOTAL(CASE WHEN date >= ? THEN quantity END)
             FROM sales
-            WHERE product = ? AND date >= '2024-06-01'
-            ORDER BY date
-        """, (product_name, product_name))
-        transactions = cursor.fetchall()
+            GROUP BY product
+        """, (since,))
+    }
 
-        current_stock = stock_quantity
+    entries = []
+    for name, file_name in files.items():
+        last_sale, sold = sales_stats.get(name, (None, 0))
+        entries.append({
+            "file_name": file_name,
+            "product_name": name,
+            "stock": stocks.get(name),
+            "last_sale": last_sale[:10] if last_sale else None,
+            "velocity": round(sold / VELOCITY_DAYS, 3),
+            "size": os.path.getsize(os.path.join(directory, file_name)),
+        })
+    entries.sort(key=lambda entry: entry["file_name"])
+    return entries
 
-        for date, quantity, price, trans_type in transactions:
-            if trans_type == 'prihod':
-                product_data["history"].append({
-                    "type": "prihod",
-                    "date": date,
-                    "quantity": quantity,
-                    "price": price,
-                    "stock_after": current_stock
-                })
-                current_stock += quantity
-            else:  # sales
-                product_data["history"].append({
-                    "type": "sales",
-                    "date": date,
-                    "quantity": quantity,
-                    "price": price,
-                    "stock_after": current_stock - quantity
-                })
-                current_stock -= quantity
 
-        # Сохраняем в отдельный JSON‑файл
-        json_file_path = os.path.join(JSON_DIR_PATH, f"{sanitize_filename(product_name)}.json")
-        with open(json_file_path, "w", encoding="utf-8") as f:
-            json.dump(product_data, f, ensure_ascii=False, indent=4)
+# Функция для записи индекса сборки; возвращает True, если его содержимое изменилось
+def write_index(directory, entries):
+    index_path = os.path.join(directory, INDEX_FILE_NAME)
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            if json.load(f).get("products") == entries:
+                return False
+    except (OSError, ValueError):
+        pass
+
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "products": entries},
+                  f, ensure_ascii=False)
+    # Читатели видят либо прежний индекс, либо новый целиком
+    os.replace(temp_path, index_path)
+    return True
+
+
+# Функция для атомарной публикации каталога сборки под путём JSON_DIR_PATH
+def publish_build(build_dir):
+    if os.path.isdir(JSON_LINK_PATH) and not os.path.islink(JSON_LINK_PATH):
+        # Первый запуск: старый обычный каталог уходит в архив сборок
+        os.rename(JSON_LINK_PATH, os.path.join(JSON_BUILDS_PATH, "legacy-" + datetime.now().strftime("%Y%m%d%H%M%S")))
+    temp_link = JSON_LINK_PATH + ".tmp"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(os.path.relpath(build_dir, os.path.dirname(JSON_LINK_PATH) or "."), temp_link)
+    # rename поверх ссылки атомарен: читатели видят либо старую, либо новую сборку целиком
+    os.replace(temp_link, JSON_LINK_PATH)
+
+    builds = sorted(os.listdir(JSON_BUILDS_PATH), key=lambda name: os.path.getmtime(os.path.join(JSON_BUILDS_PATH, name)))
+    for name in builds[:-KEEP_BUILDS]:
+        path = os.path.join(JSON_BUILDS_PATH, name)
+        if os.path.realpath(path) != os.path.realpath(build_dir):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def create_json_files():
+    """
+    1. Считаем отпечатки товаров и сравниваем с прошлой сборкой (json_build_state).
+    2. Если ничего не изменилось — выходим, опубликованные файлы остаются как есть.
+    3. Собираем новый каталог: неизменённые файлы — жёсткими ссылками
+       на прошлую сборку, изменённые и новые — потоковой записью из БД.
+    4. Пишем в каталог индекс товаров для /files (.index.json), атомарно
+       переключаем JSON_DIR_PATH на новый каталог и сохраняем отпечатки.
+    5. Возвращаем список файлов опубликованной сборки.
+    """
+    ensure_schema()
+    os.makedirs(JSON_BUILDS_PATH, exist_ok=True)
+    conn = connect()
+    try:
+        # Шаг 1. Текущие и опубликованные отпечатки
+        with metrics.timer('etl_stage_seconds', stage='json_fingerprints'):
+            current = product_fingerprints(conn)
+        previous = {
+            name: (file_name, fingerprint)
+            for name, file_name, fingerprint in conn.execute(
+                "SELECT product_name, file_name, fingerprint FROM json_build_state"
+            )
+        }
+        published = set(list_json_files())
+
+        unchanged = {
+            name: previous[name][0]
+            for name, (_, fingerprint) in current.items()
+            if name in previous and previous[name][1] == fingerprint and previous[name][0] in published
+        }
+        stocks = {name: stock for name, (stock, _) in current.items()}
+        dirty = {name: stock for name, stock in stocks.items() if name not in unchanged}
+        removed = set(previous) - set(current)
+
+        # Шаг 2. Нечего пересобирать: обновляем только индекс (скорость продаж зависит от даты)
+        if not dirty and not removed and published == set(unchanged.values()):
+            print("JSON товаров актуальны, пересборка не нужна.")
+            if write_index(JSON_DIR_PATH, build_index_entries(conn, JSON_DIR_PATH, unchanged, stocks)):
+                bump_data_version()
+            return list_json_files()
+
+        # Шаг 3. Новый каталог сборки
+        build_dir = os.path.join(JSON_BUILDS_PATH, datetime.now().strftime("%Y%m%d%H%M%S%f"))
+        os.makedirs(build_dir)
+        with metrics.timer('etl_stage_seconds', stage='json_link_unchanged'):
+            for file_name in unchanged.values():
+                source = os.path.join(JSON_DIR_PATH, file_name)
+                target = os.path.join(build_dir, file_name)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+        with metrics.timer('etl_stage_seconds', stage='json_write'):
+            written = write_products(conn, build_dir, dirty)
+
+        # Шаг 4. Индекс, публикация и сохранение отпечатков
+        files = {**unchanged, **written}
+        with metrics.timer('etl_stage_seconds', stage='json_publish'):
+            write_index(build_dir, build_index_entries(conn, build_dir, files, stocks))
+            publish_build(build_dir)
+
+        def save_state(write_conn):
+            write_conn.execute("DELETE FROM json_build_state")
+            write_conn.executemany(
+                "INSERT INTO json_build_state (product_name, file_name, fingerprint) VALUES (?, ?, ?)",
+                [(name, files[name], current[name][1]) for name in files]
+            )
 
-    conn.close()
+        run_write(save_state)
+    finally:
+        conn.close()
 
+    metrics.inc('json_files_total', len(written), state='written')
+    metrics.inc('json_files_total', len(unchanged), state='linked')
+    metrics.inc('json_files_total', len(removed), state='removed')
+    print(f"JSON товаров: пересобрано {len(written)}, без изменений {len(unchanged)}, удалено {len(removed)}.")
+    bump_data_version()
+    # Шаг 5. Список файлов опубликованной сборки
+    return list_json_files()
@@ -1,158 +1,238 @@
+import os
 import requests
-from requests.auth import HTTPBasicAuth
-from datetime import datetime
-import calendar
-import sqlite3
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from db import bump_data_version, connect, ensure_schema, get_watermark, run_write, set_watermark
+from metrics import metrics
+from moysklad_client import EXPORT_WORKERS, ORGANIZATION_URL, get_client
+from summary import months_between, refresh_monthly_summary
+
+STORE_IDS = [
+    "https://api.moysklad.ru/api/remap/1.2/entity/store/09304ed8-2391-11e9-9109-f8fc00017cb5",
+    "https://api.moysklad.ru/api/remap/1.2/entity/store/2e8092ab-71bd-11ef-0a80-0c29000f676c"
+]
+
+# Переносить ли снимок предыдущего дня на дни без движения товара вместо запроса к API
+CARRY_FORWARD = os.getenv("STOCK_CARRY_FORWARD", "1") == "1"
+
+# Документы МойСклад, которые меняют остаток (инвентаризация — через оприходование и списание)
+STOCK_DOCUMENT_TYPES = (
+    "retaildemand", "demand", "supply",
+    "retailsalesreturn", "salesreturn", "purchasereturn",
+    "enter", "loss", "move", "processing",
+)
+
+
+# Функция для пакетной записи остатков за день одной транзакцией
+def save_stock_rows(rows, day=None):
+    ensure_schema()
+
+    def write(conn):
+        if day:
+            # Повторно загруженный день заменяется целиком
+            conn.execute('DELETE FROM stock_data WHERE start_date_str = ?', (day,))
+        before = conn.total_changes
+        # Дубли отсекает уникальный индекс (product_code, start_date_str)
+        conn.executemany('''
+            INSERT OR IGNORE INTO stock_data (product_name, product_code, stock_quantity, start_date_str)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        return conn.total_changes - before
+
+    written = run_write(write)
+    metrics.inc('etl_rows_fetched_total', len(rows), table='stock_data')
+    metrics.inc('etl_rows_written_total', written, table='stock_data')
+    return written
+
+
+# Функция для переноса снимка остатков предыдущего дня на указанный день
+def carry_stock_forward(previous_day, day):
+    ensure_schema()
+
+    def write(conn):
+        conn.execute('DELETE FROM stock_data WHERE start_date_str = ?', (day,))
+        before = conn.total_changes
+        conn.execute('''
+            INSERT OR IGNORE INTO stock_data (product_name, product_code, stock_quantity, start_date_str)
+            SELECT product_name, product_code, stock_quantity, ? FROM stock_data WHERE start_date_str = ?
+        ''', (day, previous_day))
+        return conn.total_changes - before
+
+    written = run_write(write)
+    metrics.inc('etl_rows_written_total', written, table='stock_data_carried')
+    return written
+
+
+# Функция для загрузки всех страниц отчёта об остатках за один день
+def fetch_stock_day(sklad, day):
+    """Возвращает строки с положительным остатком или None, если запрос не удался."""
+    day_rows = []
+    offset = 0
+
+    while True:
+        try:
+            stock_data = sklad.get_stock_all(day, STORE_IDS, limit=1000, offset=offset)
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка при выполнении запроса за {day}: {e}")
+            return None
+
+        rows = stock_data.get('rows', [])
+        if not rows and offset == 0:
+            print(f"Нет данных за {day}")
+
+        for item in rows:
+            product_name = item.get('name', 'Товар не указан')
+            stock_quantity = item.get('stock', 0)
+            product_code = item.get('code', 'Код не указан')
 
-# Путь к базе данных SQLite
-DB_PATH = '/var/data/sales_data.db'
+            if stock_quantity > 0:
+                day_rows.append((product_name, product_code, stock_quantity, day))
 
-username = "admin@bayzak1"
-password = "Pospro2023!"
-headers = {
-    "Content-Type": "application/json"
-}
+        if len(rows) < 1000:
+            return day_rows
+        offset += 1000
 
 
-# Функция для удаления данных из базы начиная с указанной даты
-def clear_stock_data(start_date):
+# Функция для получения дней, по которым снимок уже есть в базе
+def stored_stock_days(start_day):
+    ensure_schema()
+    conn = connect()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        return {row[0] for row in conn.execute(
+            'SELECT DISTINCT start_date_str FROM stock_data WHERE start_date_str >= ?', (start_day,)
+        )}
+    finally:
+        conn.close()
+
 
-        # Удаление всех записей, где start_date_str >= start_date
-        cursor.execute('DELETE FROM stock_data WHERE start_date_str >= ?', (start_date,))
-        conn.commit()
+# Функция для получения дней, в которые в базе есть продажи или приходы
+def active_days(start_day):
+    ensure_schema()
+    conn = connect()
+    try:
+        return {row[0] for row in conn.execute('''
+            SELECT DISTINCT substr(date, 1, 10) FROM sales WHERE date >= ?
+            UNION
+            SELECT DISTINCT substr(date, 1, 10) FROM prihod WHERE date >= ?
+        ''', (start_day, start_day))}
+    finally:
         conn.close()
-        print(f"Удалены записи, начиная с даты {start_date}.")
-    except sqlite3.OperationalError as e:
-        print(f"Ошибка при очистке данных: {e}")
-    except Exception as e:
-        print(f"Неожиданная ошибка при очистке данных: {e}")
 
 
-# Функция для сохранения данных в базу
-def save_to_db(product_name, product_code, stock_quantity, start_date_str):
-    while True:  # Бесконечный цикл для повторных попыток записи
+# Функция для получения дней с любым движением товара по документам МойСклад
+def movement_days(sklad, start_day, document_types=STOCK_DOCUMENT_TYPES):
+    """
+    Даты документов всех типов, меняющих остаток, начиная с start_day.
+    В базе есть только продажи и приходы, а возвраты, списания, перемещения
+    и оприходования по итогам инвентаризации видны только в API.
+    Возвращает None, если хотя бы один тип не загрузился: без полного
+    списка переносить снимок нельзя.
+    """
+    days = set()
+    for entity in document_types:
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS stock_data (
-                        product_name TEXT,
-                        product_code TEXT,
-                        stock_quantity INTEGER,
-                        start_date_str TEXT
-                    )
-                ''')
-
-            # Проверяем, существует ли запись с тем же продуктом и датой
-            cursor.execute('SELECT * FROM stock_data WHERE product_code = ? AND start_date_str = ?',
-                           (product_code, start_date_str))
-            existing = cursor.fetchone()
-
-            if not existing:
-                cursor.execute('''
-                    INSERT INTO stock_data (product_name, product_code, stock_quantity, start_date_str)
-                    VALUES (?, ?, ?, ?)
-                ''', (product_name, product_code, stock_quantity, start_date_str))
-
-            conn.commit()
-            conn.close()
-            break  # Если запись успешна, выходим из цикла
-
-        except sqlite3.OperationalError as e:
-            print(f"Ошибка записи в базу данных: {e}. Повторная попытка...")
-            time.sleep(1)  # Ожидание перед повторной попыткой
-        except Exception as e:
-            print(f"Неожиданная ошибка: {e}. Повторная попытка...")
-            time.sleep(1)  # Ожидание перед повторной попыткой
-
-
-# Основная функция для обработки данных
-def products(start_date_str):
-    # Очистка существующих данных с указанной даты
-    clear_stock_data(start_date_str)
-
-    url = "https://api.moysklad.ru/api/remap/1.2/report/stock/all"
-    store_ids = [
-        "https://api.moysklad.ru/api/remap/1.2/entity/store/09304ed8-2391-11e9-9109-f8fc00017cb5",
-        "https://api.moysklad.ru/api/remap/1.2/entity/store/2e8092ab-71bd-11ef-0a80-0c29000f676c"
-    ]
-
-    current_date = datetime.now()
-    start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
-
-    while start_date <= current_date:
-        last_day_of_month = calendar.monthrange(start_date.year, start_date.month)[1]
-        # Определяем конечный день для текущего месяца (либо last_day_of_month, либо текущая дата)
-        end_day = min(last_day_of_month,
-                      current_date.day) if start_date.month == current_date.month and start_date.year == current_date.year else last_day_of_month
-
-        # Вложенный цикл по дням до end_day
-        for day in range(1, end_day + 1):
-            try:
-                current_day = start_date.replace(day=day)
-            except ValueError:
-                continue  # Пропускаем день, если такой день отсутствует (например, 30-е февраля)
-
-            start_date_str = current_day.strftime("%Y-%m-%d")
-            filter_store = ";".join([f"store={store_id}" for store_id in store_ids])
-            more_data = True
-            offset = 0
-
-            while more_data:
-                params = {
-                    "filter": f"moment={start_date_str};{filter_store}",
-                    "limit": 1000,
-                    "offset": offset
-                }
-                try:
-                    response = requests.get(url, headers=headers, auth=HTTPBasicAuth(username, password), params=params)
-                    response.raise_for_status()
-                except requests.exceptions.RequestException as e:
-                    print(f"Ошибка при выполнении запроса: {e}")
-                    break
-
-                stock_data = response.json()
-
-                if stock_data.get('rows'):
-                    for item in stock_data.get('rows', []):
-                        product_name = item.get('name', 'Товар не указан')
-                        stock_quantity = item.get('stock', 0)
-                        product_code = item.get('code', 'Код не указан')
-
-                        #print(f"Товар: {product_name}")
-                        #print(f"Код товара: {product_code}")
-                        #print(f"Остаток: {stock_quantity}")
-                        #print(f"Дата: {start_date_str}")
-                        #print("-" * 50)
-
-                        if stock_quantity > 0:
-                            save_to_db(product_name, product_code, stock_quantity, start_date_str)
-                else:
-                    print(f"Нет данных за {start_date_str}")
-
-                if len(stock_data.get('rows', [])) < 1000:
-                    more_data = False
-                else:
-                    offset += 1000
-
-        # Переход к следующему месяцу
-        if start_date.month == 12:
-            start_date = start_date.replace(year=start_date.year + 1, month=1, day=1)
+            for item in sklad.iter_documents(entity, ORGANIZATION_URL, f"{start_day} 00:00:00"):
+                days.add(item.get('moment', '')[:10])
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка загрузки документов {entity} для переноса остатков: {e}")
+            return None
+    return days
+
+
+# Функция для планирования: какие дни загрузить из API, а какие перенести
+def plan_stock_days(days, stored, active, refetch_stored=False, carry_forward=CARRY_FORWARD):
+    """
+    Первый и последний день диапазона загружаются всегда: первый — опора для
+    переноса, последний (сегодня) ещё меняется. Отчёт на дату D — это остаток
+    на начало дня, поэтому он отличается от D-1 только при движении в день D-1.
+    """
+    to_fetch, to_carry = [], []
+    for index, day in enumerate(days):
+        if index == 0 or index == len(days) - 1:
+            to_fetch.append(day)
+        elif day in stored and not refetch_stored:
+            continue
+        elif carry_forward and days[index - 1] not in active:
+            to_carry.append(day)
         else:
-            start_date = start_date.replace(month=start_date.month + 1, day=1)
-
-
-# Вспомогательная функция для запуска products с передачей start_date
-def run_products(start_date):
+            to_fetch.append(day)
+    return to_fetch, to_carry
+
+
+# Основная функция для обработки данных. Недостающие дни загружаются
+# параллельно, дни без движения получают снимок предыдущего дня.
+# Возвращает последний день, после которого в истории нет пропусков из-за ошибок.
+def products(start_date_str, workers=EXPORT_WORKERS, refetch_stored=False):
+    sklad = get_client()
+
+    current_date = datetime.now().date()
+    start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
+    days = [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+            for offset in range((current_date - start_date).days + 1)]
+    if not days:
+        return None
+
+    active, carry_forward = active_days(start_date_str), CARRY_FORWARD
+    if carry_forward:
+        with metrics.timer('etl_stage_seconds', stage='stock_movement_days'):
+            moved = movement_days(sklad, start_date_str)
+        if moved is None:
+            carry_forward = False
+        else:
+            active |= moved
+    to_fetch, to_carry = plan_stock_days(days, stored_stock_days(start_date_str), active, refetch_stored,
+                                         carry_forward)
+    print(f"Остатки: загрузка {len(to_fetch)} дн., перенос {len(to_carry)} дн., "
+          f"пропуск {len(days) - len(to_fetch) - len(to_carry)} дн.")
+
+    failed_days = set()
+    with metrics.timer('etl_stage_seconds', stage='stock_fetch_days'), \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch_stock_day, sklad, day): day for day in to_fetch}
+        # Запись идёт в основном потоке по мере готовности дней
+        for future in as_completed(futures):
+            day = futures[future]
+            day_rows = future.result()
+            if day_rows is None:
+                failed_days.add(day)
+                continue
+            save_stock_rows(day_rows, day=day)
+
+    # Перенос идёт по порядку дат, чтобы опираться на уже готовый предыдущий день
+    carry = set(to_carry)
+    with metrics.timer('etl_stage_seconds', stage='stock_carry_forward'):
+        for index, day in enumerate(days):
+            if day not in carry:
+                continue
+            if days[index - 1] in failed_days:
+                failed_days.add(day)
+                continue
+            carry_stock_forward(days[index - 1], day)
+
+    last_synced = None
+    for day in days:
+        if day in failed_days:
+            break
+        last_synced = day
+    return last_synced
+
+
+# Вспомогательная функция для запуска products с передачей start_date.
+# start_date используется при первом запуске (или full=True), дальше загрузка
+# продолжается с последнего сохранённого дня: его снимок мог быть снят до конца дня.
+def run_products(start_date, full=False):
     # Преобразование даты в строку, если она передана как объект datetime
     if isinstance(start_date, datetime):
         start_date_str = start_date.strftime("%Y-%m-%d")
     else:
         start_date_str = start_date
-    products(start_date_str)
-    print('Закончен сбор остатков с даты:' + str(start_date))
+    watermark = None if full else get_watermark('stock')
+    if watermark:
+        start_date_str = watermark
+    last_synced = products(start_date_str, refetch_stored=full)
+    set_watermark('stock', last_synced)
+    with metrics.timer('etl_stage_seconds', stage='stock_summary'):
+        refresh_monthly_summary(months_between(start_date_str))
+    bump_data_version()
+    print('Закончен сбор остатков с даты:' + str(start_date_str))
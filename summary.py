@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from db import DB_PATH, connect, ensure_schema, run_write
+
+# Сводка за месяц: уникальные SKU (остатки ∪ приходы), проданные SKU и выручка.
+# Все выборки идут по диапазону дат, поэтому используют индексы по дате.
+MONTH_SUMMARY_SQL = '''
+    INSERT OR REPLACE INTO monthly_summary (month, sku, sales_sku, revenue, updated_at)
+    SELECT
+        :month,
+        (SELECT COUNT(*) FROM (
+            SELECT product_code FROM stock_data WHERE start_date_str >= :start AND start_date_str < :end
+            UNION
+            SELECT product FROM prihod WHERE date >= :start AND date < :end
+        )),
+        (SELECT COUNT(DISTINCT product) FROM sales WHERE date >= :start AND date < :end),
+        (SELECT COALESCE(SUM(price * quantity), 0) FROM sales WHERE date >= :start AND date < :end),
+        datetime('now')
+    WHERE EXISTS (SELECT 1 FROM stock_data WHERE start_date_str >= :start AND start_date_str < :end)
+'''
+
+
+# Функция для получения первого дня следующего месяца
+def _next_month(month):
+    year, month_number = int(month[:4]), int(month[5:7])
+    if month_number == 12:
+        return f"{year + 1}-01-01"
+    return f"{year}-{month_number + 1:02d}-01"
+
+
+# Функция для получения списка месяцев 'YYYY-MM' от даты start_date до end_date (по умолчанию — сегодня)
+def months_between(start_date, end_date=None):
+    end_month = (end_date or datetime.now().strftime("%Y-%m-%d"))[:7]
+    month = start_date[:7]
+    months = []
+    while month <= end_month:
+        months.append(month)
+        month = _next_month(month)[:7]
+    return months
+
+
+# Функция для пересчёта сводки за указанные месяцы (None — за всю историю)
+def refresh_monthly_summary(months=None, db_path=DB_PATH):
+    ensure_schema(db_path)
+
+    def write(conn):
+        if months is None:
+            # Сводка показывает только месяцы, за которые есть остатки
+            conn.execute('DELETE FROM monthly_summary')
+            selected = [row[0] for row in conn.execute(
+                'SELECT DISTINCT substr(start_date_str, 1, 7) FROM stock_data ORDER BY 1'
+            )]
+        else:
+            selected = sorted(set(months))
+            conn.executemany('DELETE FROM monthly_summary WHERE month = ?', [(month,) for month in selected])
+        conn.executemany(MONTH_SUMMARY_SQL, [
+            {'month': month, 'start': f"{month}-01", 'end': _next_month(month)} for month in selected
+        ])
+        return len(selected)
+
+    refreshed = run_write(write, db_path)
+    print(f"Обновлена помесячная сводка: {refreshed} мес.")
+    return refreshed
+
+
+# Функция для первичного заполнения сводки на базе, где она ещё пуста
+def ensure_monthly_summary(db_path=DB_PATH):
+    ensure_schema(db_path)
+    conn = connect(db_path)
+    try:
+        empty = conn.execute('SELECT 1 FROM monthly_summary LIMIT 1').fetchone() is None
+        has_stock = conn.execute('SELECT 1 FROM stock_data LIMIT 1').fetchone() is not None
+    finally:
+        conn.close()
+    if empty and has_stock:
+        refresh_monthly_summary(db_path=db_path)
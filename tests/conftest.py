@@ -0,0 +1,36 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# Пути модули читают при импорте: база, JSON и блокировка планировщика тестов — во временном каталоге
+WORKDIR = tempfile.mkdtemp(prefix="sclad-tests-")
+os.environ["SALES_DB_PATH"] = os.path.join(WORKDIR, "sales_data.db")
+os.environ["PRODUCTS_JSON_DIR"] = os.path.join(WORKDIR, "products_json")
+os.environ["SCHEDULER_LOCK"] = os.path.join(WORKDIR, "scheduler.lock")
+os.environ["SCHEDULER_ENABLED"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect, ensure_schema  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "sales_data.db")
+    ensure_schema(path)
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = connect(db_path)
+    yield conn
+    conn.close()
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -0,0 +1,49 @@
+from datetime import date
+
+import numpy as np
+
+from analytics import AnalyticsData, abc_xyz_matrix, compute_metrics, query_skus
+
+TODAY = date(2026, 10, 18)
+DAYS = 84
+
+
+def analytics_data(sales):
+    products = ["Товар без продаж", "Товар ровный", "Товар рваный"]
+    sales = np.array(sales, dtype=np.int64)
+    months = ["2026-07", "2026-08", "2026-09", "2026-10"]
+    revenue = sales.reshape(len(products), 4, 21).sum(axis=2).astype(np.float64) * 100
+    zeros = np.zeros((len(products), len(months)))
+    return AnalyticsData(products, months, [0, 21, 42, 63], date(2026, 7, 26), TODAY, 1, sales, revenue,
+                         zeros, zeros + 10, zeros + 10, np.array([10.0, 10.0, 10.0]))
+
+
+def sample():
+    erratic = [0] * DAYS
+    erratic[5], erratic[60] = 40, 30
+    return analytics_data([[0] * DAYS, [2] * DAYS, erratic])
+
+
+def test_product_without_sales_has_no_xyz_class():
+    metrics = compute_metrics(sample(), months=4)
+
+    assert np.isnan(metrics["cv"][0])
+    assert list(metrics["xyz"]) == ["-", "X", "Z"]
+
+
+def test_xyz_filter_skips_products_without_demand():
+    data = sample()
+
+    erratic = query_skus(months=4, xyz="Z", data=data)
+    everything = query_skus(months=4, data=data)
+
+    assert [item["product_name"] for item in erratic["items"]] == ["Товар рваный"]
+    assert query_skus(months=4, xyz="-", data=data)["total"] == 0
+    assert {item["product_name"]: item["xyz"] for item in everything["items"]}["Товар без продаж"] is None
+
+
+def test_matrix_counts_products_without_demand_separately():
+    result = abc_xyz_matrix(months=4, data=sample())
+
+    assert sum(cell["sku"] for cell in result["cells"].values()) == 2
+    assert result["no_demand"]["sku"] == 1
@@ -0,0 +1,63 @@
+from db import delete_document_rows, delete_missing_documents, document_rows
+
+
+def insert(conn, documents):
+    conn.executemany("""
+        INSERT INTO sales (document_number, date, seller, product, quantity, price, document_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, list(document_rows(documents)))
+
+
+def stored(conn):
+    return sorted(conn.execute("SELECT document_number, date, product, quantity FROM sales"))
+
+
+def position(product, quantity=1):
+    return {"product": product, "quantity": quantity, "price": 100}
+
+
+def test_changed_document_keeps_other_documents_with_the_same_number(conn):
+    # Розничная нумерация начинается заново: номер 00001 у двух разных чеков
+    insert(conn, [
+        ("00001", "2025-03-02 10:00:00", "Продавец", [position("Товар A")], "id-2025"),
+        ("00001", "2026-03-02 10:00:00", "Продавец", [position("Товар B")], "id-2026"),
+    ])
+    touched = set()
+    changed = [("00001", "2026-04-01 09:00:00", "Продавец", [position("Товар B", 3)], "id-2026")]
+    with conn:
+        delete_document_rows(conn, "sales", changed, touched)
+        insert(conn, changed)
+
+    assert stored(conn) == [
+        ("00001", "2025-03-02 10:00:00", "Товар A", 1),
+        ("00001", "2026-04-01 09:00:00", "Товар B", 3),
+    ]
+    assert touched == {"2026-03"}
+
+
+def test_rows_written_before_document_ids_match_by_number_and_date(conn):
+    conn.executemany("INSERT INTO sales (document_number, date, seller, product, quantity, price) "
+                     "VALUES (?, ?, 'Продавец', ?, 1, 100)",
+                     [("00002", "2026-03-05 12:00:00", "Товар C"), ("00002", "2025-03-05 12:00:00", "Товар D")])
+    changed = [("00002", "2026-03-05 12:00:00", "Продавец", [position("Товар C", 2)], "id-c")]
+    with conn:
+        delete_document_rows(conn, "sales", changed)
+        insert(conn, changed)
+
+    assert stored(conn) == [
+        ("00002", "2025-03-05 12:00:00", "Товар D", 1),
+        ("00002", "2026-03-05 12:00:00", "Товар C", 2),
+    ]
+
+
+def test_reconcile_removes_only_documents_missing_by_id(db_path, conn):
+    insert(conn, [
+        ("00003", "2026-03-10 10:00:00", "Продавец", [position("Товар E")], "id-kept"),
+        ("00003", "2026-03-11 10:00:00", "Продавец", [position("Товар F")], "id-deleted"),
+    ])
+    conn.commit()
+
+    removed = delete_missing_documents("sales", [("id-kept", "00003")], "2026-03-01 00:00:00", db_path)
+
+    assert removed == 1
+    assert stored(conn) == [("00003", "2026-03-10 10:00:00", "Товар E", 1)]
@@ -0,0 +1,66 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+
+from gpt_payload import DETAIL_LEVELS, _next_period, build_history_payload
+
+# Четверг: подневный ряд и окно недель начинаются не с понедельника
+TODAY = date(2026, 10, 15)
+
+
+def daily_sales(first_day, today=TODAY):
+    history = []
+    day = first_day
+    while day <= today:
+        history.append({"date": f"{day.isoformat()} 12:00:00", "type": "sales", "quantity": 1, "price": 10,
+                        "stock_after": 100})
+        day += timedelta(days=1)
+    return {"product_name": "Товар 00321", "stock": 100, "history": history}
+
+
+def period_lengths(series):
+    start = date.fromisoformat(series["from"])
+    lengths = []
+    for _ in series["sold"]:
+        following = _next_period(start, series["step"])
+        lengths.append((following - start).days)
+        start = following
+    return series.get("days", lengths), lengths
+
+
+@pytest.mark.parametrize("first_day", [date(2025, 6, 11), date(2026, 2, 25)])
+def test_every_bucket_reports_the_days_it_covers(first_day):
+    data = daily_sales(first_day)
+    payload = json.loads(build_history_payload(data, today=TODAY, token_budget=10 ** 6)[0])
+
+    total = 0
+    for name in ("monthly", "weekly", "daily"):
+        if name not in payload:
+            continue
+        days, _ = period_lengths(payload[name])
+        # Продаём по штуке в день: в периоде продано столько, сколько в нём дней
+        assert payload[name]["sold"] == days
+        total += sum(days)
+    assert total == (TODAY - first_day).days + 1
+
+
+def test_week_tier_holds_only_whole_weeks():
+    payload = json.loads(build_history_payload(daily_sales(date(2025, 6, 11)), today=TODAY,
+                                               token_budget=10 ** 6)[0])
+    weekly = payload["weekly"]
+    assert date.fromisoformat(weekly["from"]).weekday() == 0
+    assert "days" not in weekly
+    assert set(weekly["sold"]) == {7}
+    assert date.fromisoformat(payload["daily"]["from"]).weekday() == 0
+    assert payload["daily"]["from"] <= (TODAY - timedelta(days=DETAIL_LEVELS[0][0] - 1)).isoformat()
+
+
+def test_partial_month_before_weeks_is_marked():
+    payload = json.loads(build_history_payload(daily_sales(date(2025, 6, 11)), today=TODAY,
+                                               token_budget=10 ** 6)[0])
+    days, lengths = period_lengths(payload["monthly"])
+    # История начинается 11 июня, а недели — с понедельника до начала месяца
+    weekly_from = date.fromisoformat(payload["weekly"]["from"])
+    assert days[0] == lengths[0] - 10
+    assert days[-1] == (weekly_from - weekly_from.replace(day=1)).days
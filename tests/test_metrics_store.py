@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+
+from metrics import Registry
+from metrics_store import RETIRED, collect, publish
+
+
+def other_process(conn, pid, registry, process=None):
+    conn.execute("INSERT INTO metric_snapshots (process, pid, state, updated_at) VALUES (?, ?, ?, '')",
+                 (process or f"{pid}-1", pid, json.dumps(registry.state())))
+    conn.commit()
+
+
+def finished_pid():
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    return child.pid
+
+
+def test_scrape_sums_every_worker(db_path, conn):
+    leader = Registry()
+    leader.inc("etl_rows_written_total", 120, table="sales")
+    leader.observe("etl_stage_seconds", 3, stage="sales")
+    other_process(conn, os.getppid(), leader)
+
+    worker = Registry()
+    worker.inc("moysklad_requests_total", endpoint="entity/demand", status=200)
+    worker.inc("etl_rows_written_total", 5, table="sales")
+    publish(worker, db_path)
+
+    text = collect(db_path).render()
+    assert 'etl_rows_written_total{table="sales"} 125' in text
+    assert 'moysklad_requests_total{endpoint="entity/demand",status="200"} 1' in text
+    assert 'etl_stage_seconds_count{stage="sales"} 1' in text
+
+
+def test_finished_worker_counters_do_not_reset(db_path, conn):
+    gone = Registry()
+    gone.inc("db_write_retries_total", 7)
+    other_process(conn, finished_pid(), gone)
+    before = collect(db_path).snapshot()
+
+    publish(Registry(), db_path)
+    publish(Registry(), db_path)
+
+    assert collect(db_path).snapshot() == before
+    processes = [row[0] for row in conn.execute("SELECT process FROM metric_snapshots")]
+    assert RETIRED in processes and len(processes) == 2
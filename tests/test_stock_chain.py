@@ -0,0 +1,64 @@
+import requests
+
+import stock_actual
+from stock_actual import STOCK_DOCUMENT_TYPES, movement_days, plan_stock_days
+
+DAYS = ["2026-10-01", "2026-10-02", "2026-10-03", "2026-10-04", "2026-10-05"]
+
+
+class FakeSklad:
+    def __init__(self, documents, failing=()):
+        self.documents = documents
+        self.failing = failing
+        self.requested = []
+
+    def iter_documents(self, entity, organization_url, start_date, field='moment', limit=1000):
+        self.requested.append(entity)
+        if entity in self.failing:
+            raise requests.exceptions.ConnectionError("timeout")
+        yield from self.documents.get(entity, [])
+
+
+def test_chain_runs_stock_after_sales_and_receipts():
+    import my_sclad_api
+
+    scheduler = my_sclad_api.scheduler
+    order = []
+    for job in scheduler.jobs.values():
+        job.func = lambda name=job.name: order.append(name)
+
+    assert scheduler.run_job("sales", trigger="test") == "success"
+    assert order == ["sales", "prihod", "stock", "json", "forecasts"]
+
+
+def test_movement_covers_every_stock_document_type():
+    sklad = FakeSklad({
+        "loss": [{"moment": "2026-10-02 18:00:00.000"}],
+        "salesreturn": [{"moment": "2026-10-03 10:00:00.000"}],
+    })
+
+    assert movement_days(sklad, "2026-10-01") == {"2026-10-02", "2026-10-03"}
+    assert set(sklad.requested) == set(STOCK_DOCUMENT_TYPES)
+    assert {"retaildemand", "supply", "move", "enter", "loss"} <= set(STOCK_DOCUMENT_TYPES)
+
+
+def test_write_off_day_is_fetched_not_carried():
+    active = {"2026-10-01"} | movement_days(FakeSklad({"loss": [{"moment": "2026-10-03 18:00:00"}]}), DAYS[0])
+
+    to_fetch, to_carry = plan_stock_days(DAYS, set(), active)
+
+    # Остаток на 04-е — после списания 03-го
+    assert "2026-10-04" in to_fetch
+    assert to_carry == ["2026-10-03"]
+
+
+def test_no_carry_forward_without_the_full_movement_list(monkeypatch):
+    saved = []
+    monkeypatch.setattr(stock_actual, "get_client", lambda: FakeSklad({}, failing=("move",)))
+    monkeypatch.setattr(stock_actual, "fetch_stock_day", lambda sklad, day: [])
+    monkeypatch.setattr(stock_actual, "save_stock_rows", lambda rows, day=None: saved.append(day))
+    monkeypatch.setattr(stock_actual, "carry_stock_forward", lambda previous_day, day: saved.append(("carry", day)))
+
+    stock_actual.products("2026-10-01")
+
+    assert saved and all(not isinstance(day, tuple) for day in saved)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+from transactions import query_transactions
+
+DATE_FILTER = {"date_from": "2026-02-01", "date_to": "2026-05-31"}
+
+
+def fill_sales(conn, days=180, per_day=50):
+    start = datetime(2026, 1, 1)
+    rows = []
+    for day in range(days):
+        for n in range(per_day):
+            moment = start + timedelta(days=day, minutes=10 * n)
+            rows.append((f"{day:04d}-{n:03d}", moment.strftime("%Y-%m-%d %H:%M:%S"), f"Продавец {n % 3}",
+                         f"Товар {n % 20:05d}", 1, 100))
+    conn.executemany("INSERT INTO sales (document_number, date, seller, product, quantity, price) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+
+def page_steps(conn, args, order, cursor, limit=50):
+    # Число инструкций виртуальной машины SQLite — сколько строк индекса прошёл запрос
+    steps = [0]
+
+    def count():
+        steps[0] += 1
+
+    conn.set_progress_handler(count, 1)
+    try:
+        page = query_transactions(conn, "sales", args, limit, order, cursor)
+    finally:
+        conn.set_progress_handler(None, 1)
+    return page, steps[0]
+
+
+def all_pages(conn, args, order, limit=50):
+    cursor, items = None, []
+    while True:
+        page = query_transactions(conn, "sales", args, limit, order, cursor)
+        items += page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return items
+
+
+def test_pages_with_date_filter_match_plain_query(conn):
+    fill_sales(conn)
+    for order in ("desc", "asc"):
+        expected = conn.execute(f"""
+            SELECT document_number FROM sales WHERE date >= '2026-02-01' AND date < '2026-06-01'
+            ORDER BY date {order}, rowid {order}
+        """).fetchall()
+        got = [item["document_number"] for item in all_pages(conn, DATE_FILTER, order)]
+        assert got == [row[0] for row in expected]
+
+
+def test_deep_page_with_date_filter_seeks_from_cursor(conn):
+    fill_sales(conn)
+    for order in ("desc", "asc"):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        first, first_steps = page_steps(conn, DATE_FILTER, order, None)
+        cursor = first["next_cursor"]
+        for _ in range(80):
+            cursor = query_transactions(conn, "sales", DATE_FILTER, 50, order, cursor)["next_cursor"]
+        statements.clear()
+        _, deep_steps = page_steps(conn, DATE_FILTER, order, cursor)
+        conn.set_trace_callback(None)
+
+        plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statements[-1]))
+        assert "USING INDEX ix_sales_date" in plan
+        assert "TEMP B-TREE" not in plan
+        # Без слияния курсора с границей периода страница 80 проходила бы
+        # все 4000 строк от date_to / date_from до курсора
+        assert deep_steps < first_steps * 2
@@ -0,0 +1,60 @@
+from export_stream import EXPORT_TABLES, date_bounds, party_filters
+from pagination import decode_cursor, encode_cursor
+
+# Таблицы операций, которые можно листать через /sales и /prihod
+TRANSACTION_TABLES = ("sales", "prihod")
+
+
+# Функция для страницы операций с фильтрами и курсором по (дата, rowid)
+def query_transactions(conn, name, args, limit, order="desc", cursor=None):
+    """
+    Фильтры — как у /export: date_from, date_to, product, seller / supplier.
+    Ключ страницы — (date, rowid): дата задаёт порядок, rowid делает ключ
+    уникальным. Дата курсора заменяет границу периода, если она уже:
+    поиск по индексу (товар, дата), (продавец / поставщик, дата) или (дата)
+    начинается сразу с курсора, а не с date_to / date_from, поэтому дальняя
+    страница отвечает так же быстро, как первая, и с фильтром по датам.
+    Возвращает {"items": [...], "next_cursor": ...}.
+    """
+    if name not in TRANSACTION_TABLES:
+        raise KeyError(name)
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+
+    spec = EXPORT_TABLES[name]
+    lower, upper = date_bounds(args)
+    key = decode_cursor(cursor)
+    if key and (len(key) != 2 or not isinstance(key[0], str) or not isinstance(key[1], int)):
+        raise ValueError("invalid cursor")
+
+    conditions, params = [], []
+    if lower and not (key and order == "asc" and key[0] >= lower):
+        conditions.append("date >= ?")
+        params.append(lower)
+    if upper and not (key and order == "desc" and key[0] < upper):
+        conditions.append("date < ?")
+        params.append(upper)
+    if key:
+        # Граница по дате курсора задаёт начало поиска по индексу,
+        # сравнение (date, rowid) отсекает уже отданные строки той же даты
+        conditions.append("date <= ?" if order == "desc" else "date >= ?")
+        params.append(key[0])
+        conditions.append(f"(date, rowid) {'<' if order == 'desc' else '>'} (?, ?)")
+        params.extend(key)
+    party_conditions, party_params = party_filters(spec, args)
+    conditions += party_conditions
+    params += party_params
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = conn.execute(f'''
+        SELECT rowid, {', '.join(spec['columns'])} FROM {spec['table']}
+        {where}
+        ORDER BY date {order}, rowid {order}
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+
+    items = [dict(zip(spec["columns"], row[1:])) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor((items[-1]["date"], rows[limit - 1][0]))
+    return {"items": items, "next_cursor": next_cursor}